@@ -1,8 +1,39 @@
+import time
 from neo4j import GraphDatabase 
+from neo4j.exceptions import TransientError, ServiceUnavailable, SessionExpired, Neo4jError
 
 NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "test1234" 
+
+# BulkWriter defaults: rows per UNWIND batch, its adaptive bounds and the commit latency it aims for.
+BULK_BATCH_SIZE = 5000
+BULK_MIN_BATCH_SIZE = 100
+BULK_MAX_BATCH_SIZE = 50000
+BULK_TARGET_COMMIT_SECONDS = 2.0
+BULK_MAX_RETRIES = 5
+
+# Lookup keys the importers MATCH/MERGE on: (name, label, property).
+SCHEMA_UNIQUE_CONSTRAINTS = [
+    ('microrna_name_unique', 'microRNA', 'name'),
+    ('microrna_accession_unique', 'microRNA', 'accession'),
+]
+# Target keys are not unique: importers key Targets on ens_code or geneid and may leave the other empty.
+SCHEMA_RANGE_INDEXES = [
+    ('target_ens_code', 'Target', 'ens_code'),
+    ('target_geneid', 'Target', 'geneid'),
+    ('target_name', 'Target', 'name'),
+    ('pathway_id', 'Pathway', 'id'),
+    ('db_info_name', 'DB_info', 'name'),
+    ('relation_info_name', 'Relation_general_info', 'name'),
+]
+# For the backend's substring (CONTAINS / STARTS WITH) searches by name.
+SCHEMA_TEXT_INDEXES = [
+    ('microrna_name_text', 'microRNA', 'name'),
+    ('target_name_text', 'Target', 'name'),
+]
+SCHEMA_AWAIT_SECONDS = 300
+_schema_ensured = False
 _driver = None
 
 def get_driver():
@@ -23,6 +54,56 @@ def db_connect():
     """
     return get_driver().session()
 
+def ensure_schema(await_seconds=SCHEMA_AWAIT_SECONDS):
+    """
+    Idempotently creates the uniqueness constraints, range and text indexes for every
+    lookup key, waits up to await_seconds for them to come online and prints any index
+    still populating. A uniqueness constraint the existing data violates is replaced by
+    a range index (with a warning) so importers keep working on an unclean graph; once the
+    data has no duplicates, a later run swaps that index for the constraint. Runs once per process.
+    """
+    global _schema_ensured
+    if _schema_ensured:
+        return
+    with get_driver().session() as session:
+        existing_constraints = {record['name'] for record in session.run("SHOW CONSTRAINTS YIELD name RETURN name")}
+        for name, label, prop in SCHEMA_UNIQUE_CONSTRAINTS:
+            if name in existing_constraints:
+                continue
+            duplicate = session.run(f"MATCH (n:{label}) WHERE n.{prop} IS NOT NULL "
+                                    f"WITH n.{prop} AS value, count(*) AS node_count WHERE node_count > 1 "
+                                    f"RETURN value LIMIT 1").single()
+            if duplicate is not None:
+                print(f"Schema: :{label}({prop}) has duplicate values (e.g. {duplicate['value']!r}); "
+                      f"using a range index. Deduplicate the data to enable the unique constraint.")
+                session.run(f"CREATE INDEX {name}_range IF NOT EXISTS FOR (n:{label}) ON (n.{prop})").consume()
+                continue
+            # the data is clean; Neo4j refuses the constraint while the fallback index of an earlier run exists
+            session.run(f"DROP INDEX {name}_range IF EXISTS").consume()
+            try:
+                session.run(f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE").consume()
+            except Neo4jError as e:
+                print(f"Schema: Could not create unique constraint on :{label}({prop}) ({e.code}); "
+                      f"falling back to a range index.")
+                session.run(f"CREATE INDEX {name}_range IF NOT EXISTS FOR (n:{label}) ON (n.{prop})").consume()
+        for name, label, prop in SCHEMA_RANGE_INDEXES:
+            session.run(f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})").consume()
+        for name, label, prop in SCHEMA_TEXT_INDEXES:
+            session.run(f"CREATE TEXT INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})").consume()
+
+        try:
+            session.run("CALL db.awaitIndexes($timeout)", timeout=await_seconds).consume()
+        except Neo4jError as e:
+            print(f"Schema: Indexes not online after {await_seconds}s ({e.code}); continuing while they populate.")
+        pending_count = 0
+        for record in session.run("SHOW INDEXES YIELD name, state, populationPercent WHERE state <> 'ONLINE' "
+                                  "RETURN name, state, populationPercent"):
+            pending_count += 1
+            print(f"Schema: Index {record['name']} is {record['state']} ({record['populationPercent']:.1f}% populated).")
+        if pending_count == 0:
+            print("Schema: All constraints and indexes are ONLINE.")
+    _schema_ensured = True
+
 def create_db_info(name, link):
     """
     Create, if it does not exist, a DB_info node.
@@ -54,4 +135,134 @@ def create_relation_info(name, source_db_link, min_value, max_value, cut_off):
                 r.min_value = $min_value_val,
                 r.max_value = $max_value_val,
                 r.cut_off = $cut_off_val
-        """, params)
\ No newline at end of file
+        """, params)
+
+class BulkWriter:
+    """
+    Buffers node/relationship upserts per Cypher template and writes each buffer as
+    `UNWIND $rows AS row <template>` inside a managed write transaction.
+
+    Templates are flushed in the order of templates, then in the order other templates were
+    first used. Pass the node upsert templates before the relationship templates that MATCH
+    them: a node template that is only used for some rows (new targets) would otherwise be
+    registered after the relationship template and its nodes committed too late, with the
+    relationships silently not created. A flush of all buffers
+    happens once any buffer holds batch_size rows. The batch size then adapts to commit
+    latency: halved when a commit takes longer than target_commit_seconds, grown by half
+    when it is well under. Transient errors are retried with backoff (on top of the
+    driver's own retries); a batch that keeps failing is split in half before the error is raised.
+    on_flush, if given, is called after every flush that wrote rows.
+
+    Usage:
+        with BulkWriter(templates=(TARGET_UPSERT_TEMPLATE, RELATION_UPSERT_TEMPLATE)) as writer:
+            writer.add(TARGET_UPSERT_TEMPLATE, {...})
+            writer.add(RELATION_UPSERT_TEMPLATE, {...})
+    """
+
+    def __init__(self, session=None, batch_size=BULK_BATCH_SIZE, min_batch_size=BULK_MIN_BATCH_SIZE,
+                 max_batch_size=BULK_MAX_BATCH_SIZE, target_commit_seconds=BULK_TARGET_COMMIT_SECONDS,
+                 max_retries=BULK_MAX_RETRIES, on_flush=None, templates=()):
+        self._own_session = session is None
+        self.session = session if session is not None else db_connect()
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_commit_seconds = target_commit_seconds
+        self.max_retries = max_retries
+        self.on_flush = on_flush
+        self._buffers = {template: [] for template in templates}
+        self._counters = {}
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+
+    def add(self, template, row):
+        """Buffers one row for template; flushes every buffer once this one is full."""
+        buffer = self._buffers.setdefault(template, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush()
+
+    def pending_rows(self):
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def flush(self):
+        """Writes all buffered rows, template by template in flush order (see the class docstring)."""
+        flushed = False
+        for template, buffer in self._buffers.items():
+            while buffer:
+                rows = buffer[:self.batch_size]
+                del buffer[:len(rows)]
+                self._write_rows(template, rows)
+                flushed = True
+        if flushed and self.on_flush:
+            self.on_flush()
+
+    def counters(self, template=None):
+        """Summed summary counters (nodes_created, relationships_created, properties_set, ...) of one or all templates."""
+        totals = {}
+        for counted_template, template_counters in self._counters.items():
+            if template is not None and counted_template != template:
+                continue
+            for name, value in template_counters.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def close(self):
+        if self._own_session and self.session is not None:
+            self.session.close()
+            self.session = None
+
+    @staticmethod
+    def _run_unwind(tx, query, rows):
+        return tx.run(query, rows=rows).consume().counters
+
+    def _record_counters(self, template, summary_counters):
+        template_counters = self._counters.setdefault(template, {})
+        for name in ('nodes_created', 'nodes_deleted', 'relationships_created', 'relationships_deleted',
+                     'properties_set', 'labels_added'):
+            template_counters[name] = template_counters.get(name, 0) + getattr(summary_counters, name, 0)
+
+    def _adapt_batch_size(self, elapsed_seconds, row_count):
+        if row_count < self.batch_size:
+            return
+        if elapsed_seconds > self.target_commit_seconds:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        elif elapsed_seconds < self.target_commit_seconds / 4:
+            self.batch_size = min(self.max_batch_size, self.batch_size + self.batch_size // 2)
+
+    def _write_rows(self, template, rows):
+        query = "UNWIND $rows AS row\n" + template
+        last_error = None
+        for attempt in range(self.max_retries):
+            try:
+                start_time = time.time()
+                summary_counters = self.session.execute_write(self._run_unwind, query, rows)
+                self._adapt_batch_size(time.time() - start_time, len(rows))
+                self._record_counters(template, summary_counters)
+                self.rows_written += len(rows)
+                return
+            except (TransientError, ServiceUnavailable, SessionExpired) as e:
+                last_error = e
+                wait_seconds = min(2 ** attempt, 30)
+                print(f"BulkWriter: Transient error writing {len(rows)} rows (attempt {attempt + 1}/{self.max_retries}): {e}. Retrying in {wait_seconds}s...")
+                time.sleep(wait_seconds)
+
+        # A batch that keeps hitting transient errors (lock contention, memory limits) may go
+        # through in smaller pieces; an unreachable database will not.
+        if len(rows) > 1 and isinstance(last_error, TransientError):
+            self.batch_size = min(self.batch_size, max(self.min_batch_size, len(rows) // 2))
+            print(f"BulkWriter: Splitting failed batch of {len(rows)} rows.")
+            half = len(rows) // 2
+            self._write_rows(template, rows[:half])
+            self._write_rows(template, rows[half:])
+            return
+        raise last_error
@@ -1,20 +1,256 @@
 import sys
+import os
+import re
+import hashlib
 import urllib.request
 import urllib.parse
 import time
 import json 
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import urllib3
+import httpcache
 
-def url_request(full_url_str, data_payload=None, method=None, headers=None, max_retries=3, timeout_seconds=30):
+# Upper bound on requests in flight across all callers of the shared pool.
+MAX_CONCURRENT_REQUESTS = 8
+
+# Requests per second allowed per host. Hosts not listed are not throttled.
+# NCBI allows 3 rps without an API key and 10 with one (ncbi.py adjusts this).
+HOST_RATE_LIMITS = {
+    'eutils.ncbi.nlm.nih.gov': 3.0,
+    'rest.ensembl.org': 15.0,
+    'rest.uniprot.org': 10.0,
+    'rest.kegg.jp': 3.0,
+}
+
+# Bytes read per chunk when streaming a download to disk.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Number of distinct hosts whose keep-alive connections are kept open at once.
+CONNECTION_POOL_HOSTS = 20
+
+_host_buckets = {}
+_host_buckets_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+_pool_manager = None
+_pool_manager_lock = threading.Lock()
+
+# Optional on-disk response cache (see configure_response_cache). In replay-only
+# mode url_request never touches the network and cache misses return None.
+_response_cache = None
+REPLAY_ONLY = False
+
+# Follow redirects (UniProt job status answers with 303), but leave every other
+# retry decision to url_request so backoff and logging stay in one place.
+_REDIRECT_ONLY = urllib3.util.Retry(total=None, connect=0, read=0, status=0, other=0,
+                                    redirect=5, raise_on_redirect=False)
+
+
+class _HTTPStatusError(Exception):
+    """Raised for 4xx/5xx responses; mirrors the code/reason/headers of urllib's HTTPError."""
+
+    def __init__(self, code, reason, headers):
+        super().__init__(f"HTTP {code}: {reason}")
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+
+
+class _TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a request may be sent to the host."""
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Holds back every caller of this host, e.g. after a 429."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def _get_pool_manager():
+    """
+    Returns the process-wide urllib3 pool manager. It keeps one pool of persistent
+    (keep-alive) connections per host, sized so every pool worker can hold one.
+    """
+    global _pool_manager
+    with _pool_manager_lock:
+        if _pool_manager is None:
+            proxy_url = urllib.request.getproxies().get('https')
+            if proxy_url:
+                _pool_manager = urllib3.ProxyManager(proxy_url, num_pools=CONNECTION_POOL_HOSTS,
+                                                     maxsize=MAX_CONCURRENT_REQUESTS)
+            else:
+                _pool_manager = urllib3.PoolManager(num_pools=CONNECTION_POOL_HOSTS,
+                                                    maxsize=MAX_CONCURRENT_REQUESTS)
+        return _pool_manager
+
+
+def _send(method, full_url_str, body, headers, timeout_seconds, preload_content=True, decode_content=True):
+    """
+    Sends one request over a pooled connection. gzip/deflate bodies are decoded transparently.
+    Raises _HTTPStatusError for 4xx/5xx responses and urllib3 errors for transport failures.
+    """
+    response = _get_pool_manager().request(method, full_url_str, body=body, headers=headers,
+                                           timeout=timeout_seconds, retries=_REDIRECT_ONLY,
+                                           preload_content=preload_content, decode_content=decode_content)
+    if response.status >= 400:
+        if not preload_content:
+            response.drain_conn()
+            response.release_conn()
+        raise _HTTPStatusError(response.status, response.reason, response.headers)
+    return response
+
+
+def _response_charset(response):
+    charset_match = re.search(r'charset=["\']?([\w.:-]+)', response.headers.get('Content-Type', ''), re.IGNORECASE)
+    return charset_match.group(1) if charset_match else None
+
+
+def set_host_rate(host, requests_per_second):
+    """Sets (or removes, with None) the request rate limit for a host."""
+    with _host_buckets_lock:
+        if requests_per_second:
+            HOST_RATE_LIMITS[host] = float(requests_per_second)
+            bucket = _host_buckets.get(host)
+            if bucket is None or bucket.rate != float(requests_per_second):
+                _host_buckets[host] = _TokenBucket(float(requests_per_second))
+        else:
+            HOST_RATE_LIMITS.pop(host, None)
+            _host_buckets.pop(host, None)
+
+
+def _host_bucket(full_url_str):
+    host = urllib.parse.urlsplit(full_url_str).hostname or ''
+    with _host_buckets_lock:
+        bucket = _host_buckets.get(host)
+        if bucket is None and HOST_RATE_LIMITS.get(host):
+            bucket = _host_buckets[host] = _TokenBucket(HOST_RATE_LIMITS[host])
+        return bucket
+
+
+def _retry_after_seconds(e_http, default_seconds):
+    retry_after = e_http.headers.get('Retry-After') if e_http.headers else None
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return default_seconds
+
+
+def configure_response_cache(cache_file=None, ttl_seconds=httpcache.DEFAULT_TTL_SECONDS,
+                             max_bytes=httpcache.DEFAULT_MAX_BYTES, replay_only=False):
+    """Enables the content-addressed response cache for every url_request call."""
+    global _response_cache, REPLAY_ONLY
+    _response_cache = httpcache.ResponseCache(cache_file or httpcache.DEFAULT_CACHE_FILE, ttl_seconds, max_bytes)
+    REPLAY_ONLY = replay_only
+    print(f"Download: Response cache enabled at {_response_cache.cache_file}"
+          f"{' (replay-only, no network)' if replay_only else ''}.")
+
+
+def configure_from_argv(argv):
+    """
+    Applies and removes the shared download flags from an importer's argv (in place), so
+    positional argument handling is unaffected:
+      --http-cache[=FILE]       cache responses on disk (default ../data/http_cache.sqlite)
+      --http-cache-ttl=SECONDS  expire cached responses after SECONDS (default 30 days)
+      --http-cache-max-mb=MB    evict least recently used responses beyond MB (default 2048)
+      --replay-only             serve strictly from the cache; implies --http-cache
+      --ncbi-offline            answer NCBI lookups from the gene store only (see ncbi_dump.py)
+    """
+    cache_file, enabled, replay_only = None, False, False
+    ttl_seconds, max_bytes = httpcache.DEFAULT_TTL_SECONDS, httpcache.DEFAULT_MAX_BYTES
+    remaining = [argv[0]] if argv else []
+    for arg in argv[1:]:
+        if arg == '--http-cache':
+            enabled = True
+        elif arg.startswith('--http-cache='):
+            enabled, cache_file = True, arg.split('=', 1)[1]
+        elif arg.startswith('--http-cache-ttl='):
+            ttl_seconds = float(arg.split('=', 1)[1])
+        elif arg.startswith('--http-cache-max-mb='):
+            max_bytes = int(float(arg.split('=', 1)[1]) * 1024 * 1024)
+        elif arg == '--replay-only':
+            enabled, replay_only = True, True
+        elif arg == '--ncbi-offline':
+            import ncbi  # ncbi imports this module
+            ncbi.OFFLINE_ONLY = True
+        else:
+            remaining.append(arg)
+    argv[:] = remaining
+    if enabled:
+        configure_response_cache(cache_file, ttl_seconds, max_bytes, replay_only)
+    return argv
+
+
+def get_executor():
+    """
+    Returns the shared bounded thread pool used for concurrent requests.
+    Tasks running in it may call url_request, but must not wait on other tasks of the pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS, thread_name_prefix='download')
+        return _executor
+
+
+def submit_url_request(full_url_str, *args, **kwargs):
+    """Queues url_request on the shared pool and returns a Future of its result."""
+    return get_executor().submit(url_request, full_url_str, *args, **kwargs)
+
+
+def url_request_many(request_list):
+    """
+    Runs many url_request calls concurrently (bounded by MAX_CONCURRENT_REQUESTS and the
+    per-host rate limits) and returns their results in the order of request_list.
+    Each item is either a URL string or a dict of url_request keyword arguments.
+    """
+    futures = []
+    for request_item in request_list:
+        if isinstance(request_item, dict):
+            futures.append(get_executor().submit(url_request, **request_item))
+        else:
+            futures.append(submit_url_request(request_item))
+    return [future.result() for future in futures]
+
+
+def url_request(full_url_str, data_payload=None, method=None, headers=None, max_retries=3, timeout_seconds=30, use_cache=True, response_headers=None):
     """
     Performs an HTTP URL request and returns the decoded text content.
     Handles GET (default) or POST.
+    Successful responses go through the response cache when one is configured; pass
+    use_cache=False for requests whose answer changes over time (e.g. job status polling).
+    If response_headers is a dict, it is filled with the headers of a response fetched from the network.
     If data_payload is a dict for POST, it will be urlencoded by default unless Content-Type is application/json.
     If you need to send JSON, set headers={'Content-Type': 'application/json'} 
     and pass json.dumps(data_payload).encode('utf-8') as data_payload (making it bytes).
     """
     effective_headers = { 
         'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:45.0) Gecko/20100101 Firefox/45.0',
-        'Accept-Charset': 'utf-8' 
+        'Accept-Charset': 'utf-8',
+        'Accept-Encoding': 'gzip, deflate'
     }
     if headers: 
         effective_headers.update(headers)
@@ -50,19 +286,36 @@ def url_request(full_url_str, data_payload=None, method=None, headers=None, max_
     if final_method is None: 
         final_method = "GET"
 
+    cache_key = None
+    if _response_cache is not None and use_cache:
+        cache_key = httpcache.request_key(final_method, full_url_str, encoded_data_for_post)
+        cached_text = _response_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+    if REPLAY_ONLY:
+        print(f"Download: Replay-only mode, no cached response for URL: {full_url_str}")
+        return None
+
+    host_bucket = _host_bucket(full_url_str)
+
     retry_count = 0
     while retry_count < max_retries:
+        if host_bucket: host_bucket.acquire()
         try:
-            req = urllib.request.Request(full_url_str, data=encoded_data_for_post, headers=effective_headers, method=final_method)
-            with urllib.request.urlopen(req, timeout=timeout_seconds) as response:
-                response_bytes = response.read()
-                charset = response.headers.get_content_charset() or 'utf-8'
-                try:
-                    return response_bytes.decode(charset)
-                except UnicodeDecodeError:
-                    print(f"Download: UnicodeDecodeError with charset {charset}, trying 'latin-1' for URL: {full_url_str}")
-                    return response_bytes.decode('latin-1', errors='replace') 
-        except urllib.error.HTTPError as e_http:
+            response = _send(final_method, full_url_str, encoded_data_for_post, effective_headers, timeout_seconds)
+            response_bytes = response.data
+            if response_headers is not None:
+                response_headers.update(response.headers)
+            charset = _response_charset(response) or 'utf-8'
+            try:
+                response_text = response_bytes.decode(charset)
+            except (UnicodeDecodeError, LookupError):
+                print(f"Download: UnicodeDecodeError with charset {charset}, trying 'latin-1' for URL: {full_url_str}")
+                response_text = response_bytes.decode('latin-1', errors='replace') 
+            if cache_key is not None:
+                _response_cache.put(cache_key, full_url_str, response_text)
+            return response_text
+        except _HTTPStatusError as e_http:
             print(f"Download: HTTP Error {e_http.code}: {e_http.reason} for URL: {full_url_str}")
             if e_http.code == 400: 
                 print("Download: Received 400 Bad Request. URL or parameters likely malformed or ID not found by API for this endpoint.")
@@ -71,15 +324,16 @@ def url_request(full_url_str, data_payload=None, method=None, headers=None, max_
             if e_http.code == 404: print("Download: Received 404 Not Found."); return None
             if e_http.code == 429: print("Download: Received 429 Too Many Requests. API rate limit likely hit.")
             if e_http.code == 429 and retry_count < max_retries -1 : 
-                wait_time = 5 * (retry_count + 1) 
+                wait_time = _retry_after_seconds(e_http, 5 * (retry_count + 1))
                 print(f"Download: Waiting {wait_time}s before retry for 429 error...")
-                time.sleep(wait_time) 
+                if host_bucket: host_bucket.pause(wait_time)
+                else: time.sleep(wait_time) 
             elif e_http.code >= 500: 
                 pass 
             else: 
                 return None
-        except urllib.error.URLError as e_url: 
-            print(f"Download: URL Error: {e_url.reason} for URL: {full_url_str}")
+        except urllib3.exceptions.HTTPError as e_url: 
+            print(f"Download: URL Error: {getattr(e_url, 'reason', None) or e_url} for URL: {full_url_str}")
         except Exception as e_general: 
             print(f"Download: General error for URL {full_url_str}: {type(e_general).__name__} - {e_general}")
         
@@ -91,4 +345,205 @@ def url_request(full_url_str, data_payload=None, method=None, headers=None, max_
         else:
             print(f"Download: Max retries reached for URL: {full_url_str}")
             
-    return None 
\ No newline at end of file
+    return None
+
+
+def _next_page_url(response_headers):
+    """Extracts the rel="next" target of an RFC 8288 Link header, or None."""
+    for header_name, header_value in response_headers.items():
+        if header_name.lower() != 'link':
+            continue
+        for link in header_value.split(','):
+            link_match = re.match(r'\s*<([^>]+)>\s*;.*rel="?next"?', link)
+            if link_match:
+                return link_match.group(1)
+    return None
+
+
+def iter_url_pages(full_url_str, headers=None, timeout_seconds=60):
+    """
+    Yields the text of each page of a paginated API result, following Link rel="next" headers.
+    Pages are not cached. If a page cannot be fetched, None is yielded and iteration stops,
+    so callers can tell a complete result from a truncated one.
+    """
+    next_url = full_url_str
+    while next_url:
+        page_headers = {}
+        page_text = url_request(next_url, None, method="GET", headers=headers, timeout_seconds=timeout_seconds,
+                                use_cache=False, response_headers=page_headers)
+        yield page_text
+        if page_text is None:
+            return
+        next_url = _next_page_url(page_headers)
+
+
+def _read_json_file(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f_json:
+            return json.load(f_json)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_json_file(file_path, data):
+    with open(file_path, 'w', encoding='utf-8') as f_json:
+        json.dump(data, f_json, indent=2)
+
+
+def file_checksum(file_path, algorithm='sha256'):
+    """Hex digest of a file, read in DOWNLOAD_CHUNK_SIZE chunks."""
+    digest = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f_in:
+        for chunk in iter(lambda: f_in.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cached_file_intact(dest_path, dest_meta, checksum):
+    """
+    Whether the file kept from the last download still matches its metadata: its recorded size
+    and every digest known for it (checksum and the ones recorded in the metadata).
+    """
+    if dest_meta.get('size') is not None and os.path.getsize(dest_path) != dest_meta['size']:
+        print(f"Download: '{dest_path}' is {os.path.getsize(dest_path)} bytes, {dest_meta['size']} were downloaded.")
+        return False
+    digests = {algorithm: dest_meta[algorithm] for algorithm in hashlib.algorithms_guaranteed if dest_meta.get(algorithm)}
+    if checksum:
+        digests[checksum[0]] = checksum[1]
+    for algorithm, expected_digest in digests.items():
+        actual_digest = file_checksum(dest_path, algorithm)
+        if actual_digest.lower() != expected_digest.lower():
+            print(f"Download: {algorithm} mismatch for '{dest_path}' (expected {expected_digest}, got {actual_digest}).")
+            return False
+    return True
+
+
+def download_to_file(full_url_str, dest_path, checksum=None, headers=None, max_retries=5, timeout_seconds=60):
+    """
+    Streams a (possibly multi-gigabyte) file to dest_path without holding it in memory.
+
+    - Interrupted transfers are kept in dest_path + '.part' and resumed with an HTTP Range request.
+    - The ETag/Last-Modified of the last download are kept in dest_path + '.meta.json'; if the
+      server answers the conditional request with 304, the existing file is kept once it still has
+      the recorded size and checksum, and downloaded again otherwise.
+    - checksum, if given, is (algorithm, hexdigest), e.g. ('md5', '...'); a mismatch discards the download.
+
+    Returns dest_path on success (downloaded or unchanged), None on failure.
+    """
+    part_path = dest_path + '.part'
+    meta_path = dest_path + '.meta.json'
+    part_meta_path = part_path + '.json'
+    dest_dir = os.path.dirname(dest_path)
+    if dest_dir:
+        os.makedirs(dest_dir, exist_ok=True)
+
+    base_headers = {
+        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:45.0) Gecko/20100101 Firefox/45.0',
+        # Raw bytes are required for byte ranges and checksums to line up.
+        'Accept-Encoding': 'identity',
+    }
+    if headers:
+        base_headers.update(headers)
+
+    host_bucket = _host_bucket(full_url_str)
+    retry_count = 0
+    while retry_count < max_retries:
+        request_headers = dict(base_headers)
+        dest_meta = _read_json_file(meta_path)
+        if os.path.exists(dest_path) and dest_meta and dest_meta.get('url') == full_url_str:
+            if dest_meta.get('etag'): request_headers['If-None-Match'] = dest_meta['etag']
+            if dest_meta.get('last_modified'): request_headers['If-Modified-Since'] = dest_meta['last_modified']
+
+        part_meta = _read_json_file(part_meta_path)
+        resume_from = 0
+        if os.path.exists(part_path) and part_meta and part_meta.get('url') == full_url_str:
+            resume_from = os.path.getsize(part_path)
+            validator = part_meta.get('etag') or part_meta.get('last_modified')
+            if resume_from and validator:
+                request_headers['Range'] = f"bytes={resume_from}-"
+                request_headers['If-Range'] = validator
+            else:
+                resume_from = 0
+
+        if host_bucket: host_bucket.acquire()
+        try:
+            response = _send("GET", full_url_str, None, request_headers, timeout_seconds,
+                             preload_content=False, decode_content=False)
+            try:
+                if response.status == 304:
+                    if _cached_file_intact(dest_path, dest_meta, checksum):
+                        print(f"Download: '{dest_path}' is up to date (not modified on server).")
+                        return dest_path
+                    print(f"Download: Discarding the damaged '{dest_path}' and downloading it again.")
+                    os.remove(dest_path)
+                    os.remove(meta_path)
+                    continue
+
+                if response.status == 206 and resume_from:
+                    print(f"Download: Resuming '{dest_path}' at byte {resume_from}...")
+                    file_mode = 'ab'
+                else:
+                    resume_from = 0
+                    file_mode = 'wb'
+                    _write_json_file(part_meta_path, {
+                        'url': full_url_str,
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                    })
+
+                total_size = response.headers.get('Content-Length')
+                total_size = int(total_size) + resume_from if total_size and total_size.isdigit() else None
+                bytes_written = resume_from
+                next_report = bytes_written + 100 * DOWNLOAD_CHUNK_SIZE
+                with open(part_path, file_mode) as f_part:
+                    for chunk in response.stream(DOWNLOAD_CHUNK_SIZE):
+                        f_part.write(chunk)
+                        bytes_written += len(chunk)
+                        if bytes_written >= next_report:
+                            progress = f" of {total_size // (1024 * 1024)}" if total_size else ""
+                            print(f"Download: {bytes_written // (1024 * 1024)}{progress} MB of '{os.path.basename(dest_path)}'...")
+                            next_report = bytes_written + 100 * DOWNLOAD_CHUNK_SIZE
+                if total_size is not None and bytes_written < total_size:
+                    raise urllib3.exceptions.ProtocolError(f"connection closed after {bytes_written} of {total_size} bytes")
+            finally:
+                response.release_conn()
+
+            if checksum:
+                algorithm, expected_digest = checksum
+                actual_digest = file_checksum(part_path, algorithm)
+                if actual_digest.lower() != expected_digest.lower():
+                    print(f"Download: {algorithm} mismatch for '{dest_path}' (expected {expected_digest}, got {actual_digest}). Discarding.")
+                    os.remove(part_path)
+                    os.remove(part_meta_path)
+                    return None
+
+            finished_meta = _read_json_file(part_meta_path) or {'url': full_url_str}
+            finished_meta['size'] = os.path.getsize(part_path)
+            finished_meta['downloaded_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            if checksum: finished_meta[checksum[0]] = checksum[1].lower()
+            os.replace(part_path, dest_path)
+            _write_json_file(meta_path, finished_meta)
+            os.remove(part_meta_path)
+            print(f"Download: Saved '{dest_path}' ({finished_meta['size']} bytes).")
+            return dest_path
+        except _HTTPStatusError as e_http:
+            print(f"Download: HTTP Error {e_http.code}: {e_http.reason} for URL: {full_url_str}")
+            if e_http.code == 416 and resume_from:
+                print("Download: Server rejected the resume range; restarting from scratch.")
+                os.remove(part_path)
+            elif e_http.code == 429:
+                wait_time = _retry_after_seconds(e_http, 5 * (retry_count + 1))
+                if host_bucket: host_bucket.pause(wait_time)
+                else: time.sleep(wait_time)
+            elif e_http.code < 500:
+                return None
+        except (urllib3.exceptions.HTTPError, OSError) as e_transfer:
+            print(f"Download: Transfer of {full_url_str} interrupted: {e_transfer}")
+
+        retry_count += 1
+        if retry_count < max_retries:
+            print(f"Download: Retrying ({retry_count}/{max_retries})...")
+            time.sleep(min(2 ** (retry_count - 1), 30))
+        else:
+            print(f"Download: Max retries reached for URL: {full_url_str}. Partial data kept in '{part_path}'.")
+    return None
@@ -1,27 +1,19 @@
 import json
-import os
 import urllib.parse 
+import genestore
+import download
 from download import url_request 
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data'))
-ENSEMBL_CACHE_DIR = BASE_DATA_DIR 
-ENSEMBL_CACHE_FILE = os.path.join(ENSEMBL_CACHE_DIR, 'ensembl_gene_cache.dat') 
-
-ENSEMBL_LOOKUP_URL_TEMPLATE = "https://rest.ensembl.org/lookup/id/{}?expand=xrefs&content-type=application/json"
-
-def _ensure_dir_exists(file_path):
-    directory = os.path.dirname(file_path)
-    if directory and not os.path.exists(directory):
-        try: os.makedirs(directory);
-        except OSError as e: print(f"Ensembl Helper: Error creating dir '{directory}': {e}"); return False
-    return True
+ENSEMBL_LOOKUP_BATCH_URL = "https://rest.ensembl.org/lookup/id?expand=xrefs&content-type=application/json"
+# The POST /lookup/id endpoint accepts at most 1000 IDs per request.
+ENSEMBL_LOOKUP_BATCH_SIZE = 1000
 
 
 def _parse_ensembl_lookup_json(json_data, ensembl_id_val):
+    """Parses one lookup result, given either as the raw JSON text or as an already decoded dict."""
     if not json_data: return None
     try:
-        data = json.loads(json_data)
+        data = json.loads(json_data) if isinstance(json_data, str) else json_data
         if data.get('error'):
             print(f"Ensembl API Error for {ensembl_id_val}: {data.get('error')}")
             return None
@@ -52,36 +44,64 @@ def _parse_ensembl_lookup_json(json_data, ensembl_id_val):
     except Exception as e: print(f"Ensembl API: Error parsing for {ensembl_id_val}: {e}"); return None
 
 
-def get_gene_by_id(ensembl_id_val):
-    if not ensembl_id_val: return None
-    clean_ensembl_id = ensembl_id_val.strip() 
+def _lookup_batch(ensembl_ids):
+    """
+    Looks up one batch of Ensembl IDs with a single POST /lookup/id and caches all results.
+    Returns {ensembl_id: record or None}.
+    """
+    request_headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+    json_response = url_request(ENSEMBL_LOOKUP_BATCH_URL, {'ids': ensembl_ids}, method="POST", headers=request_headers)
+    results = {ensembl_id: None for ensembl_id in ensembl_ids}
+    if not json_response:
+        print(f"Ensembl API: Batch lookup of {len(ensembl_ids)} IDs failed; they will be retried on the next run.")
+        return results
+    try:
+        lookup_data = json.loads(json_response)
+    except json.JSONDecodeError:
+        print(f"Ensembl API: Failed to decode batch lookup JSON. Resp: {json_response[:200]}")
+        return results
+
+    for ensembl_id in ensembl_ids:
+        results[ensembl_id] = _parse_ensembl_lookup_json(lookup_data.get(ensembl_id), ensembl_id)
 
-    if _ensure_dir_exists(ENSEMBL_CACHE_FILE):
-        try:
-            with open(ENSEMBL_CACHE_FILE, 'r', encoding='utf-8') as f_cache:
-                for line in f_cache:
-                    parts = line.strip().split('\t')
-                    if len(parts) == 4 and parts[1] == clean_ensembl_id:
-                        if parts[0] == "NOT_FOUND_SYMBOL": return None
-                        return {'name': parts[0], 'embl': parts[1], 'id': parts[2], 'species': parts[3]}
-        except FileNotFoundError: pass 
+    genestore.put_genes('ensembl', [record for record in results.values() if record])
+    if not download.REPLAY_ONLY:
+        genestore.put_misses('ensembl', 'embl', [ensembl_id for ensembl_id, record in results.items() if record is None])
+    return results
 
-    lookup_url = ENSEMBL_LOOKUP_URL_TEMPLATE.format(clean_ensembl_id) 
-    
-    request_headers = {
-        'Accept': 'application/json',
-    }
-    
-    json_response = url_request(lookup_url, None, method="GET", headers=request_headers)
-    
-    gene_details = _parse_ensembl_lookup_json(json_response, clean_ensembl_id)
 
-    if _ensure_dir_exists(ENSEMBL_CACHE_FILE):
-        try:
-            with open(ENSEMBL_CACHE_FILE, 'a', encoding='utf-8') as f_cache:
-                if gene_details:
-                    f_cache.write(f"{gene_details.get('name','')}\t{gene_details.get('embl','')}\t{gene_details.get('id','')}\t{gene_details.get('species','')}\n")
-                else:
-                    f_cache.write(f"NOT_FOUND_SYMBOL\t{clean_ensembl_id}\tNOT_FOUND_ID\tNOT_FOUND_SPECIES\n")
-        except IOError as e: print(f"Warning: Could not write to Ensembl Gene Cache: {e}")
-    return gene_details
\ No newline at end of file
+def get_genes_by_ids(ensembl_ids):
+    """
+    Get gene details for many Ensembl gene IDs at once.
+    Cached IDs are answered locally; the rest are posted ENSEMBL_LOOKUP_BATCH_SIZE at a time.
+    Returns {clean_ensembl_id: record or None}.
+    """
+    results = {}
+    to_lookup = []
+    for ensembl_id_val in ensembl_ids:
+        if not ensembl_id_val: continue
+        clean_ensembl_id = ensembl_id_val.strip()
+        if clean_ensembl_id in results: continue
+
+        cached_gene = genestore.lookup_gene('ensembl', embl=clean_ensembl_id)
+        if cached_gene is genestore.MISS:
+            results[clean_ensembl_id] = None
+        elif cached_gene:
+            results[clean_ensembl_id] = cached_gene
+        else:
+            results[clean_ensembl_id] = None
+            to_lookup.append(clean_ensembl_id)
+
+    batches = [to_lookup[i:i + ENSEMBL_LOOKUP_BATCH_SIZE] for i in range(0, len(to_lookup), ENSEMBL_LOOKUP_BATCH_SIZE)]
+    if len(batches) > 1:
+        print(f"Ensembl API: Looking up {len(to_lookup)} IDs in {len(batches)} concurrent batches...")
+    batch_map = download.get_executor().map if len(batches) > 1 else map
+    for batch_results in batch_map(_lookup_batch, batches):
+        results.update(batch_results)
+    return results
+
+
+def get_gene_by_id(ensembl_id_val):
+    if not ensembl_id_val: return None
+    clean_ensembl_id = ensembl_id_val.strip() 
+    return get_genes_by_ids([clean_ensembl_id]).get(clean_ensembl_id)
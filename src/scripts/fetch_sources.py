@@ -0,0 +1,127 @@
+import sys
+import os
+import shutil
+import zipfile
+import xml.etree.ElementTree as ET
+from download import download_to_file, url_request
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data'))
+
+# name -> (url, destination relative to ../data[, checksum URL]). Sources that are only published
+# behind a form (miRTarBase release CSVs, RNA22 full prediction sets) are fetched with --url.
+# A .zip is extracted next to itself, since the importers read the plain files.
+# The checksum URL is a metalink listing the file's md5 for the current release; it is fetched
+# first and the download is verified against it (see fetch_expected_checksum). Only UniProt
+# publishes one: the miRBase, TargetScan and NCBI gene files are not verified.
+UNIPROT_RELEASE_METALINK_URL = 'https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/RELEASE.metalink'
+
+SOURCES = {
+    'mirbase_dat': ('https://www.mirbase.org/download/miRNA.dat', 'mirbase/miRNA.dat'),
+    'mirbase_mature': ('https://www.mirbase.org/download/mature.fa', 'mirbase/mature.fa'),
+    'mirbase_aliases': ('https://www.mirbase.org/download/aliases.txt', 'mirbase/aliases.txt'),
+    'targetscan': ('https://www.targetscan.org/vert_80/vert_80_data_download/Predicted_Targets_Info.default_predictions.txt.zip',
+                   'targetscan/Predicted_Targets_Info.default_predictions.txt.zip'),
+    'uniprot_sprot': ('https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/uniprot_sprot.dat.gz',
+                      'uniprot_sprot.dat.gz', UNIPROT_RELEASE_METALINK_URL),
+    'ncbi_gene_info': ('https://ftp.ncbi.nlm.nih.gov/gene/DATA/gene_info.gz', 'ncbi/gene_info.gz'),
+    'ncbi_gene2refseq': ('https://ftp.ncbi.nlm.nih.gov/gene/DATA/gene2refseq.gz', 'ncbi/gene2refseq.gz'),
+    'ncbi_gene2ensembl': ('https://ftp.ncbi.nlm.nih.gov/gene/DATA/gene2ensembl.gz', 'ncbi/gene2ensembl.gz'),
+}
+
+
+def fetch_expected_checksum(checksum_url, file_name):
+    """('md5', hexdigest) of file_name from the metalink at checksum_url, or None if it cannot be had."""
+    metalink_text = url_request(checksum_url, None, method="GET", use_cache=False)
+    if not metalink_text:
+        print(f"Checksum: Could not fetch {checksum_url}.")
+        return None
+    try:
+        root = ET.fromstring(metalink_text)
+    except ET.ParseError as e:
+        print(f"Checksum: Could not parse {checksum_url}: {e}")
+        return None
+    # metalink elements are namespaced; match on the local names
+    for file_elem in root.iter():
+        if not file_elem.tag.endswith('}file') and file_elem.tag != 'file':
+            continue
+        if file_elem.get('name') != file_name:
+            continue
+        for hash_elem in file_elem.iter():
+            if (hash_elem.tag.endswith('}hash') or hash_elem.tag == 'hash') and hash_elem.get('type') == 'md5' and hash_elem.text:
+                return 'md5', hash_elem.text.strip().lower()
+    print(f"Checksum: {checksum_url} lists no md5 for {file_name}.")
+    return None
+
+
+def extract_zip(zip_path):
+    """
+    Extracts the files of zip_path into its directory, skipping those already extracted from this
+    archive (at least as new as it); returns the extracted file paths, or None if the archive is bad.
+    """
+    dest_dir = os.path.dirname(zip_path)
+    extracted = []
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                member_path = os.path.join(dest_dir, os.path.basename(member.filename))
+                extracted.append(member_path)
+                if os.path.exists(member_path) and os.path.getmtime(member_path) >= os.path.getmtime(zip_path):
+                    print(f"Extract: '{member_path}' is up to date.")
+                    continue
+                with archive.open(member) as f_member, open(member_path + '.part', 'wb') as f_out:
+                    shutil.copyfileobj(f_member, f_out, 1024 * 1024)
+                os.replace(member_path + '.part', member_path)
+                print(f"Extract: Saved '{member_path}' ({member.file_size} bytes).")
+    except (zipfile.BadZipFile, OSError) as e:
+        print(f"Extract: Could not extract '{zip_path}': {e}")
+        return None
+    return extracted
+
+
+def fetch_sources(source_names):
+    """
+    Downloads (or confirms unchanged) each named source, verifying it against its published
+    checksum if it has one, and extracting zips; returns the names that failed.
+    """
+    failed = []
+    for name in source_names:
+        url, relative_dest, *checksum_url = SOURCES[name]
+        dest_path = os.path.join(BASE_DATA_DIR, relative_dest)
+        print(f"--- {name}: {url} -> {dest_path}")
+        checksum = None
+        if checksum_url:
+            checksum = fetch_expected_checksum(checksum_url[0], url.rsplit('/', 1)[-1])
+            if checksum is None:
+                failed.append(name)
+                continue
+        if not download_to_file(url, dest_path, checksum=checksum):
+            failed.append(name)
+        elif dest_path.endswith('.zip') and extract_zip(dest_path) is None:
+            failed.append(name)
+    return failed
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--url':
+        if len(sys.argv) < 4:
+            print("Usage: python fetch_sources.py --url <url> <dest_path> [<algorithm>:<hexdigest>]")
+            sys.exit(1)
+        checksum_arg = tuple(sys.argv[4].split(':', 1)) if len(sys.argv) > 4 else None
+        sys.exit(0 if download_to_file(sys.argv[2], sys.argv[3], checksum=checksum_arg) else 1)
+
+    requested = sys.argv[1:] or list(SOURCES)
+    unknown = [name for name in requested if name not in SOURCES]
+    if unknown:
+        print(f"Unknown source(s): {', '.join(unknown)}. Known: {', '.join(SOURCES)}")
+        print("Usage: python fetch_sources.py [<source> ...]")
+        print("       python fetch_sources.py --url <url> <dest_path> [<algorithm>:<hexdigest>]")
+        sys.exit(1)
+
+    failed_sources = fetch_sources(requested)
+    if failed_sources:
+        print(f"Failed: {', '.join(failed_sources)}")
+        sys.exit(1)
+    print("All sources are up to date.")
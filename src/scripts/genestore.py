@@ -0,0 +1,327 @@
+import os
+import sqlite3
+import threading
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data'))
+GENE_STORE_FILE = os.path.join(BASE_DATA_DIR, 'gene_crosswalk.sqlite')
+
+# Legacy flat caches, imported once into the store on first use.
+LEGACY_NCBI_GENE_CACHE_FILE = os.path.join(BASE_DATA_DIR, 'ncbi_gene.dat')
+LEGACY_ENSEMBL_CACHE_FILE = os.path.join(BASE_DATA_DIR, 'ensembl_gene_cache.dat')
+LEGACY_UNIPROT_ENS_AC_CACHE_FILE = os.path.join(BASE_DATA_DIR, 'uniprot_ens_ac_cache.dat')
+LEGACY_UNIPROT_ENTRY_CACHE_FILE = os.path.join(BASE_DATA_DIR, 'uniprot_entry_cache.dat')
+LEGACY_REFSEQ_GENEID_CACHE_FILE = os.path.join(BASE_DATA_DIR, 'pictar', 'refseq_geneid.dat')
+
+# Returned by the lookup functions when a negative result is cached, as
+# opposed to None which means "nothing cached yet, ask the remote API".
+MISS = 'NOT_FOUND'
+
+# Natural key of a gene row for each source: NCBI rows are keyed by GeneID,
+# Ensembl rows by the ENSG ID and UniProt rows by the accession.
+SOURCE_KEY_FIELD = {
+    'ncbi': 'id',
+    'ensembl': 'embl',
+    'uniprot': 'ac',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS gene (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL COLLATE NOCASE,
+    geneid TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    embl TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    species TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    ac TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (source, key)
+);
+CREATE INDEX IF NOT EXISTS gene_geneid_idx ON gene (source, geneid);
+CREATE INDEX IF NOT EXISTS gene_name_idx ON gene (source, name, species);
+CREATE INDEX IF NOT EXISTS gene_embl_idx ON gene (source, embl);
+CREATE INDEX IF NOT EXISTS gene_ac_idx ON gene (source, ac);
+CREATE TABLE IF NOT EXISTS miss (
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL COLLATE NOCASE,
+    species TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    PRIMARY KEY (source, kind, value, species)
+);
+CREATE TABLE IF NOT EXISTS refseq (
+    accession TEXT PRIMARY KEY COLLATE NOCASE,
+    geneid TEXT
+);
+CREATE TABLE IF NOT EXISTS ens_ac (
+    embl TEXT NOT NULL COLLATE NOCASE,
+    ac TEXT NOT NULL,
+    PRIMARY KEY (embl, ac)
+);
+CREATE TABLE IF NOT EXISTS ens_geneid (
+    embl TEXT PRIMARY KEY COLLATE NOCASE,
+    geneid TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+_migration_lock = threading.Lock()
+
+
+def get_connection():
+    """Returns this thread's connection to the crosswalk store, creating the schema on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(GENE_STORE_FILE), exist_ok=True)
+        conn = sqlite3.connect(GENE_STORE_FILE, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        with _migration_lock:
+            _migrate_legacy_caches(conn)
+    return conn
+
+
+def close_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+def get_meta(key):
+    row = get_connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(key, value):
+    conn = get_connection()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def _row_to_record(source, row):
+    geneid, name, embl, species, ac = row
+    record = {'name': name, 'embl': embl, 'id': geneid, 'species': species}
+    if source == 'uniprot':
+        record['ac'] = ac
+    return record
+
+
+def lookup_gene(source, geneid=None, name=None, embl=None, ac=None, species=None):
+    """
+    Looks up a cached gene record of the given source by exactly one key.
+    Returns the record dict, MISS if a negative result is cached, or None if nothing is cached.
+    The species filter only applies to name and Ensembl lookups and is case-insensitive.
+    """
+    if geneid is not None:
+        kind, value = 'id', str(geneid).strip()
+        where, params = "geneid = ?", [value]
+    elif name is not None:
+        kind, value = 'name', name.strip()
+        where, params = "name = ?", [value]
+    elif embl is not None:
+        kind, value = 'embl', embl.strip()
+        where, params = "embl = ?", [value]
+    elif ac is not None:
+        kind, value = 'ac', ac.strip()
+        where, params = "ac = ?", [value]
+    else:
+        return None
+
+    species_key = species.strip() if species and kind in ('name', 'embl') else ''
+    if species_key:
+        where += " AND species = ?"
+        params.append(species_key)
+
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT geneid, name, embl, species, ac FROM gene WHERE source = ? AND " + where + " LIMIT 1",
+        [source] + params).fetchone()
+    if row:
+        return _row_to_record(source, row)
+
+    if conn.execute("SELECT 1 FROM miss WHERE source = ? AND kind = ? AND value = ? AND species = ?",
+                    (source, kind, value, species_key)).fetchone():
+        return MISS
+    return None
+
+
+def _gene_row(source, record):
+    geneid = str(record.get('id') or '').strip()
+    embl = (record.get('embl') or '').strip()
+    ac = (record.get('ac') or '').strip()
+    row = {'id': geneid, 'embl': embl, 'ac': ac}
+    key = row[SOURCE_KEY_FIELD[source]]
+    if not key:
+        return None
+    return (source, key, geneid, (record.get('name') or '').strip(), embl,
+            (record.get('species') or '').strip(), ac)
+
+
+def put_genes(source, records):
+    """Stores (or replaces) gene records of one source in a single transaction."""
+    rows = [row for row in (_gene_row(source, r) for r in records if r) if row]
+    if not rows:
+        return 0
+    conn = get_connection()
+    with conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO gene (source, key, geneid, name, embl, species, ac)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    return len(rows)
+
+
+def put_gene(source, record):
+    return put_genes(source, [record])
+
+
+def put_misses(source, kind, values, species=None):
+    """Caches negative results so the same unknown key is not queried again."""
+    species_key = species.strip() if species else ''
+    rows = [(source, kind, str(v).strip(), species_key) for v in values if v]
+    if not rows:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO miss (source, kind, value, species) VALUES (?, ?, ?, ?)", rows)
+
+
+def put_miss(source, kind, value, species=None):
+    put_misses(source, kind, [value], species)
+
+
+def lookup_refseq(accession):
+    """Returns the cached GeneID for a versionless RefSeq accession, MISS, or None if not cached."""
+    row = get_connection().execute("SELECT geneid FROM refseq WHERE accession = ?",
+                                   (accession.strip(),)).fetchone()
+    if row is None:
+        return None
+    return row[0] if row[0] else MISS
+
+
+def put_refseqs(mapping):
+    """Stores {accession: geneid or None}; None caches the accession as not found."""
+    rows = [(acc.strip(), str(gid) if gid else None) for acc, gid in mapping.items() if acc]
+    if not rows:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO refseq (accession, geneid) VALUES (?, ?)", rows)
+
+
+def lookup_uniprot_acs(ensembl_id):
+    """Returns the cached UniProt accessions mapped from an Ensembl gene ID, MISS, or None if not cached."""
+    conn = get_connection()
+    acs = [row[0] for row in conn.execute("SELECT ac FROM ens_ac WHERE embl = ? ORDER BY rowid",
+                                          (ensembl_id.strip(),))]
+    if acs:
+        return acs
+    if conn.execute("SELECT 1 FROM miss WHERE source = 'uniprot' AND kind = 'embl' AND value = ? AND species = ''",
+                    (ensembl_id.strip(),)).fetchone():
+        return MISS
+    return None
+
+
+def put_uniprot_acs(mapping):
+    """Stores {ensembl_id: [accessions]}; an empty list caches the Ensembl ID as not mapped."""
+    rows = []
+    not_mapped = []
+    for ensembl_id, acs in mapping.items():
+        if acs:
+            rows.extend((ensembl_id.strip(), ac.strip()) for ac in acs if ac)
+        else:
+            not_mapped.append(ensembl_id)
+    conn = get_connection()
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO ens_ac (embl, ac) VALUES (?, ?)", rows)
+    put_misses('uniprot', 'embl', not_mapped)
+
+
+def lookup_ens_geneid(ensembl_id):
+    """
+    Returns the NCBI GeneID stored for an Ensembl gene ID whose gene record names another Ensembl ID
+    (an Entrezgene record only carries its first cross-reference), or None if none is stored.
+    """
+    row = get_connection().execute("SELECT geneid FROM ens_geneid WHERE embl = ?", (ensembl_id.strip(),)).fetchone()
+    return row[0] if row else None
+
+
+def put_ens_geneids(mapping):
+    """Stores {ensembl_id: geneid} aliases for lookup_ens_geneid."""
+    rows = [(ensembl_id.strip(), str(geneid).strip()) for ensembl_id, geneid in mapping.items() if ensembl_id and geneid]
+    if not rows:
+        return
+    conn = get_connection()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO ens_geneid (embl, geneid) VALUES (?, ?)", rows)
+
+
+def _read_legacy_lines(file_path, expected_columns):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f_cache:
+            for line in f_cache:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) == expected_columns:
+                    yield [p.strip() for p in parts]
+    except FileNotFoundError:
+        return
+
+
+def _migrate_legacy_caches(conn):
+    """One-shot import of the old line-scanned .dat caches into the store."""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_dat_migrated'").fetchone():
+        return
+
+    print("Gene Store: Migrating legacy .dat caches into " + GENE_STORE_FILE)
+    ncbi_records, ensembl_records, uniprot_records = [], [], []
+    misses = []
+    for name, embl, geneid, species in _read_legacy_lines(LEGACY_NCBI_GENE_CACHE_FILE, 4):
+        if name == 'NOT_FOUND_SYMBOL':
+            misses.append(('ncbi', 'id', geneid, ''))
+        elif embl == 'SYMBOL_NOT_FOUND_EMBL':
+            misses.append(('ncbi', 'name', name, '' if species == 'ANY' else species))
+        elif name == 'ENSEMBL_NOT_FOUND_SYMBOL':
+            misses.append(('ncbi', 'embl', embl, '' if species == 'ANY' else species))
+        else:
+            ncbi_records.append({'name': name, 'embl': embl, 'id': geneid, 'species': species})
+
+    for name, embl, geneid, species in _read_legacy_lines(LEGACY_ENSEMBL_CACHE_FILE, 4):
+        if name == 'NOT_FOUND_SYMBOL':
+            misses.append(('ensembl', 'embl', embl, ''))
+        else:
+            ensembl_records.append({'name': name, 'embl': embl, 'id': geneid, 'species': species})
+
+    for ac, name, geneid, species, embl in _read_legacy_lines(LEGACY_UNIPROT_ENTRY_CACHE_FILE, 5):
+        if name == 'NOT_PARSED':
+            misses.append(('uniprot', 'ac', ac, ''))
+        else:
+            uniprot_records.append({'ac': ac, 'name': name, 'id': geneid, 'species': species, 'embl': embl})
+
+    ens_ac_rows = []
+    for embl, ac in _read_legacy_lines(LEGACY_UNIPROT_ENS_AC_CACHE_FILE, 2):
+        if ac == 'NOT_MAPPED':
+            misses.append(('uniprot', 'embl', embl.upper(), ''))
+        else:
+            ens_ac_rows.append((embl.upper(), ac))
+
+    refseq_rows = [(acc, None if gid == 'NOT_FOUND' else gid)
+                   for acc, gid in _read_legacy_lines(LEGACY_REFSEQ_GENEID_CACHE_FILE, 2)]
+
+    for source, records in (('ncbi', ncbi_records), ('ensembl', ensembl_records), ('uniprot', uniprot_records)):
+        rows = [row for row in (_gene_row(source, r) for r in records) if row]
+        conn.executemany("""
+            INSERT OR IGNORE INTO gene (source, key, geneid, name, embl, species, ac)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    conn.executemany("INSERT OR IGNORE INTO miss (source, kind, value, species) VALUES (?, ?, ?, ?)", misses)
+    conn.executemany("INSERT OR IGNORE INTO ens_ac (embl, ac) VALUES (?, ?)", ens_ac_rows)
+    conn.executemany("INSERT OR IGNORE INTO refseq (accession, geneid) VALUES (?, ?)", refseq_rows)
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_dat_migrated', '1')")
+    conn.commit()
+    print(f"Gene Store: Migrated {len(ncbi_records)} NCBI, {len(ensembl_records)} Ensembl, "
+          f"{len(uniprot_records)} UniProt genes, {len(refseq_rows)} RefSeq and {len(ens_ac_rows)} Ensembl->UniProt mappings.")
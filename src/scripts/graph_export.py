@@ -0,0 +1,437 @@
+"""
+Offline export of the whole graph as neo4j-admin bulk-import CSV files.
+
+The stages reuse the importers' parsers and name/gene resolution, but instead of
+MERGE-ing row by row through Bolt they collect deduplicated nodes and relationships
+in memory and write one CSV (header on the first line) per label / relationship type.
+An empty database is then built in one offline load with `neo4j-admin database import full`.
+"""
+import sys
+import os
+import re
+import csv
+import time
+
+import mirbase
+import targetscan_fixed
+import rna22_fixed
+import pictar_fixed
+import mirtarbase_fixed
+from ncbi import get_genes_by_ids, get_geneids_by_refseqs, normalize_refseq_accession
+from prefetch import resolve_genes_by_ens, close_resolvers
+from download import configure_from_argv
+from mirna_resolver import MirnaResolver
+
+DEFAULT_OUT_DIR = '../../db_dump/import'
+ARRAY_DELIMITER = ';'
+
+# label -> [(property key, CSV header column)]; the first column is the node's :ID
+NODE_COLUMNS = {
+    'microRNA': [('name', 'name:ID(microRNA)'), ('accession', 'accession'),
+                 ('species', 'species'), ('mirbase_link', 'mirbase_link'),
+                 ('sequence', 'sequence'), ('seed', 'seed')],
+    'Target': [('key', ':ID(Target)'), ('name', 'name'), ('species', 'species'),
+               ('geneid', 'geneid'), ('ens_code', 'ens_code'), ('ncbi_link', 'ncbi_link')],
+    'Pathway': [('key', ':ID(Pathway)'), ('id', 'id'), ('name', 'name'),
+                ('source', 'source'), ('created_at', 'created_at:long')],
+    'DB_info': [('name', 'name:ID(DB_info)'), ('link', 'link')],
+    'Relation_general_info': [('name', 'name:ID(Relation_general_info)'), ('source_db_link', 'source_db_link'),
+                              ('min_value', 'min_value:double'), ('max_value', 'max_value:double'),
+                              ('cut_off', 'cut_off:double')],
+}
+
+
+class CsvGraphWriter:
+    """
+    Collects deduplicated nodes and relationships and writes them as neo4j-admin import CSVs.
+
+    Targets are keyed by Ensembl ID when one is known and by 'NCBI:<geneid>' otherwise;
+    both identifiers resolve to the same node, so a gene reached through TargetScan (Ensembl)
+    and through miRTarBase (GeneID) is exported once.
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.nodes = {label: {} for label in NODE_COLUMNS}
+        self.target_key_by_ens = {}
+        self.target_key_by_geneid = {}
+        self.relationships = {}
+        self.relationship_columns = {}
+
+    def add_node(self, label, node_id, properties):
+        """Adds a node; for an existing node only the properties it does not have yet are filled in."""
+        existing = self.nodes[label].get(node_id)
+        if existing is None:
+            self.nodes[label][node_id] = dict(properties)
+            return
+        for key, value in properties.items():
+            if existing.get(key) in (None, '') and value not in (None, ''):
+                existing[key] = value
+
+    def target_key(self, ens_code='', geneid=''):
+        """The :ID of the Target with the Ensembl ID or GeneID, or None."""
+        if ens_code and ens_code in self.target_key_by_ens:
+            return self.target_key_by_ens[ens_code]
+        if geneid and str(geneid) in self.target_key_by_geneid:
+            return self.target_key_by_geneid[str(geneid)]
+        return None
+
+    def add_target(self, name, species, geneid='', ens_code='', ncbi_link=''):
+        """Adds (or completes) a Target and returns its :ID."""
+        geneid = str(geneid) if geneid else ''
+        key = self.target_key(ens_code, geneid) or (ens_code if ens_code else 'NCBI:' + geneid)
+        self.add_node('Target', key, {'key': key, 'name': name, 'species': species, 'geneid': geneid,
+                                      'ens_code': ens_code, 'ncbi_link': str(ncbi_link) if ncbi_link else ''})
+        node = self.nodes['Target'][key]
+        if node['ens_code']: self.target_key_by_ens.setdefault(node['ens_code'], key)
+        if node['geneid']: self.target_key_by_geneid.setdefault(node['geneid'], key)
+        return key
+
+    def add_db_info(self, name, link):
+        self.add_node('DB_info', name, {'name': name, 'link': link})
+
+    def add_relation_info(self, name, source_db_link, min_value, max_value, cut_off):
+        # create_relation_info SETs these on every run, so the last values win here too
+        self.nodes['Relation_general_info'][name] = {'name': name, 'source_db_link': source_db_link,
+                                                    'min_value': min_value, 'max_value': max_value, 'cut_off': cut_off}
+
+    def register_relationship_type(self, rel_type, start_label, end_label, columns):
+        """columns is a [(property key, CSV header column)] list for the relationship's properties."""
+        if rel_type not in self.relationships:
+            self.relationships[rel_type] = {}
+            self.relationship_columns[rel_type] = (start_label, end_label, columns)
+
+    def add_relationship(self, rel_type, start_id, end_id, dedup_key, properties, merge=None):
+        """
+        Adds a relationship unless one with the same dedup_key exists; in that case
+        merge(existing_properties, properties), if given, updates the existing one in place.
+        """
+        relationships = self.relationships[rel_type]
+        existing = relationships.get(dedup_key)
+        if existing is None:
+            relationships[dedup_key] = (start_id, end_id, dict(properties))
+            return True
+        if merge is not None:
+            merge(existing[2], properties)
+        return False
+
+    def _write_csv(self, file_name, header, rows):
+        file_path = os.path.join(self.out_dir, file_name)
+        with open(file_path, 'w', newline='', encoding='utf-8') as f_out:
+            csv_writer = csv.writer(f_out)
+            csv_writer.writerow(header)
+            for row in rows:
+                csv_writer.writerow([ARRAY_DELIMITER.join(value) if isinstance(value, list) else value for value in row])
+        return file_path
+
+    def write(self):
+        """Writes every non-empty label / relationship type; returns ([(label, path)], [(type, path)])."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        node_files = []
+        for label, columns in NODE_COLUMNS.items():
+            if not self.nodes[label]:
+                continue
+            rows = ([node.get(key, '') for key, _ in columns] for node in self.nodes[label].values())
+            node_files.append((label, self._write_csv(f"nodes_{label}.csv", [header for _, header in columns], rows)))
+            print(f"  {label}: {len(self.nodes[label])} nodes")
+
+        relationship_files = []
+        for rel_type, relationships in self.relationships.items():
+            if not relationships:
+                continue
+            start_label, end_label, columns = self.relationship_columns[rel_type]
+            header = [f":START_ID({start_label})", f":END_ID({end_label})", ':TYPE'] + [h for _, h in columns]
+            rows = ([start_id, end_id, rel_type] + [properties.get(key, '') for key, _ in columns]
+                    for start_id, end_id, properties in relationships.values())
+            file_name = "rels_" + re.sub(r'[^A-Za-z0-9_.-]', '_', rel_type) + ".csv"
+            relationship_files.append((rel_type, self._write_csv(file_name, header, rows)))
+            print(f"  {rel_type}: {len(relationships)} relationships")
+        return node_files, relationship_files
+
+
+def import_command(node_files, relationship_files, database='neo4j'):
+    """The neo4j-admin command that loads the written files into an (empty) database."""
+    parts = ['neo4j-admin database import full', '--overwrite-destination', f"--array-delimiter='{ARRAY_DELIMITER}'"]
+    parts += [f"--nodes={label}={os.path.abspath(path)}" for label, path in node_files]
+    parts += [f"--relationships={rel_type}={os.path.abspath(path)}" for rel_type, path in relationship_files]
+    parts.append(database)
+    return ' \\\n    '.join(parts)
+
+
+def export_mirbase(graph, mirnas, dat_file, species_prefix, species_name):
+    """microRNA nodes of the species, one per accession and name."""
+    print(f"miRBase: {dat_file} ({species_prefix}, {species_name})")
+    for record in mirbase.collect_mirbase_records(dat_file, {species_prefix: species_name}).values():
+        if record['id'] in graph.nodes['microRNA']:
+            continue
+        graph.add_node('microRNA', record['id'], {'name': record['id'], 'accession': record['accession'],
+                                                  'species': record['species'], 'mirbase_link': record['accession']})
+        mirnas.add(record['id'], record['accession'])
+
+
+def export_mature(graph, mirnas, fa_file):
+    """Sequence and seed of the exported mature microRNAs (matched by accession) from mature.fa."""
+    print(f"miRBase mature sequences: {fa_file}")
+    species_by_prefix = {name.split('-')[0]: node['species'] for name, node in graph.nodes['microRNA'].items()}
+    for mature in mirbase.iter_mature_sequences(fa_file, species_by_prefix):
+        name = mirnas.name_for_accession(mature['accession'])
+        if name:
+            graph.add_node('microRNA', name, {'sequence': mature['sequence'], 'seed': mature['seed']})
+
+
+def _merge_targetscan(existing, new):
+    existing['pct_score'] = min(existing['pct_score'], new['pct_score'])
+    for key in ('source_microrna_inputs', 'source_target_ensembl_inputs'):
+        for value in new[key]:
+            if value not in existing[key]: existing[key].append(value)
+
+
+def export_targetscan(graph, mirnas, data_file_path, species_arg):
+    """
+    One species per TargetScan file (see targetscan_fixed.check_targetscan_species); repeat
+    --targetscan for more species, e.g. the TargetScanMouse file for mmu.
+    """
+    print(f"TargetScan: {data_file_path} ({species_arg})")
+    try:
+        species_prefix, (species_name, tax_id) = targetscan_fixed.parse_species_arg(species_arg)
+        targetscan_fixed.check_targetscan_species(data_file_path, tax_id)
+    except ValueError as e_species:
+        print(f"Error: {e_species}")
+        sys.exit(1)
+    graph.add_db_info('TargetScan', 'http://www.targetscan.org')
+    graph.register_relationship_type('TargetScan', 'microRNA', 'Target', [
+        ('tool_name', 'tool_name'), ('pct_score', 'pct_score:double'),
+        ('source_microrna_inputs', 'source_microrna_inputs:string[]'),
+        ('source_target_ensembl_inputs', 'source_target_ensembl_inputs:string[]')])
+
+    stats = {}
+    pairs = targetscan_fixed.aggregate_targetscan_pairs(data_file_path, species_prefix, tax_id, mirnas, stats)
+    if not stats['considered']:
+        print(f"Error: {data_file_path} has no rows with Species ID {tax_id}; {species_prefix} ({species_name}) not exported.")
+        return
+    new_target_ids = sorted({ens_base for _, ens_base in pairs if graph.target_key(ens_code=ens_base) is None})
+    for ens_base, gene_details in resolve_genes_by_ens(new_target_ids, targetscan_fixed.TARGET_SOURCES, species_name).items():
+        if gene_details:
+            graph.add_target(gene_details.get('name') or ens_base, gene_details.get('species') or species_name,
+                             gene_details.get('id', ''), ens_base, gene_details.get('id', ''))
+        else:
+            graph.add_target(ens_base, species_name, ens_code=ens_base)
+
+    for (mirna_name, ens_base), (min_pct, mirna_inputs, ensembl_inputs) in pairs.items():
+        target_key = graph.target_key(ens_code=ens_base)
+        graph.add_relationship('TargetScan', mirna_name, target_key, (mirna_name, target_key), {
+            'tool_name': 'TargetScan', 'pct_score': min_pct,
+            'source_microrna_inputs': list(mirna_inputs), 'source_target_ensembl_inputs': list(ensembl_inputs)
+        }, merge=_merge_targetscan)
+
+    # the PCT range covers every exported species, as one targetscan_fixed run over the same files
+    min_pct, max_pct = stats['min_pct'], stats['max_pct']
+    previous = graph.nodes['Relation_general_info'].get('TargetScan')
+    if previous:
+        min_pct, max_pct = min(min_pct, previous['min_value']), max(max_pct, previous['max_value'])
+    graph.add_relation_info('TargetScan', 'https://www.targetscan.org/cgi-bin/targetscan/data_download.vert80.cgi',
+                            min_pct if min_pct != float('inf') else 0.0,
+                            max_pct if max_pct != float('-inf') else 1.0, 0.0)
+
+
+def export_rna22(graph, mirnas, tsv_file_path, relation_name):
+    print(f"RNA22: {tsv_file_path} ({relation_name})")
+    graph.add_db_info('RNA22', 'https://cm.jefferson.edu/rna22/')
+    graph.register_relationship_type(relation_name, 'microRNA', 'Target', [
+        ('name', 'name'), ('source_microrna', 'source_microrna'), ('source_target', 'source_target'), ('score', 'score')])
+
+    new_targets = resolve_genes_by_ens(sorted(target for target in rna22_fixed.collect_rna22_targets(tsv_file_path)
+                                              if graph.target_key(ens_code=target) is None), rna22_fixed.TARGET_SOURCES)
+    min_value, max_value = float('inf'), float('-inf')
+    resolved_targets = set()
+    for _, mirna_tool_name, target, score_val in rna22_fixed.iter_rna22_rows(tsv_file_path):
+        min_value, max_value = min(min_value, score_val), max(max_value, score_val)
+        mirna_name = mirnas.resolve_rna22(mirna_tool_name)
+        if not mirna_name:
+            continue
+
+        if target not in resolved_targets and target in new_targets:
+            gene_info = new_targets[target]
+            if gene_info is not None:
+                species_name = gene_info.get('species', '') or \
+                    rna22_fixed.species.get(mirna_tool_name.replace('_', '-').split('-')[0].lower(), 'Unknown')
+                graph.add_target(gene_info.get('name'), species_name, gene_info.get('id'), target, gene_info.get('id'))
+        resolved_targets.add(target)
+
+        target_key = graph.target_key(ens_code=target)
+        if target_key is None:
+            continue
+        graph.add_relationship(relation_name, mirna_name, target_key, (mirna_name, target_key, mirna_tool_name, target), {
+            'name': relation_name, 'source_microrna': mirna_tool_name, 'source_target': target, 'score': str(score_val)})
+
+    graph.add_relation_info(relation_name, rna22_fixed.source_db_link, min_value, max_value, rna22_fixed.default_score_for_tsv)
+
+
+def _merge_pictar(existing, new):
+    existing['score'] = max(existing['score'], new['score'])
+
+
+def export_pictar(graph, mirnas, bed_file_path, relation_name):
+    print(f"PicTar: {bed_file_path} ({relation_name})")
+    graph.add_db_info('PicTar', 'http://pictar.mdc-berlin.de/')
+    graph.register_relationship_type(relation_name, 'microRNA', 'Target', [
+        ('tool_name', 'tool_name'), ('score', 'score:double'),
+        ('source_microrna', 'source_microrna'), ('source_target_refseq', 'source_target_refseq')])
+
+    refseq_geneid_map = get_geneids_by_refseqs(pictar_fixed.collect_pictar_refseqs(bed_file_path))
+    new_genes = get_genes_by_ids({geneid for geneid in refseq_geneid_map.values() if geneid and graph.target_key(geneid=geneid) is None})
+    min_score, max_score = float('inf'), float('-inf')
+    resolved_geneids = set()
+    for _, target_refseq, mirna_name, score in pictar_fixed.iter_pictar_rows(bed_file_path):
+        min_score, max_score = min(min_score, score), max(max_score, score)
+        mirna_node_name = mirnas.name_for_accession(mirnas.resolve_pictar(mirna_name))
+        geneid = refseq_geneid_map.get(normalize_refseq_accession(target_refseq))
+        if not mirna_node_name or not geneid:
+            continue
+
+        if geneid not in resolved_geneids and graph.target_key(geneid=geneid) is None:
+            gene_details = new_genes.get(geneid)
+            if gene_details:
+                graph.add_target(gene_details.get('name', target_refseq), gene_details.get('species', 'Homo sapiens'),
+                                 gene_details.get('id', geneid), gene_details.get('embl', ''), gene_details.get('id', geneid))
+            else:
+                graph.add_target(target_refseq, 'Homo sapiens', geneid)
+        resolved_geneids.add(geneid)
+
+        target_key = graph.target_key(geneid=geneid)
+        graph.add_relationship(relation_name, mirna_node_name, target_key, (mirna_node_name, target_key, mirna_name, target_refseq), {
+            'tool_name': relation_name, 'score': score, 'source_microrna': mirna_name, 'source_target_refseq': target_refseq
+        }, merge=_merge_pictar)
+
+    graph.add_relation_info(relation_name, 'http://genome.ucsc.edu/cgi-bin/hgTables',
+                            min_score if min_score != float('inf') else 0.0, max_score if max_score != float('-inf') else 0.0, 0.0)
+
+
+def _merge_mirtarbase(existing, new):
+    for key in ('tool_name', 'source_target_symbol', 'source_target_geneid_original'):
+        existing[key] = new[key]
+
+
+def export_mirtarbase(graph, mirnas, data_file_path, species_prefix):
+    print(f"miRTarBase: {data_file_path} ({species_prefix})")
+    graph.add_db_info('miRTarBase', 'https://mirtarbase.cuhk.edu.cn/')
+    columns = [('tool_name', 'tool_name'), ('score', 'score'), ('experiments', 'experiments'),
+               ('source_microrna', 'source_microrna'), ('source_target_symbol', 'source_target_symbol'),
+               ('source_target_geneid_original', 'source_target_geneid_original')]
+    graph.register_relationship_type('miRTarBase', 'microRNA', 'Target', columns)
+
+    new_genes = get_genes_by_ids({geneid for geneid in mirtarbase_fixed.collect_mirtarbase_geneids(data_file_path, species_prefix)
+                                  if graph.target_key(geneid=geneid) is None})
+    min_score, max_score = float('inf'), float('-inf')
+    resolved_geneids = set()
+    for _, row in mirtarbase_fixed.iter_mirtarbase_rows(data_file_path, species_prefix, {'rows_read': 0, 'skipped': 0}):
+        try:
+            min_score, max_score = min(min_score, float(row['score'])), max(max_score, float(row['score']))
+        except ValueError:
+            pass
+        if row['mirna_name'] not in graph.nodes['microRNA']:
+            continue
+
+        geneid = row['geneid']
+        if geneid not in resolved_geneids and graph.target_key(geneid=geneid) is None:
+            gene_details = new_genes.get(geneid)
+            if gene_details:
+                graph.add_target(gene_details.get('name', row['target_symbol']), gene_details.get('species', 'Homo sapiens'),
+                                 gene_details.get('id', geneid), gene_details.get('embl', ''), gene_details.get('id', geneid))
+            else:
+                graph.add_target(row['target_symbol'] or geneid, 'Homo sapiens', geneid)
+        resolved_geneids.add(geneid)
+
+        target_key = graph.target_key(geneid=geneid)
+        properties = {'tool_name': 'miRTarBase', 'score': row['score'], 'experiments': row['experiments'],
+                      'source_microrna': row['mirna_name'], 'source_target_symbol': row['target_symbol'],
+                      'source_target_geneid_original': row['raw_gene_id']}
+        # the importer MERGEs on (miRNA, Target, source_microrna, experiments, score) and SETs the rest,
+        # so the last row of each such key wins
+        graph.add_relationship('miRTarBase', row['mirna_name'], target_key,
+                               (row['mirna_name'], target_key, row['mirna_name'], row['experiments'], row['score']), properties,
+                               merge=_merge_mirtarbase)
+
+    graph.add_relation_info('miRTarBase', 'https://cytargetlinker.github.io/pages/linksets/mirtarbase.html',
+                            min_score if min_score != float('inf') else 0.0, max_score if max_score != float('-inf') else 0.0, 0.0)
+
+
+def export_kegg(graph):
+    """KEGG pathways of every exported Target name, as the KEGG script does against the database."""
+    import kegg_analysis_fixed as kegg
+
+    print("KEGG: pathways for the exported Targets")
+    graph.add_db_info(kegg.KEGG_DB_NAME, kegg.KEGG_BASE_URL)
+    graph.register_relationship_type('PART_OF_PATHWAY', 'Target', 'Pathway', [('created_at', 'created_at:long')])
+    created_at = int(time.time() * 1000)
+
+    target_keys_by_name = {}
+    for key, node in graph.nodes['Target'].items():
+        if node.get('name'):
+            target_keys_by_name.setdefault(node['name'], []).append(key)
+
+    for i, gene_symbol in enumerate(sorted(target_keys_by_name)):
+        if (i+1) % 500 == 0:
+            print(f"  KEGG: {i+1}/{len(target_keys_by_name)} genes")
+        entrez_id = kegg.get_kegg_gene_id(gene_symbol)
+        if not entrez_id:
+            continue
+        pathway_ids = kegg.get_pathways_for_gene(entrez_id)
+        new_pathway_ids = [pid for pid in pathway_ids if f"{kegg.KEGG_DB_NAME}:{pid}" not in graph.nodes['Pathway']]
+        for pathway_id, pathway_name in zip(new_pathway_ids, kegg.get_pathway_names(new_pathway_ids)):
+            pathway_key = f"{kegg.KEGG_DB_NAME}:{pathway_id}"
+            graph.add_node('Pathway', pathway_key, {'key': pathway_key, 'id': pathway_id, 'name': pathway_name,
+                                                    'source': kegg.KEGG_DB_NAME, 'created_at': created_at})
+        for pathway_id in pathway_ids:
+            pathway_key = f"{kegg.KEGG_DB_NAME}:{pathway_id}"
+            for target_key in target_keys_by_name[gene_symbol]:
+                graph.add_relationship('PART_OF_PATHWAY', target_key, pathway_key, (target_key, pathway_key),
+                                       {'created_at': created_at})
+
+
+if __name__ == "__main__":
+    configure_from_argv(sys.argv)
+    stages = []
+    out_dir = DEFAULT_OUT_DIR
+    for arg in sys.argv[1:]:
+        option, _, value = arg.partition('=')
+        if option == '--mirbase':
+            stages.append(('mirbase', value.split(':', 2)))
+        elif option in ('--targetscan', '--rna22', '--pictar', '--mirtarbase'):
+            stages.append((option[2:], value.rsplit(':', 1)))
+        elif option == '--mature':
+            stages.append(('mature', [value or mirbase.MATURE_FA_FILE]))
+        elif option == '--kegg':
+            stages.append(('kegg', []))
+        elif option == '--out':
+            out_dir = value
+
+    if not any(stage == 'mirbase' for stage, _ in stages) or any(len(args) != {'mirbase': 3, 'mature': 1, 'kegg': 0}.get(stage, 2) for stage, args in stages):
+        print("Usage: %s --mirbase=<miRNA.dat>:<species prefix>:<species name> [...] [--mature[=<mature.fa>]] [--out=<dir>]" % sys.argv[0])
+        print("\t[--targetscan=<Predicted_Targets_Info file>:<species prefix>, once per species file] [--rna22=<tsv file>:<relation name>]")
+        print("\t[--pictar=<bed file>:<relation name>] [--mirtarbase=<csv file>:<species prefix>] [--kegg]")
+        print("\tto write neo4j-admin import CSVs for a full rebuild (default --out=%s)" % DEFAULT_OUT_DIR)
+        exit()
+
+    graph = CsvGraphWriter(out_dir)
+    mirnas = MirnaResolver()
+    stage_functions = {'mirbase': export_mirbase, 'mature': export_mature, 'targetscan': export_targetscan, 'rna22': export_rna22,
+                       'pictar': export_pictar, 'mirtarbase': export_mirtarbase}
+    # microRNA nodes (and their sequences) first, KEGG last (it walks the exported Targets), the rest in the given order
+    ordered_stages = [s for s in stages if s[0] == 'mirbase'] + \
+                     [s for s in stages if s[0] == 'mature'] + \
+                     [s for s in stages if s[0] not in ('mirbase', 'mature', 'kegg')] + \
+                     [s for s in stages if s[0] == 'kegg']
+    try:
+        for stage, args in ordered_stages:
+            if stage == 'kegg':
+                export_kegg(graph)
+            else:
+                stage_functions[stage](graph, mirnas, *args)
+    finally:
+        close_resolvers()
+
+    print(f"Writing import files to {out_dir}")
+    node_files, relationship_files = graph.write()
+    print("Load them into an empty database (with the database stopped) using:\n")
+    print(import_command(node_files, relationship_files))
@@ -0,0 +1,113 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data'))
+DEFAULT_CACHE_FILE = os.path.join(BASE_DATA_DIR, 'http_cache.sqlite')
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Access times are only rewritten when older than this, so hits stay read-only most of the time.
+ACCESS_TIME_RESOLUTION_SECONDS = 60
+# The total size is re-checked (and the cache trimmed) every this many stores.
+EVICTION_CHECK_INTERVAL = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS response (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    body BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS response_accessed_idx ON response (accessed);
+"""
+
+
+def request_key(method, full_url_str, body=None):
+    """Content address of a request: sha256 over method, URL and the sha256 of the body."""
+    body_hash = hashlib.sha256(body or b'').hexdigest()
+    return hashlib.sha256(f"{method.upper()}\n{full_url_str}\n{body_hash}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of decoded response texts, zlib-compressed in a SQLite file.
+    Entries expire after ttl_seconds; once the compressed total exceeds max_bytes
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, ttl_seconds=DEFAULT_TTL_SECONDS, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_file = cache_file
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._store_count = 0
+        self._store_count_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.cache_file, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Returns the cached text for key, or None if absent or expired."""
+        conn = self._conn()
+        row = conn.execute("SELECT created, accessed, body FROM response WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        created, accessed, body = row
+        now = time.time()
+        if self.ttl_seconds and now - created > self.ttl_seconds:
+            with conn:
+                conn.execute("DELETE FROM response WHERE key = ?", (key,))
+            return None
+        if now - accessed > ACCESS_TIME_RESOLUTION_SECONDS:
+            with conn:
+                conn.execute("UPDATE response SET accessed = ? WHERE key = ?", (now, key))
+        return zlib.decompress(body).decode('utf-8')
+
+    def put(self, key, full_url_str, text):
+        body = zlib.compress(text.encode('utf-8'), 6)
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO response (key, url, created, accessed, size, body)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (key, full_url_str, now, now, len(body), body))
+        with self._store_count_lock:
+            self._store_count += 1
+            check_now = self._store_count % EVICTION_CHECK_INTERVAL == 0
+        if check_now:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries, then least recently used ones until the cache fits in max_bytes."""
+        conn = self._conn()
+        with conn:
+            if self.ttl_seconds:
+                conn.execute("DELETE FROM response WHERE created < ?", (time.time() - self.ttl_seconds,))
+            total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+            if not self.max_bytes or total_bytes <= self.max_bytes:
+                return
+            excess = total_bytes - self.max_bytes
+            evicted_keys = []
+            for key, size in conn.execute("SELECT key, size FROM response ORDER BY accessed"):
+                evicted_keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM response WHERE key = ?", evicted_keys)
+        print(f"HTTP Cache: Evicted {len(evicted_keys)} least recently used responses.")
@@ -1,14 +1,27 @@
 print("Starting kegg_analysis_fixed_resumable.py...")
-import requests
-import time 
 import os   
-from dbhelper import db_connect, create_db_info
+import sys
+from download import url_request, url_request_many, configure_from_argv
+from dbhelper import db_connect, create_db_info, ensure_schema, BulkWriter
 
 species_code = "hsa"  
 KEGG_DB_NAME = "KEGG"
 KEGG_BASE_URL = "https://rest.kegg.jp"
 PROGRESS_FILE = "data/kegg/kegg_analysis_progress.txt" 
-API_DELAY_SECONDS = 0.5 
+# KEGG request pacing (rest.kegg.jp) is handled by the per-host rate limiter in download.py.
+
+PATHWAY_UPSERT_TEMPLATE = """
+    MERGE (p:Pathway {id: row.pathway_id, source: row.source})
+    ON CREATE SET p.name = row.pathway_name, p.created_at = timestamp()
+    ON MATCH SET p.name = row.pathway_name, p.updated_at = timestamp()
+"""
+
+GENE_PATHWAY_TEMPLATE = """
+    MATCH (t:Target {name: row.gene_symbol})
+    MATCH (p:Pathway {id: row.pathway_id, source: row.source})
+    MERGE (t)-[r:PART_OF_PATHWAY]->(p)
+    ON CREATE SET r.created_at = timestamp()
+"""
 
 def load_last_processed_index():
     """Loads the index of the last successfully processed gene."""
@@ -39,63 +52,55 @@ def get_kegg_gene_id(symbol):
     """Find KEGG gene ID (Entrez) for a symbol."""
     url = f"{KEGG_BASE_URL}/find/genes/{symbol}"
     print(f"  Querying KEGG Gene ID: {url}")
-    try:
-        response = requests.get(url, timeout=10) 
-        response.raise_for_status() 
-        print(f"  KEGG Gene ID URL Status: {response.status_code}")
-        for line in response.text.strip().split("\n"):
-            if line.startswith(f"{species_code}:"):
-                return line.split("\t")[0].split(":")[1]
-        print(f"  KEGG ID not found for symbol: {symbol}")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"  Error fetching KEGG Gene ID for {symbol}: {e}")
+    response_text = url_request(url, timeout_seconds=10)
+    if response_text is None:
+        print(f"  Error fetching KEGG Gene ID for {symbol}")
         return None
-    finally:
-        time.sleep(API_DELAY_SECONDS)
+    for line in response_text.strip().split("\n"):
+        if line.startswith(f"{species_code}:"):
+            return line.split("\t")[0].split(":")[1]
+    print(f"  KEGG ID not found for symbol: {symbol}")
+    return None
 
 def get_pathways_for_gene(entrez_id):
     """Return list of pathway IDs (e.g., mmu04630) for a given gene ID."""
     url = f"{KEGG_BASE_URL}/link/pathway/{species_code}:{entrez_id}"
     print(f"  Querying KEGG Pathways for {entrez_id}: {url}")
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        print(f"  KEGG Pathway URL Status: {response.status_code}")
-        results = []
-        for line in response.text.strip().split("\n"):
-            parts = line.split("\t")
-            if len(parts) < 2:
-                continue
-            if parts[1].startswith("path:"):
-                pathway_id = parts[1].split(":")[1] 
-                results.append(pathway_id)
-        return results
-    except requests.exceptions.RequestException as e:
-        print(f"  Error fetching pathways for {entrez_id}: {e}")
+    response_text = url_request(url, timeout_seconds=10)
+    if response_text is None:
+        print(f"  Error fetching pathways for {entrez_id}")
         return []
-    finally:
-        time.sleep(API_DELAY_SECONDS)
+    results = []
+    for line in response_text.strip().split("\n"):
+        parts = line.split("\t")
+        if len(parts) < 2:
+            continue
+        if parts[1].startswith("path:"):
+            pathway_id = parts[1].split(":")[1] 
+            results.append(pathway_id)
+    return results
+
+def _parse_pathway_name(pathway_id, response_text):
+    if response_text is None:
+        print(f"  Error fetching pathway name for {pathway_id}")
+        return "Unknown Pathway (API Error)"
+    for line in response_text.strip().split("\n"):
+        if line.startswith("NAME"):
+            return line.split("NAME")[1].strip().split(" - ")[0] 
+    print(f"  Pathway name not found for: {pathway_id}")
+    return "Unknown Pathway"
 
 def get_pathway_name(pathway_id):
     """Fetch human-readable name of a pathway."""
-    full_pathway_id_for_kegg = f"path:{pathway_id}" 
     url = f"{KEGG_BASE_URL}/get/{pathway_id}" 
     print(f"  Querying KEGG Pathway Name for {pathway_id}: {url}")
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        print(f"  KEGG Pathway Name URL Status: {response.status_code}")
-        for line in response.text.strip().split("\n"):
-            if line.startswith("NAME"):
-                return line.split("NAME")[1].strip().split(" - ")[0] 
-        print(f"  Pathway name not found for: {pathway_id}")
-        return "Unknown Pathway"
-    except requests.exceptions.RequestException as e:
-        print(f"  Error fetching pathway name for {pathway_id}: {e}")
-        return "Unknown Pathway (API Error)"
-    finally:
-        time.sleep(API_DELAY_SECONDS)
+    return _parse_pathway_name(pathway_id, url_request(url, timeout_seconds=10))
+
+def get_pathway_names(pathway_ids):
+    """Fetch the names of several pathways concurrently; returns names in the order of pathway_ids."""
+    requests_list = [{'full_url_str': f"{KEGG_BASE_URL}/get/{pid}", 'timeout_seconds': 10} for pid in pathway_ids]
+    responses = url_request_many(requests_list)
+    return [_parse_pathway_name(pid, text) for pid, text in zip(pathway_ids, responses)]
 
 def fetch_genes_from_db():
     """Fetch gene symbols from the Neo4j database (nodes labeled 'Target')."""
@@ -117,29 +122,19 @@ def is_gene_kegg_processed_in_db(session, gene_symbol):
     record = result.single()
     return record["is_processed"] if record else False
 
-def add_pathway_to_db(pathway_id, pathway_name):
-    """Add a pathway node to the Neo4j database."""
-    with db_connect() as session:
-        session.run("""
-            MERGE (p:Pathway {id: $pathway_id, source: $source})
-            ON CREATE SET p.name = $pathway_name, p.created_at = timestamp()
-            ON MATCH SET p.name = $pathway_name, p.updated_at = timestamp()
-            """, pathway_id=pathway_id, pathway_name=pathway_name, source=KEGG_DB_NAME)
-        print(f"  Added/Merged pathway: {pathway_id} - {pathway_name}")
-
-def connect_gene_to_pathway(gene_symbol, pathway_id):
-    """Connect a 'Target' node (representing a gene) to a 'Pathway' node."""
-    with db_connect() as session:
-        session.run("""
-            MATCH (t:Target {name: $gene_symbol})
-            MATCH (p:Pathway {id: $pathway_id, source: $kegg_db_name})
-            MERGE (t)-[r:PART_OF_PATHWAY]->(p)
-            ON CREATE SET r.created_at = timestamp()
-            """, gene_symbol=gene_symbol, pathway_id=pathway_id, kegg_db_name=KEGG_DB_NAME)
-        print(f"  Connected gene {gene_symbol} to pathway {pathway_id}")
+def add_pathway_to_db(writer, pathway_id, pathway_name):
+    """Queue a pathway node upsert on the bulk writer."""
+    writer.add(PATHWAY_UPSERT_TEMPLATE, {'pathway_id': pathway_id, 'pathway_name': pathway_name, 'source': KEGG_DB_NAME})
+    print(f"  Queued pathway: {pathway_id} - {pathway_name}")
+
+def connect_gene_to_pathway(writer, gene_symbol, pathway_id):
+    """Queue the connection of a 'Target' node (representing a gene) to a 'Pathway' node."""
+    writer.add(GENE_PATHWAY_TEMPLATE, {'gene_symbol': gene_symbol, 'pathway_id': pathway_id, 'source': KEGG_DB_NAME})
+    print(f"  Queued connection of gene {gene_symbol} to pathway {pathway_id}")
 
 def main():
     """Main logic to fetch genes from DB, get KEGG pathways, and update DB."""
+    ensure_schema()
     print("Initializing KEGG database info...")
     create_db_info(KEGG_DB_NAME, KEGG_BASE_URL)
 
@@ -158,8 +153,13 @@ def main():
 
     genes_processed_this_run = 0
     genes_skipped_this_run = 0
+    # Progress is saved when the writer commits, so the file never runs ahead of the database.
+    progress = {'last_completed_idx': last_processed_idx}
+
+    def save_committed_progress():
+        save_last_processed_index(progress['last_completed_idx'])
 
-    with db_connect() as db_session_for_checks:
+    with db_connect() as db_session_for_checks, BulkWriter(on_flush=save_committed_progress, templates=(PATHWAY_UPSERT_TEMPLATE, GENE_PATHWAY_TEMPLATE)) as writer:
         for current_idx in range(total_genes):
             gene_symbol = all_genes_from_db[current_idx]
 
@@ -171,14 +171,14 @@ def main():
 
             if is_gene_kegg_processed_in_db(db_session_for_checks, gene_symbol):
                 print(f"  INFO: {gene_symbol} already has KEGG pathways in DB. Skipping API calls and marking as processed.")
-                save_last_processed_index(current_idx) 
+                progress['last_completed_idx'] = current_idx
                 genes_skipped_this_run +=1
                 continue
 
             entrez_id = get_kegg_gene_id(gene_symbol)
             if not entrez_id:
                 print(f"  ❌ {gene_symbol}: Gene symbol not found in KEGG or API error.")
-                save_last_processed_index(current_idx)
+                progress['last_completed_idx'] = current_idx
                 genes_processed_this_run +=1
                 continue
 
@@ -187,18 +187,19 @@ def main():
 
             if pathways:
                 print(f"  ✅ {gene_symbol} (Entrez ID {entrez_id}) is involved in {len(pathways)} pathway(s):")
-                for pid in pathways:
-                    pname = get_pathway_name(pid)
+                for pid, pname in zip(pathways, get_pathway_names(pathways)):
                     print(f"    - {pid}: {pname}")
-                    add_pathway_to_db(pid, pname)
-                    connect_gene_to_pathway(gene_symbol, pid)
+                    add_pathway_to_db(writer, pid, pname)
+                    connect_gene_to_pathway(writer, gene_symbol, pid)
             else:
                 print(f"  ⚠️ {gene_symbol} (Entrez ID {entrez_id}) has no known KEGG pathways or API error during pathway fetch.")
 
-            save_last_processed_index(current_idx)
+            progress['last_completed_idx'] = current_idx
             genes_processed_this_run +=1
             print(f"  --- Finished processing {gene_symbol} ---")
 
+    save_committed_progress()
+
 
     print("\n========================================")
     print("KEGG Analysis Complete.")
@@ -209,6 +210,7 @@ def main():
     print("========================================")
 
 if __name__ == "__main__":
+    configure_from_argv(sys.argv)
     try:
         main()
     except KeyboardInterrupt:
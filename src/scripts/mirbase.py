@@ -1,76 +1,233 @@
 import sys
 import re
-from dbhelper import db_connect
+import gzip
+from dbhelper import BulkWriter, ensure_schema, close_driver, BULK_MAX_BATCH_SIZE
+from mirna_seeds import SeedIndex, SEED_INDEX_FILE, normalize_sequence, seed_of
 
+MATURE_FA_FILE = '../data/mirbase/mature.fa'
+
+# Nodes of the former name-keyed loader take over the accession of the record with their name
+MIRNA_ADOPT_TEMPLATE = """
+    MATCH (m:microRNA {name: row.id})
+    SET m.accession = row.accession, m.mirbase_link = row.accession
+"""
+
+MIRNA_UPSERT_TEMPLATE = """
+    MERGE (m:microRNA {accession: row.accession})
+    ON CREATE SET m.name = row.id, m.species = row.species, m.mirbase_link = row.accession
+    ON MATCH SET  m.name = row.id, m.species = row.species
 """
-Store a microRNA in the db if not already there.
-Return True if the new node is created.
 
-Parameters
-----------
-miRNA : dict
-    microRNA properties for the new node creation.
+MATURE_SEQUENCE_TEMPLATE = """
+    MATCH (m:microRNA {accession: row.accession})
+    SET m.sequence = row.sequence, m.seed = row.seed
 """
-def store_miRNA(miRNA):
-    try:
-        r = session.run("MATCH (m:microRNA {name: $id}) RETURN m", miRNA)
-        record = r.single()
-        if record:
-            print(f"✅ Found existing microRNA in DB: {record['m']}")
-        else:
-            raise Exception("No match found")
-    except Exception as e:
-        print(f"⚠️ MATCH failed or not found for microRNA {miRNA['id']}: {e}")
-        try:
-            session.run("""
-                CREATE (m:microRNA {
-                    name: $id,
-                    accession: $accession,
-                    species: $species,
-                    mirbase_link: $accession
-                })
-            """, miRNA)
-            print(f"➕ Created new microRNA node: {miRNA['id']}")
-            return True
-        except Exception as e2:
-            print(f"❌ CREATE failed for microRNA {miRNA['id']}: {e2}")
-    return False
-
-if len(sys.argv) < 4:
-    print("Usage: %s <mirbase .dat file> <species name, ex. 'Homo sapiens'>"
-          " <species prefix, ex. hsa>" % sys.argv[0])
-    exit()
-
-session = db_connect()
-
-with open(sys.argv[1], 'r') as f:
-    data = {}
-    in_data_block = False
-    previous_line = ''
-
-    for line in f:
-        if line.startswith('ID') and line.split()[1].startswith(sys.argv[3]):
-            in_data_block = True
-            data = {'id': line.split()[1], 'species': sys.argv[2]}
-            if previous_line.startswith('AC'):
-                data['accession'] = line.split()[1]
-                store_miRNA(data)
-
-        elif in_data_block:
-            if line.startswith('AC'):
-                data['accession'] = line.split()[1][:-1]
-                store_miRNA(data)
-
-            if '/accession=' in line:
-                data['accession'] = re.search(r'/accession="([^"]+)"', line).group(1)
+
+def open_mirbase(dat_file):
+    """Opens a miRBase file (miRNA.dat, mature.fa) for reading as text, gzipped or not."""
+    if dat_file.endswith('.gz'):
+        return gzip.open(dat_file, 'rt')
+    return open(dat_file, 'r')
+
+def iter_mirbase_records(dat_file, species_by_prefix):
+    """
+    Yields a {'id', 'accession', 'species', 'kind'} record for every precursor (ID/AC lines, kind 'precursor')
+    and mature product (FT /accession= + /product=, kind 'mature') in a miRBase .dat file
+    whose ID prefix (e.g. hsa in hsa-mir-21) is a key of species_by_prefix.
+    A mature product shared by several precursors is yielded once per precursor.
+    """
+    with open_mirbase(dat_file) as f:
+        species_name = None
+        mature_accession = None
+
+        for line in f:
+            if line.startswith('ID'):
+                precursor_id = line.split()[1]
+                species_name = species_by_prefix.get(precursor_id.split('-')[0])
+
+            elif species_name is None:
+                continue
+
+            elif line.startswith('AC'):
+                yield {'id': precursor_id, 'accession': line.split()[1].rstrip(';'), 'species': species_name, 'kind': 'precursor'}
+
+            elif '/accession=' in line:
+                mature_accession = re.search(r'/accession="([^"]+)"', line).group(1)
 
             elif '/product=' in line:
-                data['id'] = re.search(r'/product="([^"]+)"', line).group(1)
-                store_miRNA(data)
+                if mature_accession:
+                    yield {'id': re.search(r'/product="([^"]+)"', line).group(1), 'accession': mature_accession,
+                           'species': species_name, 'kind': 'mature'}
+                mature_accession = None
 
             elif line.startswith('//'):
-                in_data_block = False
+                species_name = None
+                mature_accession = None
+
+def collect_mirbase_records(dat_file, species_by_prefix):
+    """One pass over the .dat file; returns {accession: record} with each accession kept once."""
+    records = {}
+    for record in iter_mirbase_records(dat_file, species_by_prefix):
+        records.setdefault(record['accession'], record)
+    return records
+
+def existing_mirna_nodes(session):
+    """[(node element ID, name, accession)] of every microRNA node in the graph."""
+    result = session.run("MATCH (m:microRNA) RETURN elementId(m) AS node, m.name AS name, m.accession AS accession")
+    return [(record['node'], record['name'], record['accession']) for record in result]
+
+def plan_mirna_upserts(records, existing_nodes):
+    """
+    Splits the records against the existing nodes into (adopt, upsert, conflicts):
+      adopt      records whose accession has no node yet but whose name has one (a node of the former
+                 name-keyed loader, with no or a stale accession); that node gets the accession
+      upsert     records to MERGE on accession (all of them but the conflicts)
+      conflicts  records whose accession and name belong to two different nodes; writing them would
+                 break the unique name constraint, so they are left to a manual merge
+    """
+    node_by_accession = {accession: node for node, _, accession in existing_nodes if accession}
+    node_by_name = {name: node for node, name, _ in existing_nodes if name}
+    adopt, upsert, conflicts = [], [], []
+    for record in records:
+        accession_node = node_by_accession.get(record['accession'])
+        name_node = node_by_name.get(record['id'])
+        if accession_node is None and name_node is not None:
+            adopt.append(record)
+            node_by_accession[record['accession']] = name_node
+        elif accession_node is not None and name_node is not None and accession_node != name_node:
+            conflicts.append(record)
+            continue
+        upsert.append(record)
+    return adopt, upsert, conflicts
+
+def import_mirbase(dat_file, species_by_prefix):
+    """
+    Upserts every precursor and mature miRNA of the species, keyed on accession, in UNWIND batches.
+    Nodes keyed by name by the former loader are matched on name when their accession is not found.
+    """
+    ensure_schema()
+    records = collect_mirbase_records(dat_file, species_by_prefix)
+    with BulkWriter(batch_size=max(1, min(len(records), BULK_MAX_BATCH_SIZE)),
+                    templates=(MIRNA_ADOPT_TEMPLATE, MIRNA_UPSERT_TEMPLATE)) as writer:
+        existing_nodes = existing_mirna_nodes(writer.session)
+        adopt, upsert, conflicts = plan_mirna_upserts(records.values(), existing_nodes)
+        for record in adopt:
+            writer.add(MIRNA_ADOPT_TEMPLATE, {'id': record['id'], 'accession': record['accession']})
+        for record in upsert:
+            writer.add(MIRNA_UPSERT_TEMPLATE, {'id': record['id'], 'accession': record['accession'], 'species': record['species']})
+        writer.flush()
+        counters = writer.counters(MIRNA_UPSERT_TEMPLATE)
+
+    print(f"miRBase: {len(records)} microRNAs from {dat_file} for {', '.join(sorted(species_by_prefix))}")
+    for prefix, species_name in sorted(species_by_prefix.items()):
+        species_records = [r for r in records.values() if r['species'] == species_name]
+        precursor_count = sum(1 for r in species_records if r['kind'] == 'precursor')
+        print(f"  {prefix} ({species_name}): {precursor_count} precursors, {len(species_records) - precursor_count} mature")
+    print(f"  Nodes created: {counters.get('nodes_created', 0)}, "
+          f"existing nodes updated: {len(upsert) - counters.get('nodes_created', 0)} "
+          f"({len(adopt)} matched on name and given their accession)")
+    if conflicts:
+        examples = ', '.join(f"{record['id']} ({record['accession']})" for record in conflicts[:5])
+        print(f"  Warning: {len(conflicts)} microRNAs skipped, their accession and name are on two different nodes "
+              f"(merge them by hand), e.g. {examples}")
+    duplicate_names = len(existing_nodes) - len({name for _, name, _ in existing_nodes})
+    if duplicate_names:
+        print(f"  Warning: {duplicate_names} microRNA nodes share their name with another node; "
+              f"the unique constraint on microRNA.name is only created once they are merged.")
+
+def iter_mature_sequences(fa_file, species_by_prefix):
+    """
+    Yields {'id', 'accession', 'sequence', 'seed'} for every mature miRNA of the species in mature.fa
+    (header lines like '>hsa-miR-21-5p MIMAT0000076 Homo sapiens miR-21-5p'), or of all species
+    if species_by_prefix is None.
+    """
+    def record(header, sequence_lines):
+        fields = header[1:].split()
+        if len(fields) < 2 or (species_by_prefix is not None and fields[0].split('-')[0] not in species_by_prefix):
+            return None
+        sequence = normalize_sequence(''.join(sequence_lines))
+        return {'id': fields[0], 'accession': fields[1], 'sequence': sequence, 'seed': seed_of(sequence)}
+
+    with open_mirbase(fa_file) as f:
+        header, sequence_lines = None, []
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                mature = record(header, sequence_lines) if header else None
+                if mature:
+                    yield mature
+                header, sequence_lines = line, []
+            elif line:
+                sequence_lines.append(line)
+        mature = record(header, sequence_lines) if header else None
+        if mature:
+            yield mature
+
+def import_mature_sequences(fa_file, species_by_prefix, seed_index_file=SEED_INDEX_FILE):
+    """
+    Stores sequence and seed (nt 2-8) on the mature microRNA nodes of the species, matched by
+    accession, and writes the seed -> miRNA index of every species in the file to seed_index_file,
+    so importing one species after another does not drop the earlier ones from the index.
+    """
+    all_matures = list(iter_mature_sequences(fa_file, None))
+    matures = [mature for mature in all_matures if mature['id'].split('-')[0] in species_by_prefix]
+    with BulkWriter(batch_size=max(1, min(len(matures), BULK_MAX_BATCH_SIZE))) as writer:
+        for mature in matures:
+            writer.add(MATURE_SEQUENCE_TEMPLATE, {'accession': mature['accession'], 'sequence': mature['sequence'], 'seed': mature['seed']})
+        writer.flush()
+        properties_set = writer.counters(MATURE_SEQUENCE_TEMPLATE).get('properties_set', 0)
+
+    seed_index = SeedIndex.from_records((mature['id'], mature['seed']) for mature in all_matures)
+    seed_index.save(seed_index_file)
+    print(f"miRBase: {len(matures)} mature sequences from {fa_file} ({properties_set} properties set)")
+    print(f"  Seed index: {len(seed_index)} miRNAs, {len(seed_index.seed_groups(min_size=1))} distinct seeds -> {seed_index_file}")
+
+def print_seed_matches(query, seed_index_file=SEED_INDEX_FILE):
+    """Prints the miRNAs sharing a seed, given the 7-nt seed itself or a miRNA name."""
+    seed_index = SeedIndex.load(seed_index_file)
+    seed = seed_index.seed_of_mirna(query) or normalize_sequence(query)
+    mirnas = seed_index.mirnas_with_seed(seed)
+    print(f"Seed {seed}: {len(mirnas)} miRNAs")
+    for name in mirnas:
+        print(f"  {name}")
+
+def parse_species_args(args):
+    """['hsa=Homo sapiens', 'mmu=Mus musculus'] -> {'hsa': 'Homo sapiens', 'mmu': 'Mus musculus'}"""
+    species_by_prefix = {}
+    for arg in args:
+        prefix, _, species_name = arg.partition('=')
+        species_by_prefix[prefix.strip()] = species_name.strip()
+    return species_by_prefix
+
+if __name__ == "__main__":
+    mature_fa_file = None
+    seed_index_file = SEED_INDEX_FILE
+    for arg in list(sys.argv[1:]):
+        if arg == '--mature' or arg.startswith('--mature='):
+            mature_fa_file = arg.split('=', 1)[1] if '=' in arg else MATURE_FA_FILE
+            sys.argv.remove(arg)
+        elif arg.startswith('--seed-index='):
+            seed_index_file = arg.split('=', 1)[1]
+            sys.argv.remove(arg)
+
+    if len(sys.argv) == 3 and sys.argv[1] == 'seed':
+        print_seed_matches(sys.argv[2], seed_index_file)
+        exit()
 
-        previous_line = line
+    if len(sys.argv) == 4 and '=' not in sys.argv[2] + sys.argv[3]:
+        # original form: <dat file> <species name> <species prefix>
+        species_by_prefix = {sys.argv[3]: sys.argv[2]}
+    elif len(sys.argv) >= 3 and all('=' in arg for arg in sys.argv[2:]):
+        species_by_prefix = parse_species_args(sys.argv[2:])
+    else:
+        print("Usage: %s <miRNA.dat[.gz]> <species prefix>=<species name> [...], ex. hsa='Homo sapiens' mmu='Mus musculus'" % sys.argv[0])
+        print("Usage: %s <miRNA.dat[.gz]> <species name, ex. 'Homo sapiens'> <species prefix, ex. hsa>" % sys.argv[0])
+        print("\t[--mature[=<mature.fa[.gz]>]] also stores sequences/seeds and writes the seed index of all its species [--seed-index=<file>]")
+        print("Usage: %s seed <7-nt seed | miRNA name> [--seed-index=<file>]" % sys.argv[0])
+        print("\tto list the miRNAs sharing a seed")
+        exit()
 
-session.close()
+    import_mirbase(sys.argv[1], species_by_prefix)
+    if mature_fa_file:
+        import_mature_sequences(mature_fa_file, species_by_prefix, seed_index_file)
+    close_driver()
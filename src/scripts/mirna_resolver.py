@@ -0,0 +1,279 @@
+"""
+In-memory miRNA name resolution shared by the importers.
+
+All microRNA names/accessions are loaded once (from the graph or from miRBase records)
+into lowercase hash maps plus a family-letter index, and the miRBase aliases and the
+PicTar name->accession map are read once, so resolving a tool's miRNA name never
+queries the database or rescans a file. Results are memoized per tool name.
+"""
+import re
+
+MIRBASE_ALIASES_FILE = '../data/mirbase/aliases.txt'
+PICTAR_MIRNA_ACCESSION_MAP_FILE = '../data/pictar/mirna_accession.dat'
+
+FAMILY_LETTERS = "abcdef"
+
+# (base incl. number)(family letter)(arm)(rest), e.g. hsa-mir-23 | a | -3p | ''
+FAMILY_NAME_PATTERN = re.compile(r'^(.*?mir-\d+|.*?let-\d+)([a-zA-Z])?(-[35]p)?(.*)$')
+
+
+def unique_ordered_candidates(candidates_list):
+    """
+    Returns a list with unique elements, preserving the original order.
+    """
+    seen = set()
+    return [x for x in candidates_list if not (x in seen or seen.add(x))]
+
+
+def targetscan_candidates(targetscan_mirna_tool_name, species_prefix):
+    """
+    Normalizes a TargetScan miRNA name and returns (name with species prefix, direct candidates),
+    the candidates being the name, the name without a '.1'-style suffix, and their -5p/-3p variants.
+    """
+    base_candidate_with_species = targetscan_mirna_tool_name.strip().lower()
+    if not base_candidate_with_species.startswith(species_prefix.lower() + "-"):
+        if base_candidate_with_species.startswith("mir-") or base_candidate_with_species.startswith("let-"):
+            base_candidate_with_species = species_prefix.lower() + "-" + base_candidate_with_species
+        else:
+            base_candidate_with_species = species_prefix.lower() + "-mir-" + base_candidate_with_species
+
+    direct_candidates = [base_candidate_with_species]
+    # Handle tool-specific suffixes like ".1", ".2"
+    if '.' in base_candidate_with_species:
+        parts = base_candidate_with_species.rsplit('.', 1)
+        if parts[1].isdigit() or (len(parts[1]) == 1 and 'A' <= parts[1].upper() <= 'Z'):
+            direct_candidates.append(parts[0])
+
+    # Add -5p/-3p variants for names that lack them
+    for candidate in list(direct_candidates):
+        if not (candidate.endswith("-5p") or candidate.endswith("-3p")):
+            direct_candidates.append(candidate + "-5p")
+            direct_candidates.append(candidate + "-3p")
+
+    return base_candidate_with_species, unique_ordered_candidates(direct_candidates)
+
+
+def pictar_candidates(pictar_miRNA_name_original):
+    """
+    Normalizes a PicTar miRNA name and returns (processed_name, candidate lowercase miRBase names),
+    the candidates in the order they should be tried (star arms, -5p/-3p, family letters).
+    """
+    original_lc_stripped = pictar_miRNA_name_original.strip().lower()
+
+    name_normalized = original_lc_stripped.replace("_star", "-star")
+    name_normalized = name_normalized.replace("*", "-star")
+    name_normalized = name_normalized.replace("_", "-")
+
+    processed_name_for_logic = name_normalized
+    if not processed_name_for_logic.startswith("hsa-"):
+        processed_name_for_logic = "hsa-" + processed_name_for_logic
+
+    search_candidates = [processed_name_for_logic]
+    if original_lc_stripped != processed_name_for_logic and original_lc_stripped.startswith("hsa-"):
+        search_candidates.insert(0, original_lc_stripped)
+
+    if processed_name_for_logic.endswith("-star"):
+        base_name_if_star = processed_name_for_logic[:-len("-star")]
+        for fam_sfx in ["", "a", "b", "c", "d", "e"]:
+            if fam_sfx and base_name_if_star.endswith(fam_sfx): continue
+            for arm_sfx in ["-5p", "-3p"]:
+                search_candidates.append(base_name_if_star + fam_sfx + arm_sfx)
+    else:
+        has_arm = processed_name_for_logic.endswith("-5p") or processed_name_for_logic.endswith("-3p")
+
+        temp_name_for_family_check = processed_name_for_logic
+        if temp_name_for_family_check.endswith("-5p"): temp_name_for_family_check = temp_name_for_family_check[:-3]
+        if temp_name_for_family_check.endswith("-3p"): temp_name_for_family_check = temp_name_for_family_check[:-3]
+
+        has_family_letter = len(temp_name_for_family_check) > len("hsa-mir-X") and temp_name_for_family_check[-1].isalpha()
+
+        if not has_arm:
+            search_candidates.append(processed_name_for_logic + "-5p")
+            search_candidates.append(processed_name_for_logic + "-3p")
+
+        if not has_family_letter:
+            for fam_sfx in ["a", "b", "c", "d", "e"]:
+                candidate_with_family = processed_name_for_logic + fam_sfx
+                search_candidates.append(candidate_with_family)
+                if not has_arm:
+                    search_candidates.append(candidate_with_family + "-5p")
+                    search_candidates.append(candidate_with_family + "-3p")
+
+    return processed_name_for_logic, unique_ordered_candidates(search_candidates)
+
+
+class MirnaResolver:
+    """
+    Resolves tool miRNA names against a preloaded set of microRNA {'name', 'accession'} records.
+
+    Usage:
+        with db_connect() as session:
+            resolver = MirnaResolver.from_graph(session)
+        resolver.resolve_targetscan('miR-23-3p', 'hsa')   # -> [{'name': 'hsa-miR-23a-3p', ...}, ...]
+    """
+
+    def __init__(self, records=(), aliases_file=MIRBASE_ALIASES_FILE, pictar_map_file=PICTAR_MIRNA_ACCESSION_MAP_FILE):
+        self.by_lower_name = {}
+        self.by_name = {}
+        self.by_accession = {}
+        self.family_index = {}
+        self.aliases_file = aliases_file
+        self.pictar_map_file = pictar_map_file
+        self._aliases = None
+        self._pictar_map = None
+        self._memo = {}
+        for record in records:
+            self.add(record['name'], record['accession'])
+
+    @classmethod
+    def from_graph(cls, session, **kwargs):
+        """Loads every microRNA node with one query."""
+        result = session.run("MATCH (m:microRNA) WHERE m.name IS NOT NULL RETURN m.name AS name, m.accession AS accession")
+        resolver = cls([{'name': record['name'], 'accession': record['accession']} for record in result], **kwargs)
+        print(f"miRNA resolver: loaded {len(resolver.by_name)} microRNA names from the database.")
+        return resolver
+
+    def add(self, name, accession):
+        """Adds one microRNA; a name already known is ignored."""
+        if name in self.by_name:
+            return
+        record = {'name': name, 'accession': accession}
+        self.by_name[name] = record
+        self.by_lower_name.setdefault(name.lower(), []).append(record)
+        if accession:
+            self.by_accession.setdefault(accession, []).append(record)
+        match = FAMILY_NAME_PATTERN.match(name.lower())
+        if match:
+            base_part, family_letter, arm, rest = match.groups()
+            if family_letter and family_letter in FAMILY_LETTERS:
+                family = self.family_index.setdefault((base_part, (arm or '') + (rest or '')), {})
+                family.setdefault(family_letter, []).append(record)
+        self._memo.clear()
+
+    def find_by_name(self, name):
+        """The record with exactly this name, or None."""
+        return self.by_name.get(name)
+
+    def find_by_lower_name(self, name_lc):
+        return list(self.by_lower_name.get(name_lc, []))
+
+    def find_by_accession(self, accession):
+        return list(self.by_accession.get(accession, []))
+
+    def name_for_accession(self, accession):
+        """Name of the first microRNA with the accession, or None."""
+        records = self.by_accession.get(accession) if accession else None
+        return records[0]['name'] if records else None
+
+    def find_family(self, name_lc):
+        """
+        Family members of a name without a family letter, e.g. hsa-mir-23-3p -> hsa-mir-23a-3p, hsa-mir-23b-3p,
+        in family letter order (a-f). Returns [] for a name that already has a letter.
+        """
+        match = FAMILY_NAME_PATTERN.match(name_lc)
+        if not match or match.group(2):
+            return []
+        base_part, _, arm, rest = match.groups()
+        family = self.family_index.get((base_part, (arm or '') + (rest or '')), {})
+        return [record for letter in FAMILY_LETTERS for record in family.get(letter, [])]
+
+    def _load_aliases(self):
+        """
+        Reads the miRBase aliases file once into {lowercase old name: [('accession'|'name', value)]}.
+        Accepts miRBase's '<accession>\\t<name>;<name>;...' lines and '<x>;<old id>;<new accession>;<new id>' lines.
+        """
+        self._aliases = {}
+        try:
+            with open(self.aliases_file, 'r', encoding='utf-8') as f_aliases:
+                for line in f_aliases:
+                    line = line.strip()
+                    if '\t' in line:
+                        accession, _, names = line.partition('\t')
+                        for alias_name in names.split(';'):
+                            if alias_name.strip():
+                                self._aliases.setdefault(alias_name.strip().lower(), []).append(('accession', accession.strip()))
+                        continue
+                    parts = line.split(';')
+                    if len(parts) >= 4:
+                        old_id_alias, new_acc_alias, new_id_alias = parts[1].lower(), parts[2], parts[3].lower()
+                        target = ('name', new_id_alias) if new_id_alias else ('accession', new_acc_alias)
+                        self._aliases.setdefault(old_id_alias, []).append(target)
+        except FileNotFoundError:
+            print(f"Warning: miRBase aliases file not found: {self.aliases_file}")
+        except Exception as e_alias:
+            print(f"Warning: Error reading miRBase aliases file: {e_alias}")
+
+    def find_by_alias(self, name_lc):
+        """Records a (possibly retired) miRBase name now maps to, through the aliases file."""
+        if self._aliases is None:
+            self._load_aliases()
+        found_mirnas = []
+        for kind, value in self._aliases.get(name_lc, []):
+            records = self.find_by_lower_name(value) if kind == 'name' else self.find_by_accession(value)
+            found_mirnas.extend(record for record in records if record not in found_mirnas)
+        return found_mirnas
+
+    def _load_pictar_map(self):
+        self._pictar_map = {}
+        try:
+            with open(self.pictar_map_file, 'r', encoding='utf-8') as f_map:
+                for line in f_map:
+                    parts = line.strip().split('\t')
+                    if len(parts) == 2:
+                        self._pictar_map.setdefault(parts[0].lower(), parts[1])
+        except FileNotFoundError:
+            print(f"Warning: PicTar miRNA accession map file not found: {self.pictar_map_file}. Will use DB match for all miRNAs.")
+        except Exception as e_map:
+            print(f"Warning: Error reading PicTar miRNA map file '{self.pictar_map_file}': {e_map}")
+
+    def resolve_targetscan(self, targetscan_mirna_tool_name, species_prefix):
+        """
+        Maps a TargetScan miRNA name to miRBase names: the direct candidates first, then the
+        family members (e.g. miR-23 -> miR-23a, miR-23b), then the aliases file.
+        Returns a LIST of {'name', 'accession'} dictionaries, empty if nothing matched.
+        """
+        memo_key = ('targetscan', targetscan_mirna_tool_name, species_prefix)
+        if memo_key in self._memo:
+            return self._memo[memo_key]
+
+        base_candidate_with_species, direct_candidates = targetscan_candidates(targetscan_mirna_tool_name, species_prefix)
+        found_mirnas = [record for candidate in direct_candidates for record in self.find_by_lower_name(candidate)]
+        if not found_mirnas:
+            found_mirnas = self.find_family(base_candidate_with_species)
+        if not found_mirnas:
+            original_ts_name_lc = targetscan_mirna_tool_name.strip().lower()
+            found_mirnas = self.find_by_alias(original_ts_name_lc) or self.find_by_alias(base_candidate_with_species)
+            for record_alias in found_mirnas:
+                print(f"TargetScan miRNA Alias Match: '{targetscan_mirna_tool_name}' -> DB '{record_alias['name']}'")
+        if not found_mirnas:
+            print(f"⚠️ TargetScan: Could not map miRNA '{targetscan_mirna_tool_name}'.")
+
+        self._memo[memo_key] = found_mirnas
+        return found_mirnas
+
+    def resolve_pictar(self, pictar_miRNA_name_original):
+        """miRBase accession of a PicTar miRNA name (map file first, then name candidates), or None."""
+        memo_key = ('pictar', pictar_miRNA_name_original)
+        if memo_key in self._memo:
+            return self._memo[memo_key]
+
+        if self._pictar_map is None:
+            self._load_pictar_map()
+        accession = self._pictar_map.get(pictar_miRNA_name_original.lower())
+        if not accession:
+            processed_name_for_logic, candidates = pictar_candidates(pictar_miRNA_name_original)
+            accession = next((record['accession'] for candidate in candidates
+                              for record in self.find_by_lower_name(candidate) if record['accession']), None)
+            if not accession:
+                print(f"⚠️ Could not find miRBase accession for PicTar miRNA: {pictar_miRNA_name_original} (Processed as: '{processed_name_for_logic}', Tried: {candidates})")
+
+        self._memo[memo_key] = accession
+        return accession
+
+    def resolve_rna22(self, rna22_mirna_name):
+        """Stored name of an RNA22 miRNA name ('_' read as '-', case-insensitive), or None."""
+        memo_key = ('rna22', rna22_mirna_name)
+        if memo_key not in self._memo:
+            records = self.find_by_lower_name(rna22_mirna_name.replace('_', '-').lower())
+            self._memo[memo_key] = records[0]['name'] if records else None
+        return self._memo[memo_key]
@@ -0,0 +1,170 @@
+"""
+miRNA seed (nucleotides 2-8 of the mature sequence) helpers and a compact seed -> miRNA index.
+
+The index keeps one 2-byte seed code per miRNA and a CSR layout over all 4^7 possible seeds
+(offsets into an array of miRNA ordinals), so "which miRNAs share this seed" is two array
+reads and a slice. It is persisted as the raw arrays and loaded back with frombytes.
+"""
+import os
+import sys
+import struct
+from array import array
+
+SEED_INDEX_FILE = '../data/mirbase/seed_index.bin'
+SEED_START = 1  # 0-based offset of nucleotide 2
+SEED_LENGTH = 7
+SEED_SPACE = 4 ** SEED_LENGTH
+
+_BASE_CODES = {'A': 0, 'C': 1, 'G': 2, 'U': 3, 'T': 3}
+_CODE_BASES = 'ACGU'
+
+_INDEX_MAGIC = b'MIRSEED1'
+_INDEX_HEADER = struct.Struct('<8sII')
+
+
+def normalize_sequence(sequence):
+    """Upper-case RNA sequence (T read as U)."""
+    return sequence.strip().upper().replace('T', 'U')
+
+
+def seed_of(sequence):
+    """Nucleotides 2-8 of a mature sequence, or '' if the sequence is too short."""
+    sequence = normalize_sequence(sequence)
+    if len(sequence) < SEED_START + SEED_LENGTH:
+        return ''
+    return sequence[SEED_START:SEED_START + SEED_LENGTH]
+
+
+def encode_seed(seed):
+    """2-bit packed code of a 7-nt seed, or None if it has a base other than A/C/G/U(T)."""
+    if len(seed) != SEED_LENGTH:
+        return None
+    code = 0
+    for base in seed.upper():
+        base_code = _BASE_CODES.get(base)
+        if base_code is None:
+            return None
+        code = (code << 2) | base_code
+    return code
+
+
+def decode_seed(code):
+    bases = []
+    for _ in range(SEED_LENGTH):
+        bases.append(_CODE_BASES[code & 3])
+        code >>= 2
+    return ''.join(reversed(bases))
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+class SeedIndex:
+    """
+    Seed -> miRNA name index.
+
+    Usage:
+        index = SeedIndex.from_records([('hsa-miR-21-5p', 'AGCUUAU'), ...])
+        index.save(SEED_INDEX_FILE)
+        SeedIndex.load(SEED_INDEX_FILE).mirnas_with_seed('GAGGUAG')
+    """
+
+    def __init__(self, names, seed_codes, offsets=None, entries=None):
+        self.names = names
+        self.seed_codes = seed_codes
+        if offsets is None or entries is None:
+            offsets, entries = self._build_csr(seed_codes)
+        self.offsets = offsets
+        self.entries = entries
+        self._ordinal_by_name = None
+
+    @staticmethod
+    def _build_csr(seed_codes):
+        """Counting sort of the miRNA ordinals by seed code."""
+        offsets = array('I', bytes(4 * (SEED_SPACE + 1)))
+        for code in seed_codes:
+            offsets[code + 1] += 1
+        for code in range(SEED_SPACE):
+            offsets[code + 1] += offsets[code]
+        entries = array('I', bytes(4 * len(seed_codes)))
+        next_slot = array('I', offsets)
+        for ordinal, code in enumerate(seed_codes):
+            entries[next_slot[code]] = ordinal
+            next_slot[code] += 1
+        return offsets, entries
+
+    @classmethod
+    def from_records(cls, records):
+        """records: iterable of (miRNA name, seed); names and seeds that cannot be encoded are skipped."""
+        names = []
+        seed_codes = array('H')
+        seen_names = set()
+        for name, seed in records:
+            code = encode_seed(seed)
+            if code is None or name in seen_names:
+                continue
+            seen_names.add(name)
+            names.append(name)
+            seed_codes.append(code)
+        return cls(names, seed_codes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def mirnas_with_seed(self, seed):
+        """Names of the miRNAs with this 7-nt seed."""
+        code = encode_seed(normalize_sequence(seed))
+        if code is None:
+            return []
+        return [self.names[ordinal] for ordinal in self.entries[self.offsets[code]:self.offsets[code + 1]]]
+
+    def seed_of_mirna(self, name):
+        """Seed of a miRNA in the index, or None."""
+        if self._ordinal_by_name is None:
+            self._ordinal_by_name = {mirna_name: ordinal for ordinal, mirna_name in enumerate(self.names)}
+        ordinal = self._ordinal_by_name.get(name)
+        return decode_seed(self.seed_codes[ordinal]) if ordinal is not None else None
+
+    def mirnas_sharing_seed(self, name):
+        """Other miRNAs with the same seed as name."""
+        seed = self.seed_of_mirna(name)
+        return [mirna_name for mirna_name in self.mirnas_with_seed(seed) if mirna_name != name] if seed else []
+
+    def seed_groups(self, min_size=2):
+        """{seed: [names]} for every seed shared by at least min_size miRNAs (seed families)."""
+        groups = {}
+        for code in range(SEED_SPACE):
+            start, end = self.offsets[code], self.offsets[code + 1]
+            if end - start >= min_size:
+                groups[decode_seed(code)] = [self.names[ordinal] for ordinal in self.entries[start:end]]
+        return groups
+
+    def save(self, file_path=SEED_INDEX_FILE):
+        """Writes the arrays to file_path (via a temporary file, so readers never see a partial index)."""
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f_out:
+            f_out.write(_INDEX_HEADER.pack(_INDEX_MAGIC, len(self.names), len(self.offsets)))
+            f_out.write(_little_endian(self.seed_codes).tobytes())
+            f_out.write(_little_endian(self.offsets).tobytes())
+            f_out.write(_little_endian(self.entries).tobytes())
+            f_out.write('\n'.join(self.names).encode('utf-8'))
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path=SEED_INDEX_FILE):
+        with open(file_path, 'rb') as f_in:
+            magic, name_count, offset_count = _INDEX_HEADER.unpack(f_in.read(_INDEX_HEADER.size))
+            if magic != _INDEX_MAGIC or offset_count != SEED_SPACE + 1:
+                raise ValueError(f"Not a seed index file: {file_path}")
+            arrays = []
+            for typecode, count in (('H', name_count), ('I', offset_count), ('I', name_count)):
+                values = array(typecode)
+                values.frombytes(f_in.read(values.itemsize * count))
+                arrays.append(_little_endian(values))
+            names_blob = f_in.read().decode('utf-8')
+        names = names_blob.split('\n') if name_count else []
+        return cls(names, arrays[0], arrays[1], arrays[2])
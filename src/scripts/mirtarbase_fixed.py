@@ -1,7 +1,92 @@
 import sys
 import csv
-from dbhelper import db_connect, create_db_info, create_relation_info, close_driver
-from ncbi import get_gene_by_id 
+from dbhelper import db_connect, create_db_info, create_relation_info, close_driver, ensure_schema, BulkWriter
+from prefetch import prefetch_targets_by_geneid
+from download import configure_from_argv
+from mirna_resolver import MirnaResolver
+
+TARGET_UPSERT_TEMPLATE = """
+    MERGE (t:Target {geneid: row.m_geneid})
+    ON CREATE SET t.name = row.m_name, t.species = row.m_species, t.ens_code = row.m_ens_code, t.ncbi_link = row.m_ncbi_link
+    ON MATCH SET  t.name = row.m_name, t.species = row.m_species, t.ens_code = row.m_ens_code, t.ncbi_link = row.m_ncbi_link
+"""
+
+MINIMAL_TARGET_UPSERT_TEMPLATE = """
+    MERGE (t:Target {geneid: row.min_geneid})
+    ON CREATE SET t.name = row.min_name, t.species = row.min_species
+"""
+
+# One relationship per evidence row (experiments, PMID), so a rerun updates instead of duplicating
+RELATION_UPSERT_TEMPLATE = """
+    MATCH (mir:microRNA {name: row.p_standard_mirna_name_match})
+    MATCH (gene:Target {geneid: row.p_standard_target_geneid_match})
+    MERGE (mir)-[r:miRTarBase {
+        source_microrna: row.p_mirna_name_tool,
+        experiments: row.p_experiments,
+        score: row.p_tool_score_prop
+    }]->(gene)
+    SET r.tool_name = row.p_relation_name_prop,
+        r.source_target_symbol = row.p_target_symbol_tool,
+        r.source_target_geneid_original = row.p_target_geneid_tool_original
+"""
+
+def iter_mirtarbase_rows(data_file_path, species_prefix_filter, stats):
+    """
+    Streams a miRTarBase CSV (after its header line) and yields (row_num, row) for every
+    well-formed row of the species, where row holds mirna_name, target_symbol, raw_gene_id,
+    geneid (the cleaned integer GeneID), experiments and score.
+    stats['rows_read'] and stats['skipped'] are kept up to date.
+    """
+    with open(data_file_path, mode='r', newline='', encoding='utf-8') as csvfile:
+        csvfile.readline() 
+        reader = csv.reader(csvfile) 
+
+        for i, row in enumerate(reader):
+            current_row_num = i + 2 
+            stats['rows_read'] = i + 1
+
+            if not row: 
+                stats['skipped'] += 1
+                continue
+            
+            if len(row) != 9:
+                print(f"    ⚠️ Row {current_row_num}: Malformed (expected 9 columns, got {len(row)}). Skipping. Data: {row}")
+                stats['skipped'] += 1
+                continue
+            
+            mirna_name_from_tool = row[1].strip()
+            raw_gene_id_from_tool = row[4].strip() 
+
+            if not mirna_name_from_tool.lower().startswith(species_prefix_filter.lower()):
+                stats['skipped'] += 1
+                continue
+
+            if not raw_gene_id_from_tool:
+                print(f"    ⚠️ Row {current_row_num}: Missing GeneID. Skipping. Data: {row}")
+                stats['skipped'] += 1
+                continue
+            try:
+                cleaned_target_gene_id = str(int(float(raw_gene_id_from_tool)))
+            except ValueError:
+                print(f"    ⚠️ Row {current_row_num}: Invalid GeneID format '{raw_gene_id_from_tool}'. Skipping.")
+                stats['skipped'] += 1
+                continue
+
+            yield current_row_num, {
+                'mirna_name': mirna_name_from_tool,
+                'target_symbol': row[3].strip(),
+                'raw_gene_id': raw_gene_id_from_tool,
+                'geneid': cleaned_target_gene_id,
+                'experiments': row[6].strip(),
+                'score': row[8].strip()
+            }
+
+def collect_mirtarbase_geneids(data_file_path, species_prefix_filter):
+    """
+    Reads the miRTarBase CSV once and returns the distinct cleaned target GeneIDs of the species.
+    """
+    return {mirtarbase_row['geneid'] for _, mirtarbase_row in
+            iter_mirtarbase_rows(data_file_path, species_prefix_filter, {'rows_read': 0, 'skipped': 0})}
 
 def run_mirtarbase_import(data_file_path, species_prefix_filter):
     """
@@ -11,90 +96,54 @@ def run_mirtarbase_import(data_file_path, species_prefix_filter):
     print(f"Processing data file: {data_file_path}")
 
     database_name_display = 'miRTarBase'
+    database_url_official = 'https://mirtarbase.cuhk.edu.cn/'
     data_source_link_specific = 'https://cytargetlinker.github.io/pages/linksets/mirtarbase.html' 
     
+    ensure_schema()
     create_db_info(database_name_display, database_url_official)
 
     min_score_val = float('inf') 
     max_score_val = float('-inf') 
 
     processed_rows_count = 0
-    created_relationships_count = 0
     skipped_rows_count = 0
+    known_target_geneids = set()
 
     try:
-        with db_connect() as session: 
-            with open(data_file_path, mode='r', newline='', encoding='utf-8') as csvfile:
-                csvfile.readline() 
-                reader = csv.reader(csvfile) 
-
-                for i, row in enumerate(reader):
-                    current_row_num = i + 2 
-
-                    if not row: 
-                        skipped_rows_count += 1
-                        continue
-                    
-                    if len(row) != 9:
-                        print(f"    ⚠️ Row {current_row_num}: Malformed (expected 9 columns, got {len(row)}). Skipping. Data: {row}")
-                        skipped_rows_count += 1
-                        continue
-                    
-                    mirna_name_from_tool = row[1].strip()
-                    target_symbol_from_tool = row[3].strip()
-                    raw_gene_id_from_tool = row[4].strip() 
-                    
-                    experiments_data = row[6].strip() 
-                    
-                    experiment_or_pmid_score = row[8].strip() 
-
-                    if not mirna_name_from_tool.lower().startswith(species_prefix_filter.lower()):
-                        skipped_rows_count += 1
-                        continue
-
-                    if not raw_gene_id_from_tool:
-                        print(f"    ⚠️ Row {current_row_num}: Missing GeneID. Skipping. Data: {row}")
-                        skipped_rows_count += 1
-                        continue
-                    try:
-                        cleaned_target_gene_id = str(int(float(raw_gene_id_from_tool)))
-                    except ValueError:
-                        print(f"    ⚠️ Row {current_row_num}: Invalid GeneID format '{raw_gene_id_from_tool}'. Skipping.")
-                        skipped_rows_count += 1
-                        continue
-                    
-                    standard_mirna_name_for_match = mirna_name_from_tool
-
-                    params_for_cypher = {
-                        'p_mirna_name_tool': mirna_name_from_tool,
-                        'p_target_symbol_tool': target_symbol_from_tool,
-                        'p_target_geneid_tool_original': raw_gene_id_from_tool,
-                        'p_relation_name_prop': database_name_display, 
-                        'p_tool_score_prop': experiment_or_pmid_score, 
-                        'p_standard_mirna_name_match': standard_mirna_name_for_match,
-                        'p_standard_target_geneid_match': cleaned_target_gene_id,
-                        'p_experiments': experiments_data 
-                    }
-
-                    try:
-                        score_float = float(experiment_or_pmid_score)
-                        if score_float < min_score_val: min_score_val = score_float
-                        if score_float > max_score_val: max_score_val = score_float
-                    except ValueError:
-                        pass 
-
-                    mirna_check_query = "MATCH (m:microRNA {name: $p_standard_mirna_name_match}) RETURN m.name LIMIT 1"
-                    mirna_record = session.run(mirna_check_query, params_for_cypher).single()
-                    if not mirna_record:
-                        print(f"    ⚠️ Row {current_row_num}: microRNA node '{params_for_cypher['p_standard_mirna_name_match']}' not found in DB. Skipping.")
-                        skipped_rows_count += 1
-                        continue
-
-                    target_check_query = "MATCH (t:Target {geneid: $p_standard_target_geneid_match}) RETURN t.name LIMIT 1"
-                    target_record = session.run(target_check_query, params_for_cypher).single()
-
-                    if not target_record:
-                        gene_details_from_ncbi = get_gene_by_id(params_for_cypher['p_standard_target_geneid_match'])
+        with db_connect() as session, \
+             BulkWriter(templates=(TARGET_UPSERT_TEMPLATE, MINIMAL_TARGET_UPSERT_TEMPLATE, RELATION_UPSERT_TEMPLATE)) as writer:
+            mirna_resolver = MirnaResolver.from_graph(session)
+            new_targets = prefetch_targets_by_geneid(session, collect_mirtarbase_geneids(data_file_path, species_prefix_filter))
+            row_stats = {'rows_read': 0, 'skipped': 0}
+            for current_row_num, mirtarbase_row in iter_mirtarbase_rows(data_file_path, species_prefix_filter, row_stats):
+                experiment_or_pmid_score = mirtarbase_row['score']
+                cleaned_target_gene_id = mirtarbase_row['geneid']
+                params_for_cypher = {
+                    'p_mirna_name_tool': mirtarbase_row['mirna_name'],
+                    'p_target_symbol_tool': mirtarbase_row['target_symbol'],
+                    'p_target_geneid_tool_original': mirtarbase_row['raw_gene_id'],
+                    'p_relation_name_prop': database_name_display, 
+                    'p_tool_score_prop': experiment_or_pmid_score, 
+                    'p_standard_mirna_name_match': mirtarbase_row['mirna_name'],
+                    'p_standard_target_geneid_match': cleaned_target_gene_id,
+                    'p_experiments': mirtarbase_row['experiments'] 
+                }
+
+                try:
+                    score_float = float(experiment_or_pmid_score)
+                    if score_float < min_score_val: min_score_val = score_float
+                    if score_float > max_score_val: max_score_val = score_float
+                except ValueError:
+                    pass 
+
+                if not mirna_resolver.find_by_name(params_for_cypher['p_standard_mirna_name_match']):
+                    print(f"    ⚠️ Row {current_row_num}: microRNA node '{params_for_cypher['p_standard_mirna_name_match']}' not found in DB. Skipping.")
+                    skipped_rows_count += 1
+                    continue
+
+                if cleaned_target_gene_id not in known_target_geneids:
+                    if cleaned_target_gene_id in new_targets:
+                        gene_details_from_ncbi = new_targets[cleaned_target_gene_id]
                         
                         if gene_details_from_ncbi:
                             merge_target_params = {
@@ -109,12 +158,8 @@ def run_mirtarbase_import(data_file_path, species_prefix_filter):
                                 skipped_rows_count +=1
                                 continue
 
-                            session.run("""
-                                MERGE (t:Target {geneid: $m_geneid})
-                                ON CREATE SET t.name = $m_name, t.species = $m_species, t.ens_code = $m_ens_code, t.ncbi_link = $m_ncbi_link
-                                ON MATCH SET  t.name = $m_name, t.species = $m_species, t.ens_code = $m_ens_code, t.ncbi_link = $m_ncbi_link 
-                            """, merge_target_params)
-                            print(f"    ➕ Row {current_row_num}: Created/Merged Target node '{merge_target_params['m_name']}' (GeneID: {merge_target_params['m_geneid']})")
+                            writer.add(TARGET_UPSERT_TEMPLATE, merge_target_params)
+                            print(f"    ➕ Row {current_row_num}: Queued Target node '{merge_target_params['m_name']}' (GeneID: {merge_target_params['m_geneid']})")
                         else:
                             print(f"    ❌ Row {current_row_num}: Could not fetch details for GeneID '{params_for_cypher['p_standard_target_geneid_match']}' from NCBI. Creating minimal Target node.")
                             minimal_target_params = {
@@ -122,47 +167,27 @@ def run_mirtarbase_import(data_file_path, species_prefix_filter):
                                 'min_name': params_for_cypher['p_target_symbol_tool'] or params_for_cypher['p_standard_target_geneid_match'],
                                 'min_species': "Homo sapiens" 
                             }
-                            session.run("""
-                                MERGE (t:Target {geneid: $min_geneid})
-                                ON CREATE SET t.name = $min_name, t.species = $min_species
-                            """, minimal_target_params)
-                            print(f"    ➕ Row {current_row_num}: Created minimal Target node for GeneID '{minimal_target_params['min_geneid']}'")
-                    
-                    create_relationship_query = """
-                    MATCH (mir:microRNA {name: $p_standard_mirna_name_match})
-                    MATCH (gene:Target {geneid: $p_standard_target_geneid_match})
-                    CREATE (mir)-[r:miRTarBase {
-                        tool_name: $p_relation_name_prop,
-                        score: $p_tool_score_prop, 
-                        experiments: $p_experiments,                 // Added experiment property
-                        source_microrna: $p_mirna_name_tool,
-                        source_target_symbol: $p_target_symbol_tool,
-                        source_target_geneid_original: $p_target_geneid_tool_original
-                    }]->(gene)
-                    """
-
-                    try:
-                        result_summary = session.run(create_relationship_query, params_for_cypher).consume()
-                        
-                        if result_summary.counters.relationships_created > 0:
-                            created_relationships_count += 1
-                        else:
-                            print(f"    ⚠️ Row {current_row_num}: Relationship not created (by summary counters) for '{params_for_cypher['p_standard_mirna_name_match']}' -> '{params_for_cypher['p_standard_target_geneid_match']}'. Check MATCH conditions or if an identical relationship was somehow prevented by constraints (unlikely for CREATE).")
-                    except Exception as e_rel:
-                        print(f"    ❌ Row {current_row_num}: Error creating miRTarBase relationship for '{params_for_cypher['p_standard_mirna_name_match']}' -> '{params_for_cypher['p_standard_target_geneid_match']}': {e_rel}")
+                            writer.add(MINIMAL_TARGET_UPSERT_TEMPLATE, minimal_target_params)
+                            print(f"    ➕ Row {current_row_num}: Queued minimal Target node for GeneID '{minimal_target_params['min_geneid']}'")
+                    known_target_geneids.add(cleaned_target_gene_id)
+
+                writer.add(RELATION_UPSERT_TEMPLATE, params_for_cypher)
 
-                    processed_rows_count += 1
-                    if processed_rows_count % 500 == 0:
-                        print(f"  Processed {processed_rows_count} rows from miRTarBase file...")
+                processed_rows_count += 1
+                if processed_rows_count % 500 == 0:
+                    print(f"  Processed {processed_rows_count} rows from miRTarBase file...")
 
+            skipped_rows_count += row_stats['skipped']
+            writer.flush()
+            created_relationships_count = writer.counters(RELATION_UPSERT_TEMPLATE).get('relationships_created', 0)
             print(f"\nFinished processing miRTarBase file: {data_file_path}")
-            print(f"  Total rows read (excluding header): {i+1 if 'i' in locals() else 0}") 
+            print(f"  Total rows read (excluding header): {row_stats['rows_read']}")
             print(f"  Rows processed for relationship creation: {processed_rows_count}")
-            print(f"  Relationships successfully created: {created_relationships_count}")
+            print(f"  Relationships CREATED by MERGE this run: {created_relationships_count}")
             print(f"  Rows skipped (malformed, species mismatch, missing ID, etc.): {skipped_rows_count}")
 
             final_min_score = min_score_val if min_score_val != float('inf') else 0.0 
-            final_max_score = max_score_val if max_max_score != float('-inf') else 0.0 
+            final_max_score = max_score_val if max_score_val != float('-inf') else 0.0 
             create_relation_info(database_name_display, data_source_link_specific, final_min_score, final_max_score, 0.0)
 
     except FileNotFoundError as e:
@@ -177,6 +202,7 @@ def run_mirtarbase_import(data_file_path, species_prefix_filter):
     print("miRTarBase import script finished.")
 
 if __name__ == "__main__":
+    configure_from_argv(sys.argv)
     if len(sys.argv) < 3:
         print("Usage: python mirtarbase_fixed.py <path_to_mirtarbase_data_file.csv> <species_prefix_for_miRNA (e.g., hsa)>")
         sys.exit(1)
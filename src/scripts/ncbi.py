@@ -1,41 +1,50 @@
 import sys
 import re
 import os 
+import io
+import json
+import urllib.parse
+import xml.etree.ElementTree as ET
+import genestore
+import download
 from download import url_request 
 from urllib.parse import quote_plus
 
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data')) 
-
-GENE_CACHE_DIR = BASE_DATA_DIR 
-NCBI_GENE_CACHE_FILE = os.path.join(GENE_CACHE_DIR, 'ncbi_gene.dat')
-
-REFSEQ_CACHE_SUBDIR = os.path.join(BASE_DATA_DIR, 'pictar') 
-REFSEQ_GENEID_CACHE_FILE = os.path.join(REFSEQ_CACHE_SUBDIR, 'refseq_geneid.dat')
-
 ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+ESUMMARY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
+ELINK_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi"
+EUTILS_HOST = "eutils.ncbi.nlm.nih.gov"
 API_KEY = None 
-
-def _ensure_dir_exists(file_path):
-    """Helper to ensure the directory for a file exists."""
-    directory = os.path.dirname(file_path)
-    if directory and not os.path.exists(directory):
-        try:
-            os.makedirs(directory)
-            print(f"NCBI Helper: Created directory '{directory}'")
-        except OSError as e:
-            print(f"NCBI Helper: Error creating directory '{directory}': {e}")
-            return False
-    return True
-
-
-def _query_eutils(base_url, params_dict):
+# When True, lookups are answered only from the gene store (e.g. an index built by
+# ncbi_dump.py) and misses return None without touching E-utilities. Set by the importers'
+# --ncbi-offline flag (download.configure_from_argv) or NCBI_OFFLINE=1 in the environment.
+OFFLINE_ONLY = os.environ.get('NCBI_OFFLINE', '') not in ('', '0')
+# Number of GeneIDs posted per EFetch request; NCBI recommends POST above ~200 IDs.
+EFETCH_GENE_BATCH_SIZE = 200
+# Number of RefSeq accessions resolved per ESummary + ELink round.
+REFSEQ_BATCH_SIZE = 200
+# Number of Ensembl IDs OR-ed into one ESearch term.
+ENSEMBL_SEARCH_BATCH_SIZE = 100
+
+def _query_eutils(base_url, params_dict, post=False):
     """Helper function to query NCBI E-utils with basic error checking."""
+    if OFFLINE_ONLY:
+        return None
+    download.set_host_rate(EUTILS_HOST, 10 if API_KEY else 3)
     query_params = params_dict.copy()
     if API_KEY:
         query_params['api_key'] = API_KEY
 
+    if post:
+        # doseq lets a list value (e.g. ELink 'id') be sent as repeated parameters.
+        form_body = urllib.parse.urlencode(query_params, doseq=True)
+        form_headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
+        response_text = url_request(base_url, data_payload=form_body, method="POST", headers=form_headers)
+        if not response_text:
+            print(f"NCBI E-utils POST query failed or returned empty response for URL: {base_url} (db={query_params.get('db')})")
+        return response_text
+
     # URL-encode each parameter value before joining
     encoded_params = []
     for k, v in query_params.items():
@@ -51,6 +60,89 @@ def _query_eutils(base_url, params_dict):
         print(f"NCBI E-utils query failed or returned empty response for URL: {full_url}")
     return response_text
 
+def normalize_refseq_accession(refseq_accession):
+    """Returns the versionless, upper-case form of a RefSeq accession (NM_000546.6 -> NM_000546)."""
+    return refseq_accession.strip().split('.')[0].upper()
+
+
+def _resolve_refseq_batch(accessions):
+    """
+    Resolves one batch of versionless RefSeq accessions with two requests:
+    ESummary (nuccore) maps accessions to nuccore UIDs, ELink (nuccore_gene) maps UIDs to GeneIDs.
+    Returns {accession: geneid or None}, or None if either request failed.
+    """
+    summary_text = _query_eutils(ESUMMARY_URL, {'db': 'nuccore', 'id': ','.join(accessions), 'retmode': 'json'}, post=True)
+    if not summary_text: return None
+    try:
+        summary_result = json.loads(summary_text).get('result', {})
+    except json.JSONDecodeError:
+        print(f"NCBI (_resolve_refseq_batch): Could not decode ESummary response. Resp: {summary_text[:200]}")
+        return None
+
+    uid_to_accession = {}
+    for uid in summary_result.get('uids', []):
+        doc = summary_result.get(uid, {})
+        accession_version = doc.get('accessionversion') or doc.get('caption') or ''
+        if accession_version:
+            uid_to_accession[uid] = normalize_refseq_accession(accession_version)
+
+    resolved = {accession: None for accession in accessions}
+    if not uid_to_accession:
+        return resolved
+
+    # One 'id' parameter per UID keeps a separate linkset for every transcript.
+    link_params = {'dbfrom': 'nuccore', 'db': 'gene', 'linkname': 'nuccore_gene',
+                   'id': list(uid_to_accession.keys()), 'retmode': 'json'}
+    link_text = _query_eutils(ELINK_URL, link_params, post=True)
+    if not link_text: return None
+    try:
+        linksets = json.loads(link_text).get('linksets', [])
+    except json.JSONDecodeError:
+        print(f"NCBI (_resolve_refseq_batch): Could not decode ELink response. Resp: {link_text[:200]}")
+        return None
+
+    for linkset in linksets:
+        for uid in linkset.get('ids', []):
+            accession = uid_to_accession.get(str(uid))
+            if accession not in resolved: continue
+            for linksetdb in linkset.get('linksetdbs', []):
+                if linksetdb.get('linkname') == 'nuccore_gene' and linksetdb.get('links'):
+                    resolved[accession] = str(linksetdb['links'][0])
+                    break
+    return resolved
+
+
+def get_geneids_by_refseqs(refseq_accessions):
+    """
+    Get NCBI GeneIDs for many RefSeq transcript accessions at once.
+    Accessions are compared without their version; cached hits and cached misses are answered locally.
+    Returns {versionless_accession: geneid or None}.
+    """
+    results = {}
+    to_resolve = []
+    for refseq_accession in refseq_accessions:
+        if not refseq_accession or not isinstance(refseq_accession, str): continue
+        accession = normalize_refseq_accession(refseq_accession)
+        if not accession or accession in results: continue
+
+        cached_gene_id = genestore.lookup_refseq(accession)
+        if cached_gene_id is None:
+            to_resolve.append(accession)
+        results[accession] = cached_gene_id if cached_gene_id is not genestore.MISS else None
+
+    batches = [to_resolve[i:i + REFSEQ_BATCH_SIZE] for i in range(0, len(to_resolve), REFSEQ_BATCH_SIZE)]
+    if len(batches) > 1:
+        print(f"NCBI (get_geneids_by_refseqs): Resolving {len(to_resolve)} RefSeq accessions in {len(batches)} concurrent batches...")
+    batch_map = download.get_executor().map if len(batches) > 1 else map
+    for batch, resolved in zip(batches, batch_map(_resolve_refseq_batch, batches)):
+        if resolved is None:
+            print(f"NCBI (get_geneids_by_refseqs): Batch of {len(batch)} accessions failed; they will be retried on the next run.")
+            continue
+        genestore.put_refseqs(resolved)
+        results.update(resolved)
+    return results
+
+
 def get_geneid_by_refseq(refseq_accession):
     """
     Get NCBI GeneID for a given RefSeq transcript accession.
@@ -60,120 +152,133 @@ def get_geneid_by_refseq(refseq_accession):
     if not refseq_accession or not isinstance(refseq_accession, str):
         print("NCBI (get_geneid_by_refseq): Invalid RefSeq accession input.")
         return None
-    
-    refseq_id_cleaned = refseq_accession.strip().split('.')[0] 
+    accession = normalize_refseq_accession(refseq_accession)
+    return get_geneids_by_refseqs([accession]).get(accession)
 
-    if _ensure_dir_exists(REFSEQ_GENEID_CACHE_FILE): 
-        try:
-            with open(REFSEQ_GENEID_CACHE_FILE, 'r', encoding='utf-8') as f_cache:
-                for line in f_cache:
-                    parts = line.strip().split('\t')
-                    if len(parts) == 2 and parts[0] == refseq_id_cleaned:
-                        if parts[1] == "NOT_FOUND":
-                            return None
-                        return parts[1] 
-        except FileNotFoundError:
-            pass 
-
-    esearch_params = {'db': 'nuccore', 'term': refseq_id_cleaned, 'retmode': 'xml'}
-    xml_response_esearch = _query_eutils(ESEARCH_URL, esearch_params)
-    if not xml_response_esearch:
-        return None 
-
-    uid_match = re.search(r"<Id>(\d+)</Id>", xml_response_esearch)
-    if not uid_match:
-        print(f"NCBI (get_geneid_by_refseq): No nuccore UID found for RefSeq '{refseq_id_cleaned}'.")
-        if _ensure_dir_exists(REFSEQ_GENEID_CACHE_FILE):
-            try:
-                with open(REFSEQ_GENEID_CACHE_FILE, 'a', encoding='utf-8') as f_cache:
-                    f_cache.write(f"{refseq_id_cleaned}\tNOT_FOUND\n")
-            except IOError as e: print(f"Warning: Could not write NOT_FOUND to RefSeq cache: {e}")
-        return None
-    nuccore_uid = uid_match.group(1)
-
-    efetch_params = {'db': 'nuccore', 'id': nuccore_uid, 'rettype': 'gb', 'retmode': 'text'}
-    gb_data = _query_eutils(EFETCH_URL, efetch_params)
-    if not gb_data:
-        return None 
-
-    gene_id_match = re.search(r'/db_xref="GeneID:(\d+)"', gb_data)
-    if gene_id_match:
-        gene_id = gene_id_match.group(1)
-        if _ensure_dir_exists(REFSEQ_GENEID_CACHE_FILE): 
-            try:
-                with open(REFSEQ_GENEID_CACHE_FILE, 'a', encoding='utf-8') as f_cache:
-                    f_cache.write(f"{refseq_id_cleaned}\t{gene_id}\n")
-            except IOError as e: print(f"Warning: Could not write to RefSeq cache: {e}")
-        return gene_id
-    else:
-        print(f"NCBI (get_geneid_by_refseq): No GeneID cross-reference found for RefSeq '{refseq_id_cleaned}' (Nuccore UID: {nuccore_uid}).")
-        if _ensure_dir_exists(REFSEQ_GENEID_CACHE_FILE):
-            try:
-                with open(REFSEQ_GENEID_CACHE_FILE, 'a', encoding='utf-8') as f_cache:
-                    f_cache.write(f"{refseq_id_cleaned}\tNOT_FOUND\n")
-            except IOError as e: print(f"Warning: Could not write NOT_FOUND to RefSeq cache: {e}")
-        return None
 
+def _entrezgene_to_record(entrezgene_elem):
+    """Extracts {'name', 'id', 'embl', 'species'} from one parsed <Entrezgene> element, or None."""
+    gene_info = {'name': None, 'id': None, 'embl': '', 'species': None}
 
-def _parse_gene_efetch_xml(xml_data, requested_gene_id_for_error_log="Unknown"):
+    geneid_elem = entrezgene_elem.find('.//Gene-track_geneid')
+    if geneid_elem is not None and geneid_elem.text: gene_info['id'] = geneid_elem.text.strip()
+
+    symbol_elem = entrezgene_elem.find('Entrezgene_gene/Gene-ref/Gene-ref_locus')
+    if symbol_elem is None: symbol_elem = entrezgene_elem.find('.//Gene-ref_locus')
+    if symbol_elem is not None and symbol_elem.text: gene_info['name'] = symbol_elem.text.strip().upper()
+
+    species_elem = entrezgene_elem.find('.//Org-ref_taxname')
+    if species_elem is not None and species_elem.text: gene_info['species'] = species_elem.text.strip()
+
+    for dbtag in entrezgene_elem.iter('Dbtag'):
+        if (dbtag.findtext('Dbtag_db') or '').strip().upper() == 'ENSEMBL':
+            ensembl_id = dbtag.findtext('Dbtag_tag/Object-id/Object-id_str')
+            if ensembl_id:
+                gene_info['embl'] = ensembl_id.strip()
+                break
+
+    if gene_info['id'] and gene_info['name']:
+        return gene_info
+    return None
+
+
+def _iter_gene_efetch_xml(xml_data):
     """
-    Parses XML output from NCBI EFetch (db=gene).
-    Returns a dictionary {'name', 'id', 'embl', 'species'} or None.
-    This is a simplified parser; for robustness, an XML library (e.g., xml.etree.ElementTree) is better.
+    Parses an EFetch (db=gene) Entrezgene-Set and yields one record per <Entrezgene>. The response
+    body is already in memory (url_request returns it whole, at most EFETCH_GENE_BATCH_SIZE genes);
+    iterparse only avoids building the element tree of the whole set, as each <Entrezgene> is
+    cleared once read.
     """
-    if not xml_data: return None
-    gene_info = {'name': None, 'id': None, 'embl': '', 'species': None} 
-
+    if not xml_data: return
+    if isinstance(xml_data, str):
+        xml_data = xml_data.encode('utf-8')
     try:
-        geneid_match = re.search(r"<Gene-track_geneid>(\d+)</Gene-track_geneid>", xml_data)
-        if geneid_match: gene_info['id'] = geneid_match.group(1)
+        for _event, elem in ET.iterparse(io.BytesIO(xml_data), events=('end',)):
+            if elem.tag != 'Entrezgene':
+                continue
+            record = _entrezgene_to_record(elem)
+            elem.clear()
+            if record:
+                yield record
+    except ET.ParseError as e:
+        print(f"NCBI (_iter_gene_efetch_xml): Error parsing Entrezgene-Set XML: {e}")
 
-        symbol_match = re.search(r"<Gene-ref_locus>([^<]+)</Gene-ref_locus>", xml_data)
-        if symbol_match: gene_info['name'] = symbol_match.group(1).upper()
 
-        species_match = re.search(r"<Org-ref_taxname>([^<]+)</Org-ref_taxname>", xml_data)
-        if species_match: gene_info['species'] = species_match.group(1)
+def _parse_gene_efetch_xml(xml_data, requested_gene_id_for_error_log="Unknown"):
+    """
+    Parses XML output from NCBI EFetch (db=gene).
+    Returns a dictionary {'name', 'id', 'embl', 'species'} for the first gene, or None.
+    """
+    for record in _iter_gene_efetch_xml(xml_data):
+        return record
+    return None
 
-        ensembl_dbtag_block_match = re.search(r"<Dbtag>\s*<Dbtag_db>ENSEMBL</Dbtag_db>\s*<Dbtag_tag>\s*<Object-id>\s*<Object-id_str>([^<]+)</Object-id_str>", xml_data, re.IGNORECASE)
-        if ensembl_dbtag_block_match:
-            gene_info['embl'] = ensembl_dbtag_block_match.group(1)
-        
-        if gene_info['id'] and gene_info['name']: 
-            return gene_info
+
+def _fetch_gene_batch(gene_ids):
+    """
+    Posts one EFetch (db=gene) request for a batch of GeneIDs and caches every result.
+    Returns {geneid: record or None}; IDs are only cached as NOT_FOUND if the request itself succeeded.
+    """
+    efetch_params = {'db': 'gene', 'id': ','.join(gene_ids), 'retmode': 'xml'}
+    xml_data = _query_eutils(EFETCH_URL, efetch_params, post=True)
+    results = {gene_id: None for gene_id in gene_ids}
+    if not xml_data:
+        return results
+
+    records = []
+    for record in _iter_gene_efetch_xml(xml_data):
+        if record['id'] in results:
+            results[record['id']] = record
+            records.append(record)
+    genestore.put_genes('ncbi', records)
+
+    not_found = [gene_id for gene_id, record in results.items() if record is None]
+    if not_found:
+        print(f"NCBI API (Gene Details): No details for {len(not_found)} of {len(gene_ids)} GeneIDs. Caching as NOT_FOUND.")
+        genestore.put_misses('ncbi', 'id', not_found)
+    return results
+
+
+def get_genes_by_ids(gene_ids):
+    """
+    Get gene details for many NCBI GeneIDs at once.
+    Cached IDs are answered locally; the rest are fetched EFETCH_GENE_BATCH_SIZE at a time.
+    Returns {clean_geneid: record or None}.
+    """
+    results = {}
+    to_fetch = []
+    for gene_id_input in gene_ids:
+        if not gene_id_input: continue
+        try:
+            clean_gene_id_str = str(int(float(str(gene_id_input))))
+        except ValueError:
+            print(f"NCBI (get_genes_by_ids): Invalid GeneID format '{gene_id_input}'.")
+            continue
+        if clean_gene_id_str in results: continue
+
+        cached_gene = genestore.lookup_gene('ncbi', geneid=clean_gene_id_str)
+        if cached_gene is genestore.MISS:
+            results[clean_gene_id_str] = None
+        elif cached_gene:
+            results[clean_gene_id_str] = cached_gene
         else:
-            return None
-    except Exception as e:
-        print(f"NCBI (_parse_gene_efetch_xml): Error parsing XML for GeneID '{requested_gene_id_for_error_log}': {e}")
-        return None
+            results[clean_gene_id_str] = None
+            to_fetch.append(clean_gene_id_str)
+
+    batches = [to_fetch[i:i + EFETCH_GENE_BATCH_SIZE] for i in range(0, len(to_fetch), EFETCH_GENE_BATCH_SIZE)]
+    if len(batches) > 1:
+        print(f"NCBI API (Gene Details): Fetching {len(to_fetch)} GeneIDs in {len(batches)} concurrent batches...")
+    batch_map = download.get_executor().map if len(batches) > 1 else map
+    for batch_results in batch_map(_fetch_gene_batch, batches):
+        results.update(batch_results)
+    return results
 
 
 def _fetch_and_cache_gene_details(gene_id_to_fetch):
     """Fetches full gene details from NCBI by GeneID and caches them."""
     if not gene_id_to_fetch: return None
-
-    efetch_params = {'db': 'gene', 'id': str(gene_id_to_fetch).strip(), 'retmode': 'xml'}
-    xml_data = _query_eutils(EFETCH_URL, efetch_params)
-    gene_details = _parse_gene_efetch_xml(xml_data, str(gene_id_to_fetch))
-
-    if _ensure_dir_exists(NCBI_GENE_CACHE_FILE): 
-        try:
-            with open(NCBI_GENE_CACHE_FILE, 'a', encoding='utf-8') as f_cache:
-                if gene_details:
-                    f_cache.write(f"{gene_details.get('name','')}\t{gene_details.get('embl','')}\t{gene_details.get('id','')}\t{gene_details.get('species','')}\n")
-                else:
-                    print(f"NCBI API (Gene Details): Could not fetch/parse for GeneID {gene_id_to_fetch}. Caching as NOT_FOUND.")
-                    f_cache.write(f"NOT_FOUND_SYMBOL\tNOT_FOUND_EMBL\t{gene_id_to_fetch}\tNOT_FOUND_SPECIES\n")
-        except IOError as e: print(f"Warning: Could not write to NCBI Gene Cache: {e}")
-    return gene_details
-
-
-def get_gene_record_from_cache_line(line_parts):
-    """Helper to parse a line from ncbi_gene.dat into a dict."""
-    if len(line_parts) == 4:
-        if line_parts[0] == "NOT_FOUND_SYMBOL" and line_parts[2] == "NOT_FOUND_EMBL": 
-            return None 
-        return {'name': line_parts[0], 'embl': line_parts[1], 'id': line_parts[2], 'species': line_parts[3]}
-    return None
+    gene_id_str = str(gene_id_to_fetch).strip()
+    return _fetch_gene_batch([gene_id_str]).get(gene_id_str)
 
 
 def get_gene_by_id(gene_id_input):
@@ -185,17 +290,7 @@ def get_gene_by_id(gene_id_input):
         print(f"NCBI (get_gene_by_id): Invalid GeneID format '{gene_id_input}'.")
         return None
 
-    if _ensure_dir_exists(NCBI_GENE_CACHE_FILE):
-        try:
-            with open(NCBI_GENE_CACHE_FILE, 'r', encoding='utf-8') as f_cache:
-                for line in f_cache:
-                    parts = line.strip().split('\t')
-                    if len(parts) == 4 and parts[2] == clean_gene_id_str: 
-                        return get_gene_record_from_cache_line(parts)
-        except FileNotFoundError:
-            pass 
-
-    return _fetch_and_cache_gene_details(clean_gene_id_str)
+    return get_genes_by_ids([clean_gene_id_str]).get(clean_gene_id_str)
 
 
 def get_gene_by_name(gene_symbol, species_filter=None):
@@ -203,17 +298,11 @@ def get_gene_by_name(gene_symbol, species_filter=None):
     if not gene_symbol: return None
     clean_gene_symbol = gene_symbol.strip().upper() 
 
-    if _ensure_dir_exists(NCBI_GENE_CACHE_FILE):
-        try:
-            with open(NCBI_GENE_CACHE_FILE, 'r', encoding='utf-8') as f_cache:
-                for line in f_cache:
-                    parts = line.strip().split('\t')
-                    if len(parts) == 4 and parts[0].upper() == clean_gene_symbol:
-                        if species_filter and parts[3].lower() != species_filter.strip().lower():
-                            continue
-                        return get_gene_record_from_cache_line(parts)
-        except FileNotFoundError:
-            pass
+    cached_gene = genestore.lookup_gene('ncbi', name=clean_gene_symbol, species=species_filter)
+    if cached_gene is genestore.MISS:
+        return None
+    if cached_gene:
+        return cached_gene
 
     term = f"{clean_gene_symbol}[Gene Name]"
     if species_filter:
@@ -226,15 +315,11 @@ def get_gene_by_name(gene_symbol, species_filter=None):
     id_list_match = re.findall(r"<Id>(\d+)</Id>", xml_response_esearch)
     if not id_list_match:
         print(f"NCBI (get_gene_by_name): No GeneID found for Symbol '{clean_gene_symbol}' (Species: {species_filter}).")
-        if _ensure_dir_exists(NCBI_GENE_CACHE_FILE):
-            try:
-                with open(NCBI_GENE_CACHE_FILE, 'a', encoding='utf-8') as f_cache:
-                    f_cache.write(f"{clean_gene_symbol}\tSYMBOL_NOT_FOUND_EMBL\tSYMBOL_NOT_FOUND_ID\t{species_filter or 'ANY'}\n")
-            except IOError as e: print(f"Warning: Could not write SYMBOL_NOT_FOUND to Gene Cache: {e}")
+        genestore.put_miss('ncbi', 'name', clean_gene_symbol, species_filter)
         return None
     
     gene_id_to_fetch = id_list_match[0] 
-    return _fetch_and_cache_gene_details(gene_id_to_fetch) 
+    return get_gene_by_id(gene_id_to_fetch) 
 
 
 def get_gene_by_ens(ensembl_id, species_filter=None):
@@ -242,17 +327,11 @@ def get_gene_by_ens(ensembl_id, species_filter=None):
     if not ensembl_id: return None
     clean_ensembl_id = ensembl_id.strip().upper() 
 
-    if _ensure_dir_exists(NCBI_GENE_CACHE_FILE):
-        try:
-            with open(NCBI_GENE_CACHE_FILE, 'r', encoding='utf-8') as f_cache:
-                for line in f_cache:
-                    parts = line.strip().split('\t')
-                    if len(parts) == 4 and parts[1].upper() == clean_ensembl_id: 
-                        if species_filter and parts[3].lower() != species_filter.strip().lower():
-                            continue
-                        return get_gene_record_from_cache_line(parts)
-        except FileNotFoundError:
-            pass
+    cached_gene = _lookup_cached_gene_by_ens(clean_ensembl_id, species_filter)
+    if cached_gene is genestore.MISS:
+        return None
+    if cached_gene:
+        return cached_gene
 
     term = f"{clean_ensembl_id}[Accession]" 
     if species_filter:
@@ -265,13 +344,103 @@ def get_gene_by_ens(ensembl_id, species_filter=None):
     id_list_match = re.findall(r"<Id>(\d+)</Id>", xml_response_esearch)
     if not id_list_match:
         print(f"NCBI (get_gene_by_ens): No GeneID found for Ensembl '{clean_ensembl_id}' (Species: {species_filter}).")
-        if _ensure_dir_exists(NCBI_GENE_CACHE_FILE):
-            try:
-                with open(NCBI_GENE_CACHE_FILE, 'a', encoding='utf-8') as f_cache:
-                    f_cache.write(f"ENSEMBL_NOT_FOUND_SYMBOL\t{clean_ensembl_id}\tENSEMBL_NOT_FOUND_ID\t{species_filter or 'ANY'}\n")
-            except IOError as e: print(f"Warning: Could not write ENSEMBL_NOT_FOUND to Gene Cache: {e}")
+        genestore.put_miss('ncbi', 'embl', clean_ensembl_id, species_filter)
         return None
 
     gene_id_to_fetch = id_list_match[0]
-    return _fetch_and_cache_gene_details(gene_id_to_fetch)
-    
\ No newline at end of file
+    gene = get_gene_by_id(gene_id_to_fetch)
+    if gene and (gene.get('embl') or '').upper() != clean_ensembl_id:
+        genestore.put_ens_geneids({clean_ensembl_id: gene_id_to_fetch})
+    return gene
+
+
+def _lookup_cached_gene_by_ens(clean_ensembl_id, species_filter=None):
+    """
+    The cached NCBI gene of an Ensembl ID, by its cross-reference or else by the GeneID stored with
+    genestore.put_ens_geneids. Returns the record, MISS or None as genestore.lookup_gene.
+    """
+    cached_gene = genestore.lookup_gene('ncbi', embl=clean_ensembl_id, species=species_filter)
+    if cached_gene is not None:
+        return cached_gene
+    alias_geneid = genestore.lookup_ens_geneid(clean_ensembl_id)
+    if alias_geneid:
+        aliased_gene = genestore.lookup_gene('ncbi', geneid=alias_geneid)
+        if aliased_gene and aliased_gene is not genestore.MISS:
+            return aliased_gene
+    return None
+
+
+def _search_geneids_by_ens_batch(ensembl_ids, species_filter=None):
+    """One ESearch (db=gene) for a batch of Ensembl IDs; returns the GeneIDs found, or None if the search failed."""
+    term = "(" + " OR ".join(f"{ensembl_id}[Accession]" for ensembl_id in ensembl_ids) + ")"
+    if species_filter:
+        term += f" AND \"{species_filter.strip()}\"[Organism]"
+    esearch_params = {'db': 'gene', 'term': term, 'retmode': 'xml', 'retmax': str(len(ensembl_ids) * 5)}
+    xml_response_esearch = _query_eutils(ESEARCH_URL, esearch_params, post=True)
+    if not xml_response_esearch:
+        return None
+    return re.findall(r"<Id>(\d+)</Id>", xml_response_esearch)
+
+
+def get_genes_by_ens(ensembl_ids, species_filter=None, cancel_event=None):
+    """
+    Get gene details for many Ensembl gene IDs at once (the batched get_gene_by_ens).
+    Cached IDs are answered locally; the rest are searched ENSEMBL_SEARCH_BATCH_SIZE at a time and the
+    genes found are fetched with get_genes_by_ids. Records are matched back to the IDs by their Ensembl
+    cross-reference. An Entrezgene record only carries its first one, so a found gene may match none
+    of its batch; the IDs of that batch still unmatched are then searched again, split in two halves,
+    until a single ID is left to take the gene, which is stored as that ID's alias (genestore.put_ens_geneids).
+    Each round's searches run concurrently. Once cancel_event is set no further round starts, and the
+    IDs still searched for are left uncached.
+    Returns {clean_ensembl_id: record or None}.
+    """
+    results = {}
+    to_search = []
+    for ensembl_id in ensembl_ids:
+        if not ensembl_id: continue
+        clean_ensembl_id = ensembl_id.strip().upper()
+        if clean_ensembl_id in results: continue
+
+        cached_gene = _lookup_cached_gene_by_ens(clean_ensembl_id, species_filter)
+        results[clean_ensembl_id] = cached_gene if cached_gene and cached_gene is not genestore.MISS else None
+        if cached_gene is None:
+            to_search.append(clean_ensembl_id)
+
+    batches = [to_search[i:i + ENSEMBL_SEARCH_BATCH_SIZE] for i in range(0, len(to_search), ENSEMBL_SEARCH_BATCH_SIZE)]
+    while batches:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        if len(batches) > 1:
+            print(f"NCBI (get_genes_by_ens): Searching {sum(len(batch) for batch in batches)} Ensembl IDs in {len(batches)} concurrent batches...")
+        batch_map = download.get_executor().map if len(batches) > 1 else map
+        batch_gene_ids = list(batch_map(lambda batch: _search_geneids_by_ens_batch(batch, species_filter), batches))
+        genes = get_genes_by_ids({gene_id for gene_ids in batch_gene_ids if gene_ids for gene_id in gene_ids})
+
+        narrowed_batches = []
+        for batch, gene_ids in zip(batches, batch_gene_ids):
+            if gene_ids is None:
+                print(f"NCBI (get_genes_by_ens): Search for {len(batch)} Ensembl IDs failed; they will be retried on the next run.")
+                continue
+            batch_ids = set(batch)
+            unmatched_records = []
+            for gene_id in gene_ids:
+                record = genes.get(gene_id)
+                if not record: continue
+                record_ensembl_id = (record.get('embl') or '').upper()
+                if record_ensembl_id in batch_ids:
+                    if results[record_ensembl_id] is None: results[record_ensembl_id] = record
+                else:
+                    unmatched_records.append(record)
+
+            not_found = [ensembl_id for ensembl_id in batch if results[ensembl_id] is None]
+            if not unmatched_records:
+                genestore.put_misses('ncbi', 'embl', not_found, species_filter)
+            elif len(not_found) == 1:
+                # as get_gene_by_ens: the first gene found for the ID, kept under this ID for the next run
+                results[not_found[0]] = unmatched_records[0]
+                genestore.put_ens_geneids({not_found[0]: unmatched_records[0].get('id')})
+            elif not_found:
+                half = len(not_found) // 2
+                narrowed_batches += [not_found[:half], not_found[half:]]
+        batches = narrowed_batches
+    return results
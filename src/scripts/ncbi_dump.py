@@ -0,0 +1,168 @@
+import sys
+import os
+import gzip
+import time
+import genestore
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data'))
+DEFAULT_DUMP_DIR = os.path.join(BASE_DATA_DIR, 'ncbi')
+
+# ftp.ncbi.nlm.nih.gov/gene/DATA/ file names; per-organism gene_info files
+# (e.g. GENE_INFO/Mammalia/Homo_sapiens.gene_info.gz) work as well.
+GENE_INFO_FILE = 'gene_info.gz'
+GENE2REFSEQ_FILE = 'gene2refseq.gz'
+GENE2ENSEMBL_FILE = 'gene2ensembl.gz'
+
+# gene_info has no organism name column; other tax IDs are given as <tax_id>=<species name>
+TAX_ID_SPECIES = {
+    '9606': 'Homo sapiens',
+    '10090': 'Mus musculus',
+    '10116': 'Rattus norvegicus',
+}
+
+WRITE_BATCH_SIZE = 50000
+
+
+def _open_dump(file_path):
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rt', encoding='utf-8')
+    return open(file_path, 'r', encoding='utf-8')
+
+
+def _find_dump(dump_dir, file_name):
+    """Returns the gzipped or plain path of a dump file, or None if neither exists."""
+    for candidate in (file_name, file_name[:-len('.gz')]):
+        path = os.path.join(dump_dir, candidate)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _iter_dump_rows(file_path, tax_ids):
+    """Streams a tab-separated NCBI gene dump, yielding the columns of rows whose first column is one of tax_ids."""
+    prefixes = tuple(tax_id + '\t' for tax_id in tax_ids)
+    with _open_dump(file_path) as f_dump:
+        for line in f_dump:
+            if line.startswith(prefixes):
+                yield line.rstrip('\n').split('\t')
+
+
+def parse_tax_id_args(args):
+    """
+    ['9606', '7955=Danio rerio'] -> {'9606': 'Homo sapiens', '7955': 'Danio rerio'}; the species name
+    is what species-filtered lookups match on, so a tax ID not in TAX_ID_SPECIES needs one (ValueError).
+    """
+    species_by_tax_id = {}
+    for arg in args:
+        tax_id, _, species_name = arg.partition('=')
+        tax_id, species_name = tax_id.strip(), species_name.strip() or TAX_ID_SPECIES.get(tax_id.strip())
+        if not species_name:
+            raise ValueError(f"No species name known for tax ID {tax_id}; give it as {tax_id}=<species name>")
+        species_by_tax_id[tax_id] = species_name
+    return species_by_tax_id
+
+
+def load_gene_info(file_path, species_by_tax_id):
+    """
+    Reads gene_info and returns {geneid: record} for the tax IDs of species_by_tax_id ({tax ID: species name}).
+    The Ensembl ID is taken from the dbXrefs column when present.
+    """
+    genes = {}
+    for cols in _iter_dump_rows(file_path, species_by_tax_id):
+        if len(cols) < 6: continue
+        tax_id, gene_id, symbol, db_xrefs = cols[0], cols[1], cols[2], cols[5]
+        ensembl_id = ''
+        for xref in db_xrefs.split('|'):
+            if xref.startswith('Ensembl:'):
+                ensembl_id = xref[len('Ensembl:'):]
+                break
+        genes[gene_id] = {
+            'name': symbol.upper(),
+            'embl': ensembl_id,
+            'id': gene_id,
+            'species': species_by_tax_id[tax_id],
+        }
+    return genes
+
+
+def apply_gene2ensembl(file_path, tax_ids, genes):
+    """Fills in the Ensembl gene ID of genes whose gene_info row had none."""
+    filled = 0
+    for cols in _iter_dump_rows(file_path, tax_ids):
+        if len(cols) < 3: continue
+        gene = genes.get(cols[1])
+        if gene is not None and not gene['embl'] and cols[2] != '-':
+            gene['embl'] = cols[2].split('.')[0]
+            filled += 1
+    return filled
+
+
+def load_gene2refseq(file_path, tax_ids):
+    """Returns {versionless RNA accession: geneid} from gene2refseq."""
+    refseq_map = {}
+    for cols in _iter_dump_rows(file_path, tax_ids):
+        if len(cols) < 4 or cols[3] == '-': continue
+        refseq_map.setdefault(cols[3].split('.')[0].upper(), cols[1])
+    return refseq_map
+
+
+def build_index(dump_dir, species_by_tax_id):
+    """
+    Streams gene_info, gene2ensembl and gene2refseq from dump_dir, filtered by the tax IDs of
+    species_by_tax_id ({tax ID: species name}, see parse_tax_id_args), and loads them into the
+    gene crosswalk store so ncbi lookups are answered without network.
+    """
+    tax_ids = list(species_by_tax_id)
+    start_time = time.time()
+
+    gene_info_path = _find_dump(dump_dir, GENE_INFO_FILE)
+    if not gene_info_path:
+        print(f"NCBI Dump: gene_info not found in '{dump_dir}'.")
+        return False
+
+    print(f"NCBI Dump: Reading {gene_info_path} for tax IDs {', '.join(tax_ids)}...")
+    genes = load_gene_info(gene_info_path, species_by_tax_id)
+    print(f"  {len(genes)} genes.")
+
+    gene2ensembl_path = _find_dump(dump_dir, GENE2ENSEMBL_FILE)
+    if gene2ensembl_path:
+        print(f"NCBI Dump: Reading {gene2ensembl_path}...")
+        print(f"  Ensembl IDs filled in for {apply_gene2ensembl(gene2ensembl_path, tax_ids, genes)} genes.")
+    else:
+        print(f"NCBI Dump: Warning: gene2ensembl not found in '{dump_dir}'; using gene_info dbXrefs only.")
+
+    gene_records = list(genes.values())
+    for batch_start in range(0, len(gene_records), WRITE_BATCH_SIZE):
+        genestore.put_genes('ncbi', gene_records[batch_start:batch_start + WRITE_BATCH_SIZE])
+
+    gene2refseq_path = _find_dump(dump_dir, GENE2REFSEQ_FILE)
+    refseq_count = 0
+    if gene2refseq_path:
+        print(f"NCBI Dump: Reading {gene2refseq_path}...")
+        refseq_map = load_gene2refseq(gene2refseq_path, tax_ids)
+        refseq_count = len(refseq_map)
+        genestore.put_refseqs(refseq_map)
+        print(f"  {refseq_count} RefSeq RNA accessions.")
+    else:
+        print(f"NCBI Dump: Warning: gene2refseq not found in '{dump_dir}'; RefSeq lookups will use E-utilities.")
+
+    genestore.set_meta('ncbi_dump_tax_ids', ','.join(tax_ids))
+    genestore.set_meta('ncbi_dump_built_at', time.strftime('%Y-%m-%d %H:%M:%S'))
+    print(f"NCBI Dump: Indexed {len(gene_records)} genes and {refseq_count} RefSeq accessions "
+          f"in {time.time() - start_time:.1f}s.")
+    return True
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python ncbi_dump.py <dump_dir containing gene_info.gz, gene2refseq.gz, gene2ensembl.gz> <tax_id>[=<species name>] [...]")
+        print(f"Example: python ncbi_dump.py ../data/ncbi 9606 10090 7955='Danio rerio' (names known for {', '.join(TAX_ID_SPECIES)})")
+        sys.exit(1)
+
+    try:
+        species_by_tax_id = parse_tax_id_args(sys.argv[2:])
+    except ValueError as e:
+        print(f"NCBI Dump: {e}")
+        sys.exit(1)
+    build_index(sys.argv[1], species_by_tax_id)
@@ -0,0 +1,201 @@
+"""
+Parallel import mode shared by the tool importers (TargetScan, RNA22).
+
+Parsing: the input file is split into byte ranges aligned to line boundaries and every range is
+parsed in a process pool; results come back in file order.
+
+Writing: relationship rows are hash-partitioned by miRNA name over writer threads, each with its
+own session and BulkWriter. All the rows of a miRNA go through the same writer, so concurrent
+transactions never MERGE relationships on the same microRNA node (its lock is the hot one), and
+per miRNA the rows are still written in file order. Bolt I/O releases the GIL, so threads are
+enough to keep several transactions in flight.
+"""
+import os
+import queue
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from dbhelper import BulkWriter, BULK_BATCH_SIZE
+
+CHUNKS_PER_PROCESS = 4
+MAX_CHUNK_BYTES = 64 * 1024 * 1024
+WRITER_QUEUE_BATCHES = 4
+
+
+def read_header(file_path, encoding='utf-8'):
+    """(first line without its line break, byte offset of the second line)"""
+    with open(file_path, 'rb') as f:
+        header_bytes = f.readline()
+    return header_bytes.decode(encoding).rstrip('\r\n'), len(header_bytes)
+
+
+def line_aligned_chunks(file_path, chunk_count, start_offset=0):
+    """Splits file_path from start_offset on into up to chunk_count (start, end) byte ranges that begin on a line start."""
+    file_size = os.path.getsize(file_path)
+    boundaries = [start_offset]
+    with open(file_path, 'rb') as f:
+        for i in range(1, max(1, chunk_count)):
+            offset = start_offset + (file_size - start_offset) * i // chunk_count
+            if offset <= boundaries[-1]:
+                continue
+            # finish the line holding byte offset - 1; a chunk then starts right after a line break
+            f.seek(offset - 1)
+            f.readline()
+            offset = f.tell()
+            if offset >= file_size:
+                break
+            if offset > boundaries[-1]:
+                boundaries.append(offset)
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def iter_chunk_lines(file_path, start, end, encoding='utf-8'):
+    """Yields the lines (without line breaks) of the byte range [start, end) of file_path."""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        for line in f:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line.decode(encoding).rstrip('\r\n')
+
+
+def map_file_chunks(parse_chunk, file_path, processes, start_offset=0, chunk_args=()):
+    """
+    Calls parse_chunk(file_path, start, end, *chunk_args) for the line-aligned chunks of file_path
+    (CHUNKS_PER_PROCESS per process, at most about MAX_CHUNK_BYTES each) in a pool of processes and
+    yields the results in file order. At most two chunks per process are in flight, so results do not
+    pile up when the caller is slower than the pool. parse_chunk must be a module-level function;
+    with processes <= 1 the chunks are parsed in this process.
+    """
+    processes = max(1, processes)
+    chunk_count = max(processes * CHUNKS_PER_PROCESS, (os.path.getsize(file_path) - start_offset) // MAX_CHUNK_BYTES + 1)
+    chunks = line_aligned_chunks(file_path, chunk_count, start_offset)
+    if processes == 1:
+        for start, end in chunks:
+            yield parse_chunk(file_path, start, end, *chunk_args)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        in_flight = deque()
+        for start, end in chunks:
+            if len(in_flight) >= 2 * processes:
+                yield in_flight.popleft().result()
+            in_flight.append(pool.submit(parse_chunk, file_path, start, end, *chunk_args))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def parse_parallel_args(argv):
+    """
+    Removes the parallel mode flags from an importer's argv (in place) and returns (processes, writers):
+      --processes=N   parse the input file in N processes (default 1, 0 = one per CPU)
+      --writers=N     write relationships over N sessions partitioned by miRNA (default 1)
+    """
+    processes, writers = 1, 1
+    remaining = [argv[0]] if argv else []
+    for arg in argv[1:]:
+        if arg.startswith('--processes='):
+            processes = int(arg.split('=', 1)[1]) or os.cpu_count() or 1
+        elif arg.startswith('--writers='):
+            writers = max(1, int(arg.split('=', 1)[1]))
+        else:
+            remaining.append(arg)
+    argv[:] = remaining
+    return processes, writers
+
+
+def partition_index(key, partition_count):
+    """Stable partition of a key (crc32, not hash(), so it does not change between runs)."""
+    return zlib.crc32(key.encode('utf-8')) % partition_count
+
+
+class PartitionedWriter:
+    """
+    Spreads BulkWriter rows over writer_count writer threads by partition_key(row) (the miRNA name);
+    add() has the BulkWriter signature, so either can be passed where rows are written.
+
+    Rows are handed to a writer batch_size at a time through a bounded queue, so parsing only runs
+    WRITER_QUEUE_BATCHES batches ahead of the database. Rows that other rows depend on (new Target
+    nodes) must be committed before they are added here, e.g. with a separate BulkWriter flushed first.
+    An error in a writer thread is raised again by close().
+
+    Usage:
+        with PartitionedWriter(4, lambda row: row['miRNAname']) as writers:
+            writers.add(RELATION_UPSERT_TEMPLATE, row)
+        writers.counters(RELATION_UPSERT_TEMPLATE)
+    """
+
+    def __init__(self, writer_count, partition_key, batch_size=BULK_BATCH_SIZE):
+        self.writer_count = max(1, writer_count)
+        self.partition_key = partition_key
+        self.batch_size = batch_size
+        self.rows_added = 0
+        # sessions are opened here, in the calling thread; each is then used by one writer thread only
+        self._writers = [BulkWriter(batch_size=batch_size) for _ in range(self.writer_count)]
+        self._pending = [[] for _ in range(self.writer_count)]
+        self._queues = [queue.Queue(maxsize=WRITER_QUEUE_BATCHES) for _ in range(self.writer_count)]
+        self._errors = []
+        self._threads = [threading.Thread(target=self._run, args=(partition,), daemon=True)
+                         for partition in range(self.writer_count)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(flush=exc_type is None)
+
+    def add(self, template, row):
+        partition = partition_index(self.partition_key(row), self.writer_count)
+        pending = self._pending[partition]
+        pending.append((template, row))
+        self.rows_added += 1
+        if len(pending) >= self.batch_size:
+            self._queues[partition].put(pending)
+            self._pending[partition] = []
+
+    def close(self, flush=True):
+        """Hands over the remaining rows (unless flush is False), waits for every writer and closes the sessions."""
+        for partition in range(self.writer_count):
+            if flush and self._pending[partition]:
+                self._queues[partition].put(self._pending[partition])
+            self._pending[partition] = []
+            self._queues[partition].put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+    def counters(self, template=None):
+        """Summed summary counters of all writers, as BulkWriter.counters."""
+        totals = {}
+        for writer in self._writers:
+            for name, value in writer.counters(template).items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def _run(self, partition):
+        writer = self._writers[partition]
+        rows_queue = self._queues[partition]
+        finished = False
+        try:
+            with writer:
+                while not finished:
+                    items = rows_queue.get()
+                    if items is None:
+                        finished = True
+                        continue
+                    for template, row in items:
+                        writer.add(template, row)
+        except Exception as e:
+            print(f"PartitionedWriter: writer {partition + 1}/{self.writer_count} failed: {e}")
+            self._errors.append(e)
+            # keep draining so that add() and close() never block on a dead writer
+            while not finished:
+                finished = rows_queue.get() is None
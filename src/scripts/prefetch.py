@@ -0,0 +1,268 @@
+"""
+Up-front target prefetch shared by the importers.
+
+The input is scanned once for its distinct target identifiers, the ones that already have a
+Target node are dropped, and the rest are resolved with the batched, cached gene lookups
+(ensembl.get_genes_by_ids, ncbi.get_genes_by_ens / get_genes_by_ids, uniprot.get_genes_by_ens)
+before any write starts. The write loop then only reads the returned map and never waits on
+the network.
+
+Ensembl IDs are resolved by a HedgedGeneResolver: the sources are queried concurrently (the next
+one starts once the previous has run HEDGE_SECONDS), the answer of the highest-priority source
+wins, and sources that are no longer needed are cancelled. Importers call close_resolvers() when
+they finish.
+"""
+import time
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import ncbi
+import uniprot
+import ensembl
+
+# Target keys per existence query
+TARGET_CHECK_BATCH_SIZE = 10000
+
+# Seconds a source may run before the next source is queried too (None = only after it finished)
+HEDGE_SECONDS = 2.0
+# Seconds an ID with a good answer waits for higher-priority sources still running (None = no limit)
+PATIENCE_SECONDS = 10.0
+
+# Fields a record needs to count as a good answer, per source; Ensembl records often lack the GeneID
+COMPLETE_GENE_FIELDS = {'ensembl': ('name', 'embl')}
+DEFAULT_COMPLETE_GENE_FIELDS = ('name', 'id')
+
+# Batched Ensembl gene ID -> gene record lookups: source -> f(ensembl_ids, species_name, cancel_event) -> {id: record or None}.
+# Once cancel_event is set, a lookup stops at its next poll or page and leaves the unfinished IDs uncached.
+ENS_LOOKUPS = {
+    'ensembl': lambda ensembl_ids, species_name, cancel_event: ensembl.get_genes_by_ids(ensembl_ids),
+    'ncbi': lambda ensembl_ids, species_name, cancel_event: ncbi.get_genes_by_ens(ensembl_ids, species_name, cancel_event),
+    'uniprot': lambda ensembl_ids, species_name, cancel_event: uniprot.get_genes_by_ens(ensembl_ids, cancel_event),
+}
+
+
+def existing_target_keys(session, key_property, values):
+    """The values that a Target already has as key_property ('ens_code' or 'geneid'), checked TARGET_CHECK_BATCH_SIZE per query."""
+    values = sorted(set(values))
+    existing = set()
+    for i in range(0, len(values), TARGET_CHECK_BATCH_SIZE):
+        result = session.run(f"MATCH (t:Target) WHERE t.{key_property} IN $values RETURN t.{key_property} AS value",
+                             values=values[i:i + TARGET_CHECK_BATCH_SIZE])
+        existing.update(record['value'] for record in result)
+    return existing
+
+
+def missing_target_keys(session, key_property, values):
+    """The values (sorted) that no Target has as key_property yet."""
+    existing = existing_target_keys(session, key_property, values)
+    return sorted(value for value in set(values) if value not in existing)
+
+
+def is_complete_gene(source, record):
+    """A good answer from source: the record has every field of COMPLETE_GENE_FIELDS for the source."""
+    return bool(record) and all(record.get(field) for field in COMPLETE_GENE_FIELDS.get(source, DEFAULT_COMPLETE_GENE_FIELDS))
+
+
+class HedgedGeneResolver:
+    """
+    Resolves Ensembl gene IDs over several batched sources (ENS_LOOKUPS keys) in priority order,
+    querying them concurrently instead of one after the other.
+
+    The first source starts at once. The next one starts when every running source has finished
+    or has run for hedge_seconds, and it gets the IDs that have no answer yet. A source answer
+    counts if is_good(source, record) holds. An ID takes the good answer from the source highest in
+    priority. A good answer from a lower-priority source waits at most patience_seconds for
+    higher-priority sources that are still running. Without any good answer, the ID falls back
+    to the first record any source returned.
+    Once every ID is settled, sources that have not started are cancelled, and running ones are
+    ignored and get their cancel_event set. The lookup then stops at its next status poll or result
+    page (an HTTP request in flight still runs to its timeout), so no pool thread keeps the
+    interpreter alive at exit.
+
+    Sources run in a thread pool that the resolver keeps across resolve() calls; close() (or leaving
+    a with block) shuts it down and cancels the lookups not started yet. The batch lookups wait on
+    download.get_executor() tasks, which must not happen inside that pool.
+
+    wins counts the IDs won per source (None = unresolved), winners maps each ID to its source,
+    source_seconds holds the lookup time of every finished source and stragglers counts the
+    sources that were ignored; summary() formats them.
+
+    Usage:
+        with HedgedGeneResolver(('ncbi', 'uniprot', 'ensembl')) as resolver:
+            genes = resolver.resolve(ensembl_ids, 'Homo sapiens')
+            print(resolver.summary())
+    """
+
+    def __init__(self, sources, hedge_seconds=HEDGE_SECONDS, patience_seconds=PATIENCE_SECONDS,
+                 is_good=is_complete_gene, lookups=None):
+        self.sources = list(sources)
+        self.hedge_seconds = hedge_seconds
+        self.patience_seconds = patience_seconds
+        self.is_good = is_good
+        self.lookups = lookups if lookups is not None else ENS_LOOKUPS
+        self.wins = Counter()
+        self.winners = {}
+        self.source_seconds = {}
+        self.stragglers = Counter()
+        # room for one ignored lookup per source still running from an earlier call
+        self._executor = ThreadPoolExecutor(max_workers=2 * max(1, len(self.sources)), thread_name_prefix='gene-resolver')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shuts the pool down; lookups not started yet are cancelled, ignored ones were told to stop by resolve()."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def resolve(self, ensembl_ids, species_name=None):
+        """Returns {ensembl_id: record or None}, keyed by the IDs as given."""
+        ensembl_ids = list(dict.fromkeys(ensembl_ids))
+        if not ensembl_ids or not self.sources:
+            return {ensembl_id: None for ensembl_id in ensembl_ids}
+
+        futures, started, answers, asked, first_good = {}, {}, {}, {}, {}
+        cancel_event = threading.Event()
+        try:
+            while True:
+                now = time.monotonic()
+                for source, future in futures.items():
+                    if source not in answers and future.done():
+                        answers[source] = self._answers(source, future, asked[source])
+                        self.source_seconds[source] = self.source_seconds.get(source, 0.0) + now - started[source]
+                        for ensembl_id, record in answers[source].items():
+                            if self.is_good(source, record):
+                                first_good.setdefault(ensembl_id, now)
+
+                decisions = {ensembl_id: self._decide(ensembl_id, answers, asked, first_good, now)
+                             for ensembl_id in ensembl_ids}
+                unsettled = [ensembl_id for ensembl_id, decision in decisions.items() if decision is None]
+                if not unsettled:
+                    break
+
+                running = [futures[source] for source in futures if source not in answers]
+                next_source = next((source for source in self.sources if source not in futures), None)
+                hedge_due = (next_source is not None and self.hedge_seconds is not None and
+                             running and now - max(started.values()) >= self.hedge_seconds)
+                if next_source is not None and (not running or hedge_due):
+                    asked[next_source] = set(unsettled)
+                    started[next_source] = now
+                    futures[next_source] = self._executor.submit(self.lookups[next_source], unsettled, species_name, cancel_event)
+                    continue
+
+                deadlines = []
+                if next_source is not None and self.hedge_seconds is not None:
+                    deadlines.append(max(started.values()) + self.hedge_seconds)
+                if self.patience_seconds is not None:
+                    deadlines.extend(first_good[ensembl_id] + self.patience_seconds
+                                     for ensembl_id in unsettled if ensembl_id in first_good)
+                timeout = max(0.0, min(deadlines) - now) if deadlines else None
+                wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        finally:
+            for source, future in futures.items():
+                if source not in answers:
+                    future.cancel()
+                    self.stragglers[source] += 1
+            cancel_event.set()
+
+        results = {}
+        for ensembl_id, (source, record) in decisions.items():
+            results[ensembl_id] = record
+            self.winners[ensembl_id] = source
+            self.wins[source] += 1
+        return results
+
+    def _answers(self, source, future, ensembl_ids):
+        """{ensembl_id: record or None} of a finished source; a failed source answers None for all."""
+        try:
+            found = future.result()
+        except Exception as e:
+            print(f"Gene resolver: {source} lookup failed: {e}")
+            found = {}
+        return {ensembl_id: found.get(ensembl_id.strip()) or found.get(ensembl_id.strip().upper())
+                for ensembl_id in ensembl_ids}
+
+    def _decide(self, ensembl_id, answers, asked, first_good, now):
+        """(winning source or None, record or None) for a settled ID, None while it still waits on a source."""
+        fallback = (None, None)
+        patience_over = (self.patience_seconds is not None and ensembl_id in first_good and
+                         now - first_good[ensembl_id] >= self.patience_seconds)
+        for source in self.sources:
+            if source not in asked:
+                # not started yet: the sources before it have no good answer
+                return None
+            if ensembl_id not in asked[source]:
+                continue
+            if source not in answers:
+                if patience_over:
+                    continue
+                return None
+            record = answers[source][ensembl_id]
+            if self.is_good(source, record):
+                return source, record
+            if record and fallback[1] is None:
+                fallback = (source, record)
+        return fallback
+
+    def summary(self):
+        """One line with the IDs won per source, the unresolved count, lookup times and ignored stragglers."""
+        wins = ', '.join(f"{source} {self.wins[source]}" for source in self.sources)
+        times = ', '.join(f"{source} {seconds:.1f}s" for source, seconds in self.source_seconds.items())
+        line = f"won by {wins}, unresolved {self.wins[None]}; lookup time {times or '-'}"
+        if self.stragglers:
+            line += f"; ignored {', '.join(sorted(self.stragglers))}"
+        return line
+
+
+_resolvers = {}
+
+
+def resolve_genes_by_ens(ensembl_ids, sources, species_name=None):
+    """
+    Gene details for many Ensembl gene IDs from the batched lookups of sources, in priority order
+    (e.g. ('ensembl', 'ncbi', 'uniprot')), queried concurrently by a HedgedGeneResolver kept per
+    source order for the process (its summary, printed after each call, counts all calls so far).
+    Returns {ensembl_id: record or None}, keyed by the IDs as given.
+    """
+    sources = tuple(sources)
+    resolver = _resolvers.get(sources)
+    if resolver is None:
+        resolver = _resolvers[sources] = HedgedGeneResolver(sources)
+    genes = resolver.resolve(ensembl_ids, species_name)
+    if genes:
+        print(f"Gene resolver: {resolver.summary()}")
+    return genes
+
+
+def close_resolvers():
+    """Closes the resolvers kept by resolve_genes_by_ens; importers call it when they finish."""
+    while _resolvers:
+        _, resolver = _resolvers.popitem()
+        resolver.close()
+
+
+def prefetch_targets_by_ens(session, ensembl_ids, sources, species_name=None):
+    """
+    The prefetch stage for Targets keyed on ens_code: {ensembl_id: record or None} for every ID
+    without a Target node yet (None when no source knows it).
+    """
+    new_ids = missing_target_keys(session, 'ens_code', ensembl_ids)
+    print(f"Prefetch: {len(new_ids)} of {len(set(ensembl_ids))} targets are new; resolving them via {' -> '.join(sources)}...")
+    genes = resolve_genes_by_ens(new_ids, sources, species_name)
+    print(f"Prefetch: resolved {sum(1 for record in genes.values() if record)} of {len(new_ids)} new targets.")
+    return genes
+
+
+def prefetch_targets_by_geneid(session, geneids):
+    """
+    The prefetch stage for Targets keyed on geneid: {geneid: NCBI record or None} for every
+    GeneID without a Target node yet.
+    """
+    new_geneids = missing_target_keys(session, 'geneid', geneids)
+    print(f"Prefetch: {len(new_geneids)} of {len(set(geneids))} target GeneIDs are new; fetching their NCBI records...")
+    genes = ncbi.get_genes_by_ids(new_geneids)
+    print(f"Prefetch: fetched {sum(1 for geneid in new_geneids if genes.get(geneid))} of {len(new_geneids)} new targets.")
+    return {geneid: genes.get(geneid) for geneid in new_geneids}
@@ -1,173 +1,211 @@
 import sys
 import os
 from collections import defaultdict
+from contextlib import nullcontext
 
-import ncbi
-import uniprot
-import ensembl
-from dbhelper import db_connect, create_db_info, create_relation_info
+from dbhelper import db_connect, create_db_info, create_relation_info, close_driver, ensure_schema, BulkWriter
+from download import configure_from_argv
+from mirna_resolver import MirnaResolver
+from prefetch import prefetch_targets_by_ens, close_resolvers
+from parallel_import import read_header, iter_chunk_lines, map_file_chunks, parse_parallel_args, PartitionedWriter
 
-if len(sys.argv) < 3:
-    print("Usage: %s <tsv_file_path> <relation name property, ex. MyInteraction>" % sys.argv[0])
-    exit()
-
-tsv_file_path = sys.argv[1]
-relation_name_property = sys.argv[2]
 BATCH_SIZE = 5000
 
 species = {
     'hsa': 'Homo sapiens',
 }
 
-session = db_connect()
+# Gene sources for new targets, in priority order (see prefetch.resolve_genes_by_ens)
+TARGET_SOURCES = ('ncbi', 'uniprot', 'ensembl')
 
-create_db_info('RNA22', 'https://cm.jefferson.edu/rna22/')
 source_db_link = 'https://cm.jefferson.edu/data-tools-downloads/rna22-full-sets-of-predictions/'
-
-min_value = float('inf')
-max_value = float('-inf')
 default_score_for_tsv = 0.0
 
-if not os.path.exists(tsv_file_path):
-    print(f"Error: TSV file not found: {tsv_file_path}")
-    sys.exit(1)
-
-print(f"Processing TSV file: {tsv_file_path}")
-
-def process_batch(batch, session):
-    if not batch:
-        return
-    
-    # Prepare batch parameters
-    batch_params = []
-    for item in batch:
-        batch_params.append({
-            'miRNAname': item['miRNAname'],
-            'target': item['target'],
-            'relation': item['relation'],
-            'score': item['score'],
-            'miRNA': item['miRNA']
-        })
-    
-    # Create relationships in batch
-    query = """
-    UNWIND $batch as row
+TARGET_UPSERT_TEMPLATE = """
+    MERGE (t:Target {ens_code: row.ens_code})
+    ON CREATE SET t.name = row.name, t.species = row.species,
+                  t.geneid = row.geneid, t.ncbi_link = row.ncbi_link
+"""
+
+RELATION_UPSERT_TEMPLATE = """
     MATCH (m:microRNA {name: row.miRNAname}), (t:Target {ens_code: row.target})
     MERGE (m)-[r:RNA22 {name: row.relation, source_microrna: row.miRNA, source_target: row.target}]->(t)
     ON CREATE SET r.score = row.score
-    """
-    
-    session.run(query, {'batch': batch_params})
-    print(f"Processed batch of {len(batch)} records")
-
-# Initialize batch
-current_batch = []
-total_processed = 0
+"""
 
-with open(tsv_file_path, 'r') as f_tsv:
-    header = next(f_tsv, None)  
+def print_line_warning(line_num, message):
+    print(f"Warning: Line {line_num}{message}")
 
-    for line_num, line in enumerate(f_tsv, 1):
+def iter_rna22_lines(lines, tsv_file_path, warn=print_line_warning):
+    """
+    Parses RNA22 data lines and yields (line_num, mirna_tool_name, target_ensembl_id, score) per row
+    with at least three columns, line_num counting from 1 over lines. An unparsable score becomes
+    default_score_for_tsv. Problems are reported as warn(line_num, message).
+    """
+    for line_num, line in enumerate(lines, 1):
         line = line.strip()
         if not line:
             continue
 
         data_cols = line.split('\t')
         if len(data_cols) < 3:
-            print(f"Warning: Line {line_num} in '{tsv_file_path}' has < 3 columns. Skipping: '{line}'")
+            warn(line_num, f" in '{tsv_file_path}' has < 3 columns. Skipping: '{line}'")
             continue
 
         try:
             score_val = float(data_cols[2])
         except ValueError:
-            print(f"Warning: Line {line_num}: Invalid score '{data_cols[2]}'. Using default score 0.0.")
+            warn(line_num, f": Invalid score '{data_cols[2]}'. Using default score 0.0.")
             score_val = default_score_for_tsv
 
-        if score_val < min_value: min_value = score_val
-        if score_val > max_value: max_value = score_val
+        yield line_num, data_cols[0], data_cols[1], score_val
 
-        params = {
-            'miRNA': data_cols[0],
-            'miRNAname': data_cols[0].replace('_', '-'),
-            'target': data_cols[1],
-            'relation': relation_name_property,
-            'score': str(score_val)
-        }
+def iter_rna22_rows(tsv_file_path):
+    """Streams an RNA22 prediction TSV (after its header line) through iter_rna22_lines."""
+    with open(tsv_file_path, 'r') as f_tsv:
+        header = next(f_tsv, None)
+        yield from iter_rna22_lines(f_tsv, tsv_file_path)
 
-        current_species_prefix = None
-        try:
-            current_species_prefix = params['miRNAname'].split('-')[0].lower()
-            if current_species_prefix not in species:
-                print(f"Warning: Line {line_num}: Species prefix '{current_species_prefix}' is not recognized.")
-        except IndexError:
-            print(f"Warning: Line {line_num}: Could not extract species prefix from '{params['miRNAname']}'.")
-
-        # Check if miRNA exists
-        r_mirna = session.run(
-            "MATCH (m:microRNA) "
-            "WHERE m.name =~ ('(?i)' + $miRNAname) "
-            "RETURN m.name AS name, m.accession AS accession LIMIT 1",
-            {'miRNAname': params['miRNAname']}
-        )
-        mirna_record = r_mirna.single()
-
-        if not mirna_record:
-            print(f"Info: Line {line_num}: microRNA '{params['miRNAname']}' not found. Skipping.")
-            continue
-        else:
-            if mirna_record['name'] != params['miRNAname']:
-                params['miRNAname'] = mirna_record['name']
-
-        # Check if target exists, create if not
-        r_target = session.run(
-            "MATCH (t:Target {ens_code:$target}) RETURN t LIMIT 1",
-            {'target': params['target']}
-        )
-        target_node_exists = r_target.single()
-
-        if not target_node_exists:
-            gene_info = ncbi.get_gene_by_ens(params['target']) or \
-                        uniprot.get_gene_by_ens(params['target']) or \
-                        ensembl.get_gene_by_id(params['target'])
-
-            if gene_info is None:
-                print(f"Warning: Line {line_num}: Could not fetch info for target '{params['target']}'. Skipping.")
-                continue
-
-            if gene_info.get('species', '') == '':
-                gene_info['species'] = species.get(current_species_prefix, 'Unknown')
-
-            final_gene_props = {
-                'name': gene_info.get('name'),
-                'species': gene_info.get('species'),
-                'geneid': str(gene_info.get('id')),
-                'ens_code': params['target'],
-                'ncbi_link': str(gene_info.get('id'))
+def parse_rna22_chunk(tsv_file_path, start, end):
+    """
+    Parallel mode, run in a worker process: parses the byte range [start, end) of the TSV.
+    Returns (rows as iter_rna22_lines yields them, line count, [(line_num, warning message)]),
+    line numbers counting from the start of the range.
+    """
+    lines = list(iter_chunk_lines(tsv_file_path, start, end))
+    warnings = []
+    rows = list(iter_rna22_lines(lines, tsv_file_path, lambda line_num, message: warnings.append((line_num, message))))
+    return rows, len(lines), warnings
+
+def iter_rna22_rows_parallel(tsv_file_path, processes):
+    """iter_rna22_rows with the lines parsed in processes; same rows, same order and line numbers."""
+    _, data_offset = read_header(tsv_file_path)
+    line_offset = 0
+    for rows, line_count, warnings in map_file_chunks(parse_rna22_chunk, tsv_file_path, processes, data_offset):
+        for line_num, message in warnings:
+            print_line_warning(line_offset + line_num, message)
+        for line_num, mirna_tool_name, target, score_val in rows:
+            yield line_offset + line_num, mirna_tool_name, target, score_val
+        line_offset += line_count
+
+def collect_rna22_target_chunk(tsv_file_path, start, end):
+    """The distinct target IDs of the byte range [start, end) of the TSV (a worker process task when parallel)."""
+    lines = iter_chunk_lines(tsv_file_path, start, end)
+    return {target for _, _, target, _ in iter_rna22_lines(lines, tsv_file_path, lambda line_num, message: None)}
+
+def collect_rna22_targets(tsv_file_path, processes=1):
+    """Scans the TSV once for its distinct target Ensembl IDs; line warnings are left to the import pass."""
+    _, data_offset = read_header(tsv_file_path)
+    targets = set()
+    for chunk_targets in map_file_chunks(collect_rna22_target_chunk, tsv_file_path, processes, data_offset):
+        targets.update(chunk_targets)
+    return targets
+
+def run_rna22_import(tsv_file_path, relation_name_property, processes=1, writers=1):
+    """
+    processes > 1 parses the TSV in that many processes; writers > 1 writes the relationships
+    over that many sessions, partitioned by miRNA (see parallel_import).
+    """
+    if not os.path.exists(tsv_file_path):
+        print(f"Error: TSV file not found: {tsv_file_path}")
+        sys.exit(1)
+
+    ensure_schema()
+    create_db_info('RNA22', 'https://cm.jefferson.edu/rna22/')
+
+    min_value = float('inf')
+    max_value = float('-inf')
+
+    print(f"Processing TSV file: {tsv_file_path}")
+
+    total_processed = 0
+    queued_targets = set()
+    # With parallel writers, relationships to a queued Target are held back until the Target is committed
+    uncommitted_targets = set()
+    held_relations = []
+
+    def on_target_flush():
+        if relation_writers is not None:
+            for held_params in held_relations:
+                relation_writers.add(RELATION_UPSERT_TEMPLATE, held_params)
+            held_relations.clear()
+            uncommitted_targets.clear()
+        print(f"Total processed so far: {total_processed}")
+
+    rows = iter_rna22_rows_parallel(tsv_file_path, processes) if processes > 1 else iter_rna22_rows(tsv_file_path)
+    # the target writer is closed (and flushed) first, so the held relationships still reach the writers
+    with db_connect() as session, \
+         (PartitionedWriter(writers, lambda row: row['miRNAname']) if writers > 1 else nullcontext()) as relation_writers, \
+         BulkWriter(batch_size=BATCH_SIZE, on_flush=on_target_flush,
+                    templates=(TARGET_UPSERT_TEMPLATE, RELATION_UPSERT_TEMPLATE)) as writer:
+        mirna_resolver = MirnaResolver.from_graph(session)
+        new_targets = prefetch_targets_by_ens(session, collect_rna22_targets(tsv_file_path, processes), TARGET_SOURCES)
+        for line_num, mirna_tool_name, target, score_val in rows:
+            if score_val < min_value: min_value = score_val
+            if score_val > max_value: max_value = score_val
+
+            params = {
+                'miRNA': mirna_tool_name,
+                'miRNAname': mirna_tool_name.replace('_', '-'),
+                'target': target,
+                'relation': relation_name_property,
+                'score': str(score_val)
             }
 
-            session.run(
-                "MERGE (t:Target {ens_code: $ens_code}) "
-                "ON CREATE SET t.name = $name, t.species = $species, "
-                "t.geneid = $geneid, t.ncbi_link = $ncbi_link",
-                final_gene_props
-            )
-
-        # Add to current batch
-        current_batch.append(params)
-        
-        # Process batch if it reaches the batch size
-        if len(current_batch) >= BATCH_SIZE:
-            process_batch(current_batch, session)
-            total_processed += len(current_batch)
-            print(f"Total processed so far: {total_processed}")
-            current_batch = []
-
-# Process any remaining records
-if current_batch:
-    process_batch(current_batch, session)
-    total_processed += len(current_batch)
-
-create_relation_info(relation_name_property, source_db_link, min_value, max_value, default_score_for_tsv)
-
-session.close()
-print(f"Finished processing '{tsv_file_path}'. Total records processed: {total_processed}")
+            current_species_prefix = None
+            try:
+                current_species_prefix = params['miRNAname'].split('-')[0].lower()
+                if current_species_prefix not in species:
+                    print(f"Warning: Line {line_num}: Species prefix '{current_species_prefix}' is not recognized.")
+            except IndexError:
+                print(f"Warning: Line {line_num}: Could not extract species prefix from '{params['miRNAname']}'.")
+
+            # Check if miRNA exists
+            stored_mirna_name = mirna_resolver.resolve_rna22(params['miRNAname'])
+            if not stored_mirna_name:
+                print(f"Info: Line {line_num}: microRNA '{params['miRNAname']}' not found. Skipping.")
+                continue
+            params['miRNAname'] = stored_mirna_name
+
+            # Queue the target once if it is new (resolved by the prefetch stage)
+            if params['target'] in new_targets:
+                gene_info = new_targets[params['target']]
+
+                if gene_info is None:
+                    print(f"Warning: Line {line_num}: Could not fetch info for target '{params['target']}'. Skipping.")
+                    continue
+
+                if params['target'] not in queued_targets:
+                    writer.add(TARGET_UPSERT_TEMPLATE, {
+                        'name': gene_info.get('name'),
+                        'species': gene_info.get('species') or species.get(current_species_prefix, 'Unknown'),
+                        'geneid': str(gene_info.get('id')),
+                        'ens_code': params['target'],
+                        'ncbi_link': str(gene_info.get('id'))
+                    })
+                    queued_targets.add(params['target'])
+                    if relation_writers is not None:
+                        uncommitted_targets.add(params['target'])
+
+            if relation_writers is None:
+                writer.add(RELATION_UPSERT_TEMPLATE, params)
+            elif params['target'] in uncommitted_targets:
+                held_relations.append(params)
+            else:
+                relation_writers.add(RELATION_UPSERT_TEMPLATE, params)
+            total_processed += 1
+
+    create_relation_info(relation_name_property, source_db_link, min_value, max_value, default_score_for_tsv)
+    close_resolvers()
+    close_driver()
+    print(f"Finished processing '{tsv_file_path}'. Total records processed: {total_processed}")
+
+if __name__ == "__main__":
+    configure_from_argv(sys.argv)
+    processes_arg, writers_arg = parse_parallel_args(sys.argv)
+    if len(sys.argv) < 3:
+        print("Usage: %s <tsv_file_path> <relation name property, ex. MyInteraction>" % sys.argv[0])
+        print("\t[--processes=<N>] parses the file in N processes, [--writers=<N>] writes over N sessions")
+        exit()
+
+    run_rna22_import(sys.argv[1], sys.argv[2], processes_arg, writers_arg)
@@ -0,0 +1,275 @@
+"""
+Local miRNA seed-match target scanner: a prediction source computed from a 3'UTR FASTA
+and the miRBase mature sequences instead of a precomputed tool dump.
+
+Site types follow TargetScan's canonical definitions, for a mature miRNA seed s = nt 2-8:
+    8mer     reverse complement of nt 2-8, followed by an A (opposite nt 1)
+    7mer-m8  reverse complement of nt 2-8 (not part of an 8mer)
+    7mer-A1  reverse complement of nt 2-7, followed by an A (not part of an 8mer)
+
+Each UTR is 2-bit encoded and turned into rolling 7-mer codes with NumPy. One histogram of
+all 7-mers and one of the 7-mers followed by an A then give the site counts of every seed
+at once (an 8mer at p is exactly a 7mer-m8 at p plus a 7mer-A1 at p+1), so the cost per UTR
+does not depend on the number of miRNAs. UTR chunks are scanned in a process pool.
+"""
+import sys
+import os
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import mirbase
+from mirna_seeds import encode_seed, SEED_LENGTH, SEED_SPACE
+from targetscan_fixed import TARGETSCAN_SPECIES, TARGET_SOURCES, TARGET_UPSERT_TEMPLATE, MINIMAL_TARGET_UPSERT_TEMPLATE, target_upsert_row
+from prefetch import prefetch_targets_by_ens, close_resolvers
+from dbhelper import db_connect, create_db_info, create_relation_info, close_driver, ensure_schema, BulkWriter
+from download import configure_from_argv
+
+DEFAULT_RELATION_NAME = 'SeedMatch'
+DEFAULT_CHUNK_GENES = 500
+MIRBASE_URL = 'https://www.mirbase.org/'
+
+RELATION_UPSERT_TEMPLATE = """
+    MATCH (mir:microRNA {{accession: row.accession}})
+    MATCH (gene:Target {{ens_code: row.ens_code}})
+    MERGE (mir)-[r:{relation_name}]->(gene)
+    SET r.tool_name = row.relation_name,
+        r.score = row.site_count,
+        r.site_count = row.site_count,
+        r.sites_8mer = row.sites_8mer,
+        r.sites_7mer_m8 = row.sites_7mer_m8,
+        r.sites_7mer_a1 = row.sites_7mer_a1,
+        r.source_utr = row.source_utr,
+        r.utr_length = row.utr_length
+"""
+
+# A/C/G/T(U) -> 0..3, anything else (N, gaps) -> 4
+_ENCODE_TABLE = np.full(256, 4, dtype=np.uint8)
+for _code, _bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+    for _base in _bases:
+        _ENCODE_TABLE[ord(_base)] = _code
+_BASE_A = 0
+
+_COMPLEMENT = str.maketrans('ACGU', 'UGCA')
+
+
+def reverse_complement(rna):
+    return rna.translate(_COMPLEMENT)[::-1]
+
+
+def site_codes(seed):
+    """(7mer-m8 code, 7mer-A1 code) of the UTR sites matching a 7-nt seed (nt 2-8)."""
+    return encode_seed(reverse_complement(seed)), encode_seed(reverse_complement(seed[:SEED_LENGTH - 1]) + 'A')
+
+
+def encode_utr(sequence):
+    """UTR sequence -> uint8 array of 2-bit base codes (4 for non-ACGTU)."""
+    return _ENCODE_TABLE[np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)]
+
+
+def kmer_histograms(encoded):
+    """
+    Histograms (length 4^7) of the valid 7-mers of an encoded UTR and of the valid 7-mers
+    that are followed by an A.
+    """
+    window_count = len(encoded) - SEED_LENGTH + 1
+    if window_count <= 0:
+        empty = np.zeros(SEED_SPACE, dtype=np.int64)
+        return empty, empty
+    invalid_so_far = np.concatenate(([0], np.cumsum(encoded == 4, dtype=np.int64)))
+    valid = (invalid_so_far[SEED_LENGTH:] - invalid_so_far[:window_count]) == 0
+
+    codes = np.zeros(window_count, dtype=np.int64)
+    for offset in range(SEED_LENGTH):
+        codes = (codes << 2) | (encoded[offset:offset + window_count] & 3)
+
+    followed_by_a = np.zeros(window_count, dtype=bool)
+    followed_by_a[:-1] = encoded[SEED_LENGTH:] == _BASE_A
+    all_counts = np.bincount(codes[valid], minlength=SEED_SPACE)
+    a_counts = np.bincount(codes[valid & followed_by_a], minlength=SEED_SPACE)
+    return all_counts, a_counts
+
+
+_m8_codes = None
+_a1_codes = None
+
+
+def _init_worker(m8_codes, a1_codes):
+    global _m8_codes, _a1_codes
+    _m8_codes, _a1_codes = m8_codes, a1_codes
+
+
+def scan_chunk(chunk):
+    """
+    Worker: for [(gene, utr_id, sequence)] returns [(gene, utr_id, utr_length, seed_ordinals, n8, n7m8, n7a1)]
+    with the per-seed site counts of every seed that has at least one site in the UTR.
+    """
+    results = []
+    for gene, utr_id, sequence in chunk:
+        all_counts, a_counts = kmer_histograms(encode_utr(sequence))
+        sites_8mer = a_counts[_m8_codes]
+        sites_7mer_m8 = all_counts[_m8_codes] - sites_8mer
+        sites_7mer_a1 = all_counts[_a1_codes] - sites_8mer
+        hit = np.nonzero(sites_8mer + sites_7mer_m8 + sites_7mer_a1)[0]
+        if len(hit):
+            results.append((gene, utr_id, len(sequence), hit, sites_8mer[hit], sites_7mer_m8[hit], sites_7mer_a1[hit]))
+    return results
+
+
+def iter_utr_sequences(fasta_file):
+    """
+    Yields (versionless gene ID, UTR ID, sequence) for every record of a 3'UTR FASTA whose header
+    starts with the gene ID, e.g. '>ENSG00000121410|ENST00000263100' or '>ENSG00000121410.12 ...'.
+    """
+    opener = gzip.open if fasta_file.endswith('.gz') else open
+    with opener(fasta_file, 'rt') as f:
+        header, sequence_lines = None, []
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                if header:
+                    yield header[0], header[1], ''.join(sequence_lines)
+                utr_id = line[1:].split()[0] if len(line) > 1 else ''
+                header, sequence_lines = (utr_id.split('|')[0].split('.')[0], utr_id), []
+            elif line:
+                sequence_lines.append(line)
+        if header:
+            yield header[0], header[1], ''.join(sequence_lines)
+
+
+def longest_utr_per_gene(fasta_file):
+    """{gene: (utr_id, sequence)} keeping the longest UTR of each gene as its representative."""
+    utrs = {}
+    for gene, utr_id, sequence in iter_utr_sequences(fasta_file):
+        if sequence and (gene not in utrs or len(sequence) > len(utrs[gene][1])):
+            utrs[gene] = (utr_id, sequence)
+    return utrs
+
+
+def seed_table(mature_fa_file, species_prefix):
+    """
+    Groups the mature miRNAs of the species by seed.
+    Returns (seeds, [[accession, ...] per seed], m8 code array, A1 code array).
+    """
+    accessions_by_seed = {}
+    for mature in mirbase.iter_mature_sequences(mature_fa_file, {species_prefix: species_prefix}):
+        if encode_seed(mature['seed']) is not None:
+            accessions_by_seed.setdefault(mature['seed'], []).append(mature['accession'])
+    seeds = sorted(accessions_by_seed)
+    codes = [site_codes(seed) for seed in seeds]
+    return (seeds, [accessions_by_seed[seed] for seed in seeds],
+            np.array([m8 for m8, _ in codes], dtype=np.int64), np.array([a1 for _, a1 in codes], dtype=np.int64))
+
+
+def scan_utrs(utrs, m8_codes, a1_codes, processes=None, chunk_genes=DEFAULT_CHUNK_GENES):
+    """Scans {gene: (utr_id, sequence)} in chunks of chunk_genes UTRs over a process pool; yields scan_chunk results."""
+    items = [(gene, utr_id, sequence) for gene, (utr_id, sequence) in utrs.items()]
+    chunks = [items[i:i + chunk_genes] for i in range(0, len(items), chunk_genes)]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(m8_codes, a1_codes)) as executor:
+        for chunk_results in executor.map(scan_chunk, chunks):
+            yield from chunk_results
+
+
+def queue_new_targets(writer, genes, new_targets, species_name):
+    """
+    Upserts the Target of every gene (Ensembl ID) still waiting in new_targets (the prefetched
+    {gene: details} of the genes not in the database), removing it from there; returns how many were queued.
+    """
+    queued = 0
+    for gene in genes:
+        if gene in new_targets:
+            writer.add(*target_upsert_row(gene, new_targets.pop(gene), species_name))
+            queued += 1
+    return queued
+
+
+def run_seedscan_import(utr_fasta_file, mature_fa_file, species_prefix, relation_name=DEFAULT_RELATION_NAME,
+                        processes=None, chunk_genes=DEFAULT_CHUNK_GENES, min_sites=1):
+    if species_prefix.lower() not in TARGETSCAN_SPECIES:
+        print(f"Error: Species prefix '{species_prefix}' not defined.")
+        sys.exit(1)
+    species_name, _ = TARGETSCAN_SPECIES[species_prefix.lower()]
+    for file_path in (utr_fasta_file, mature_fa_file):
+        if not os.path.exists(file_path):
+            print(f"CRITICAL Error: Input file not found at {file_path}")
+            sys.exit(1)
+
+    seeds, accessions_per_seed, m8_codes, a1_codes = seed_table(mature_fa_file, species_prefix)
+    utrs = longest_utr_per_gene(utr_fasta_file)
+    print(f"Seed scan: {len(utrs)} genes (longest UTR each) x {len(seeds)} distinct seeds "
+          f"of {sum(len(a) for a in accessions_per_seed)} {species_prefix} mature miRNAs")
+
+    ensure_schema()
+    create_db_info(relation_name, MIRBASE_URL)
+    relation_template = RELATION_UPSERT_TEMPLATE.format(relation_name=relation_name)
+
+    min_sites_seen, max_sites_seen = float('inf'), float('-inf')
+    scanned_genes = 0
+    queued_relationships = 0
+    # the Target templates are registered first, so every flush commits the new Targets before the relationships
+    with db_connect() as session, \
+         BulkWriter(templates=(TARGET_UPSERT_TEMPLATE, MINIMAL_TARGET_UPSERT_TEMPLATE, relation_template)) as writer:
+        # resolved up front; a Target is only created once its gene has a site
+        new_targets = prefetch_targets_by_ens(session, utrs.keys(), TARGET_SOURCES, species_name)
+        pending_relationships = []
+        for gene, utr_id, utr_length, hit, sites_8mer, sites_7mer_m8, sites_7mer_a1 in \
+                scan_utrs(utrs, m8_codes, a1_codes, processes, chunk_genes):
+            scanned_genes += 1
+            for seed_ordinal, n8, n7m8, n7a1 in zip(hit.tolist(), sites_8mer.tolist(), sites_7mer_m8.tolist(), sites_7mer_a1.tolist()):
+                site_count = n8 + n7m8 + n7a1
+                if site_count < min_sites:
+                    continue
+                min_sites_seen, max_sites_seen = min(min_sites_seen, site_count), max(max_sites_seen, site_count)
+                for accession in accessions_per_seed[seed_ordinal]:
+                    pending_relationships.append({
+                        'accession': accession, 'ens_code': gene, 'relation_name': relation_name,
+                        'site_count': site_count, 'sites_8mer': n8, 'sites_7mer_m8': n7m8, 'sites_7mer_a1': n7a1,
+                        'source_utr': utr_id, 'utr_length': utr_length
+                    })
+            if len(pending_relationships) >= writer.batch_size:
+                queued_relationships += flush_relationships(writer, relation_template, pending_relationships, new_targets, species_name)
+                pending_relationships = []
+                print(f"  Scanned {scanned_genes} genes with sites, {queued_relationships} relationships queued...")
+        queued_relationships += flush_relationships(writer, relation_template, pending_relationships, new_targets, species_name)
+        writer.flush()
+        created_count = writer.counters(relation_template).get('relationships_created', 0)
+
+    create_relation_info(relation_name, os.path.basename(utr_fasta_file),
+                         min_sites_seen if min_sites_seen != float('inf') else 0.0,
+                         max_sites_seen if max_sites_seen != float('-inf') else 0.0, float(min_sites))
+    close_resolvers()
+    close_driver()
+    print(f"\nFinished seed scan of {utr_fasta_file}")
+    print(f"  Genes with at least one site: {scanned_genes}")
+    print(f"  Relationship upserts written: {queued_relationships} (new: {created_count})")
+
+
+def flush_relationships(writer, relation_template, relationships, new_targets, species_name):
+    """Queues the new Targets the relationships need, then the relationships themselves (flushed in that order)."""
+    if not relationships:
+        return 0
+    queue_new_targets(writer, {row['ens_code'] for row in relationships}, new_targets, species_name)
+    for row in relationships:
+        writer.add(relation_template, row)
+    return len(relationships)
+
+
+if __name__ == "__main__":
+    configure_from_argv(sys.argv)
+    options = {'processes': None, 'chunk_genes': DEFAULT_CHUNK_GENES, 'min_sites': 1}
+    for arg in list(sys.argv[1:]):
+        for option_name in options:
+            if arg.startswith('--' + option_name.replace('_', '-') + '='):
+                options[option_name] = max(1, int(arg.split('=', 1)[1]))
+                sys.argv.remove(arg)
+
+    if len(sys.argv) < 4:
+        print("Usage: %s <3'UTR fasta[.gz]> <mature.fa[.gz]> <species prefix, ex. hsa> [<relation name, default %s>]"
+              % (sys.argv[0], DEFAULT_RELATION_NAME))
+        print("\t[--processes=N] [--chunk-genes=N] [--min-sites=N]")
+        print("\tUTR headers must start with the Ensembl gene ID (e.g. >ENSG00000121410|ENST00000263100)")
+        exit()
+
+    run_seedscan_import(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else DEFAULT_RELATION_NAME,
+                        **options)
@@ -0,0 +1,275 @@
+import os
+import re
+import gzip
+import mmap
+import sqlite3
+import threading
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data'))
+SPROT_DAT_FILE = os.path.join(BASE_DATA_DIR, 'uniprot_sprot.dat')
+
+# Sidecar byte-offset index, stored next to the .dat file.
+SPROT_INDEX_SUFFIX = '.idx.sqlite'
+INDEX_WRITE_BATCH_SIZE = 50000
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS entry (offset INTEGER PRIMARY KEY, length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS entry_key (kind TEXT NOT NULL, value TEXT NOT NULL, offset INTEGER NOT NULL);
+"""
+
+_GENE_NAME_PATTERN = re.compile(r'\bName=([^;{]+)')
+
+
+def default_data_file():
+    """Returns the plain uniprot_sprot.dat if present, else the .gz that fetch_sources.py downloads."""
+    if not os.path.exists(SPROT_DAT_FILE) and os.path.exists(SPROT_DAT_FILE + '.gz'):
+        return SPROT_DAT_FILE + '.gz'
+    return SPROT_DAT_FILE
+
+
+def open_sprot(file_path):
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+
+def iter_entry_blocks(file_path):
+    """
+    Reads a Swiss-Prot flat file once, yielding (offset, raw entry bytes) per entry.
+    The offset is in the uncompressed stream and the block ends with its '//' line.
+    """
+    with open_sprot(file_path) as f_sprot:
+        offset = 0
+        block_start = 0
+        block_lines = []
+        for line in f_sprot:
+            if not block_lines:
+                block_start = offset
+            block_lines.append(line)
+            offset += len(line)
+            if line.startswith(b'//'):
+                yield block_start, b''.join(block_lines)
+                block_lines = []
+
+
+def parse_entry(raw_entry):
+    """
+    Parses one flat-file entry (bytes or str) into a record:
+    'entry_id' (e.g. P53_HUMAN), 'ac' (primary accession), 'acs', 'name', 'id' (first NCBI GeneID),
+    'embl' (first Ensembl gene, unversioned), 'species' (OS without the common name) and 'tax_id',
+    plus 'ids' and 'embls' with every GeneID and Ensembl gene cross-reference.
+    'name' is the GN Name= symbol, falling back to the entry mnemonic.
+    """
+    if not isinstance(raw_entry, str):
+        raw_entry = str(raw_entry, 'utf-8', errors='replace')
+
+    record = {'entry_id': '', 'ac': '', 'acs': [], 'name': '', 'id': '', 'embl': '', 'species': '', 'tax_id': '',
+              'ids': [], 'embls': []}
+    species_parts = []
+    for line in raw_entry.splitlines():
+        code = line[:2]
+        if code == 'ID':
+            record['entry_id'] = line.split()[1]
+        elif code == 'AC':
+            record['acs'].extend(ac.strip() for ac in line[5:].split(';') if ac.strip())
+        elif code == 'GN':
+            if not record['name']:
+                name_match = _GENE_NAME_PATTERN.search(line)
+                if name_match:
+                    record['name'] = name_match.group(1).strip().upper()
+        elif code == 'OS':
+            species_parts.append(line[5:].strip())
+        elif code == 'OX':
+            if not record['tax_id']:
+                tax_match = re.search(r'NCBI_TaxID=(\d+)', line)
+                if tax_match:
+                    record['tax_id'] = tax_match.group(1)
+        elif code == 'DR':
+            fields = [field.strip() for field in line[5:].split(';')]
+            if fields[0] == 'GeneID' and len(fields) > 1:
+                if fields[1] not in record['ids']:
+                    record['ids'].append(fields[1])
+            elif fields[0] == 'Ensembl' and len(fields) > 3:
+                # DR   Ensembl; ENST...; ENSP...; ENSG00000141510.17. [P04637-1]
+                ensembl_gene_id = fields[3].split()[0].rstrip('.').split('.')[0]
+                if ensembl_gene_id not in record['embls']:
+                    record['embls'].append(ensembl_gene_id)
+        elif code == 'SQ':
+            break
+
+    record['ac'] = record['acs'][0] if record['acs'] else ''
+    record['id'] = record['ids'][0] if record['ids'] else ''
+    record['embl'] = record['embls'][0] if record['embls'] else ''
+    species = ' '.join(species_parts).rstrip('.')
+    record['species'] = re.sub(r'\s*\(.*\)\s*$', '', species)
+    if not record['name'] and record['entry_id']:
+        record['name'] = record['entry_id'].split('_')[0]
+    return record
+
+
+def species_matcher(species):
+    """
+    Builds a predicate over parsed records for a species given as an entry mnemonic suffix (HUMAN),
+    an NCBI tax ID (9606) or an organism name (Homo sapiens). None matches everything.
+    """
+    if not species:
+        return lambda record: True
+    species = species.strip()
+    if species.isdigit():
+        return lambda record: record['tax_id'] == species
+    if ' ' in species:
+        species_lc = species.lower()
+        return lambda record: record['species'].lower() == species_lc
+    suffix = '_' + species.upper()
+    return lambda record: record['entry_id'].endswith(suffix)
+
+
+def _mnemonic_suffix(species):
+    """Returns the b'_HUMAN ' style ID-line marker when species is a mnemonic suffix, else None."""
+    if species and not species.strip().isdigit() and ' ' not in species.strip():
+        return b'_' + species.strip().upper().encode('ascii') + b' '
+    return None
+
+
+def iter_entries(file_path, species=None):
+    """
+    Streams parsed records of the entries matching species (see species_matcher).
+    With a mnemonic suffix, other entries are skipped on their ID line without being parsed.
+    """
+    matches = species_matcher(species)
+    id_line_marker = _mnemonic_suffix(species)
+    for offset, raw_entry in iter_entry_blocks(file_path):
+        if id_line_marker is not None and id_line_marker not in raw_entry[:raw_entry.find(b'\n')]:
+            continue
+        record = parse_entry(raw_entry)
+        if matches(record):
+            yield record
+
+
+def _record_index_keys(record):
+    """Index key kinds: entry name, every accession, gene symbol, every GeneID and Ensembl gene."""
+    yield 'entry_id', record['entry_id']
+    for ac in record['acs']:
+        yield 'ac', ac
+    yield 'name', record['name']
+    for gene_id in record['ids']:
+        yield 'geneid', gene_id
+    for ensembl_gene_id in record['embls']:
+        yield 'embl', ensembl_gene_id
+
+
+def _data_file_signature(file_path):
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def index_path_for(file_path):
+    return file_path + SPROT_INDEX_SUFFIX
+
+
+def build_index(file_path):
+    """
+    Streams an uncompressed uniprot_sprot.dat once and writes the sidecar index mapping
+    entry name, accessions, gene symbol, GeneIDs and Ensembl genes to (offset, length).
+    Returns the index path, or None for a gzipped file (mmap needs the plain file).
+    """
+    if file_path.endswith('.gz'):
+        print(f"Swiss-Prot Index: {file_path} is gzipped; decompress it to index it.")
+        return None
+    index_path = index_path_for(file_path)
+    tmp_index_path = index_path + '.tmp'
+    if os.path.exists(tmp_index_path):
+        os.remove(tmp_index_path)
+
+    print(f"Swiss-Prot Index: Indexing {file_path}...")
+    conn = sqlite3.connect(tmp_index_path)
+    conn.executescript(_INDEX_SCHEMA)
+    entry_rows, key_rows = [], []
+    entry_count = 0
+
+    def flush():
+        conn.executemany("INSERT INTO entry (offset, length) VALUES (?, ?)", entry_rows)
+        conn.executemany("INSERT INTO entry_key (kind, value, offset) VALUES (?, ?, ?)", key_rows)
+        conn.commit()
+        entry_rows.clear(); key_rows.clear()
+
+    for offset, raw_entry in iter_entry_blocks(file_path):
+        record = parse_entry(raw_entry)
+        entry_rows.append((offset, len(raw_entry)))
+        key_rows.extend((kind, value, offset) for kind, value in _record_index_keys(record) if value)
+        entry_count += 1
+        if len(entry_rows) >= INDEX_WRITE_BATCH_SIZE:
+            flush()
+            print(f"  Indexed {entry_count} entries...")
+    flush()
+    conn.execute("CREATE INDEX entry_key_idx ON entry_key (kind, value COLLATE NOCASE)")
+    conn.execute("INSERT INTO meta (key, value) VALUES ('data_file_signature', ?)", (_data_file_signature(file_path),))
+    conn.commit()
+    conn.close()
+    os.replace(tmp_index_path, index_path)
+    print(f"Swiss-Prot Index: Indexed {entry_count} entries into {index_path}.")
+    return index_path
+
+
+class SprotIndex:
+    """
+    Random access to uniprot_sprot.dat through its sidecar index.
+    Entries are sliced out of a read-only mmap of the .dat as memoryviews, without copying.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.index_path = index_path_for(file_path)
+        self._local = threading.local()
+        with open(file_path, 'rb') as f_sprot:
+            self._mmap = mmap.mmap(f_sprot.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def is_current(self):
+        """False when the .dat changed since the index was built."""
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'data_file_signature'").fetchone()
+        return row is not None and row[0] == _data_file_signature(self.file_path)
+
+    def raw_entries(self, kind, value):
+        """Returns memoryviews of the entries whose `kind` key equals value (case-insensitive)."""
+        rows = self._conn().execute("""
+            SELECT DISTINCT e.offset, e.length FROM entry_key k JOIN entry e ON e.offset = k.offset
+            WHERE k.kind = ? AND k.value = ? COLLATE NOCASE ORDER BY e.offset
+        """, (kind, value.strip())).fetchall()
+        return [self._view[offset:offset + length] for offset, length in rows]
+
+    def entries(self, kind, value):
+        """Parsed records of the entries whose `kind` key equals value."""
+        return [parse_entry(raw_entry) for raw_entry in self.raw_entries(kind, value)]
+
+
+_default_index = None
+_default_index_checked = False
+_default_index_lock = threading.Lock()
+
+
+def get_default_index():
+    """
+    Returns the SprotIndex of the default uniprot_sprot.dat when its index exists and is current,
+    else None. Checked once per process.
+    """
+    global _default_index, _default_index_checked
+    with _default_index_lock:
+        if not _default_index_checked:
+            _default_index_checked = True
+            if os.path.exists(SPROT_DAT_FILE) and os.path.exists(index_path_for(SPROT_DAT_FILE)):
+                index = SprotIndex(SPROT_DAT_FILE)
+                if index.is_current():
+                    _default_index = index
+                else:
+                    print(f"Swiss-Prot Index: {index_path_for(SPROT_DAT_FILE)} is stale; rebuild it with 'uniprot_sprot.py index'.")
+        return _default_index
@@ -1,326 +1,421 @@
 import sys
 import os
-import csv
-import re  # Added for regular expression matching in miRNA mapping
-from dbhelper import db_connect, create_db_info, create_relation_info, close_driver
-import ncbi
-import uniprot
-import ensembl
-from neo4j.exceptions import Neo4jError
-
-MIRBASE_ALIASES_FILE = '../data/mirbase/aliases.txt'
-map_file_aliases_checked_and_missing = False
-
-def unique_ordered_candidates(candidates_list):
+import re
+from contextlib import nullcontext
+from dbhelper import db_connect, create_db_info, create_relation_info, close_driver, ensure_schema, BulkWriter
+from download import configure_from_argv
+from mirna_resolver import MirnaResolver
+from prefetch import prefetch_targets_by_ens, close_resolvers
+from parallel_import import read_header, iter_chunk_lines, map_file_chunks, parse_parallel_args, PartitionedWriter
+
+# miRNA species prefix -> (species name, NCBI tax ID used in the TargetScan "Species ID" column)
+TARGETSCAN_SPECIES = {
+    'hsa': ('Homo sapiens', '9606'),
+    'mmu': ('Mus musculus', '10090')
+}
+
+# Ensembl gene ID prefix -> tax ID of its species. A TargetScan file lists the genes of its own species
+# (TargetScanHuman: ENSG IDs) for the sites of every Species ID, see check_targetscan_species.
+ENSEMBL_GENE_PREFIX_TAX_IDS = {'ENSG': '9606', 'ENSMUSG': '10090', 'ENSRNOG': '10116'}
+SPECIES_CHECK_LINES = 1000
+
+TARGET_UPSERT_TEMPLATE = """
+    MERGE (t:Target {ens_code: row.m_ens_code})
+    ON CREATE SET t.name = row.m_name, t.species = row.m_species, t.geneid = row.m_geneid, t.ncbi_link = row.m_ncbi_link
+    ON MATCH SET  t.name = row.m_name, t.species = row.m_species, t.geneid = row.m_geneid
+"""
+
+MINIMAL_TARGET_UPSERT_TEMPLATE = """
+    MERGE (t:Target {ens_code: row.p_target_ensembl_base_tool})
+    ON CREATE SET t.name = row.p_target_ensembl_base_tool, t.species = row.p_current_species_name
+"""
+
+# One write per (miRNA, gene) pair per run; on a rerun or another input file the pair keeps the
+# lowest PCT and the union of the source names, as when every input row was merged on its own
+RELATION_UPSERT_TEMPLATE = """
+    MATCH (mir:microRNA {name: row.p_standard_mirna_name_match})
+    MATCH (gene:Target {ens_code: row.p_target_ensembl_base_tool})
+    MERGE (mir)-[r:TargetScan]->(gene) // Keying on nodes and rel type only
+    ON CREATE SET
+        r.tool_name = row.p_relation_name_prop,
+        r.pct_score = row.p_pct_score_val,
+        r.source_microrna_inputs = row.p_mirna_name_tool_inputs,
+        r.source_target_ensembl_inputs = row.p_target_ensembl_full_inputs
+    ON MATCH SET
+        r.pct_score = CASE WHEN r.pct_score IS NULL OR row.p_pct_score_val < r.pct_score THEN row.p_pct_score_val ELSE r.pct_score END,
+        r.source_microrna_inputs = coalesce(r.source_microrna_inputs, []) +
+            [name IN row.p_mirna_name_tool_inputs WHERE NOT name IN coalesce(r.source_microrna_inputs, [])],
+        r.source_target_ensembl_inputs = coalesce(r.source_target_ensembl_inputs, []) +
+            [ens IN row.p_target_ensembl_full_inputs WHERE NOT ens IN coalesce(r.source_target_ensembl_inputs, [])]
+"""
+
+# Gene sources for new targets, in priority order (see prefetch.resolve_genes_by_ens)
+TARGET_SOURCES = ('ensembl', 'ncbi', 'uniprot')
+
+def targetscan_columns(header_line):
     """
-    Returns a list with unique elements, preserving the original order.
+    (miR family, gene ID, species ID, PCT) column indices from a TargetScan header line.
+    Raises ValueError if a required column is missing from the header.
     """
-    seen = set()
-    return [x for x in candidates_list if not (x in seen or seen.add(x))]
+    header_parts = [h.strip().lower() for h in header_line.strip().split('\t')]
+    print(f"TargetScan Header: {header_parts}")
 
-def map_targetscan_mirna_to_db(targetscan_mirna_tool_name, species_prefix, session):
-    """
-    Maps a TargetScan miRNA name to standardized miRBase names in the Neo4j database.
-    This now uses a multi-phase approach and can return a list of multiple valid mappings
-    (e.g., for miRNA families).
+    try:
+        return (header_parts.index("mir family"), header_parts.index("gene id"),
+                header_parts.index("species id"), header_parts.index("pct"))
+    except ValueError as ve:
+        raise ValueError(f"Error finding column in TargetScan header: {ve}. Headers found: {header_parts}")
 
-    Returns a LIST of dictionaries, e.g., [{'name': db_name, 'accession': db_acc}, ...], or an empty list.
+def parse_targetscan_line(line, columns, tax_ids, stats):
     """
-    global map_file_aliases_checked_and_missing
-    original_ts_name_lc = targetscan_mirna_tool_name.strip().lower()
-
-    # --- Basic Normalization ---
-    base_candidate_with_species = original_ts_name_lc
-    if not base_candidate_with_species.startswith(species_prefix.lower() + "-"):
-        if base_candidate_with_species.startswith("mir-") or base_candidate_with_species.startswith("let-"):
-            base_candidate_with_species = species_prefix.lower() + "-" + base_candidate_with_species
-        else:
-            base_candidate_with_species = species_prefix.lower() + "-mir-" + base_candidate_with_species
-
-    found_mirnas = []
-
-    # === PHASE 1: Try Direct/Obvious Candidates First ===
-    direct_candidates = [base_candidate_with_species]
-    # Handle tool-specific suffixes like ".1", ".2"
-    if '.' in base_candidate_with_species:
-        parts = base_candidate_with_species.rsplit('.', 1)
-        if parts[1].isdigit() or (len(parts[1]) == 1 and 'A' <= parts[1].upper() <= 'Z'):
-            direct_candidates.append(parts[0])
-
-    # Add -5p/-3p variants for names that lack them
-    for candidate in list(direct_candidates):
-        if not (candidate.endswith("-5p") or candidate.endswith("-3p")):
-            direct_candidates.append(candidate + "-5p")
-            direct_candidates.append(candidate + "-3p")
-
-    for candidate_name in unique_ordered_candidates(direct_candidates):
-        if not candidate_name: continue
-        try:
-            query = "MATCH (m:microRNA) WHERE toLower(m.name) = $name_var RETURN m.name AS name, m.accession AS accession"
-            result = session.run(query, name_var=candidate_name)
-            for record in result:
-                found_mirnas.append({'name': record['name'], 'accession': record['accession']})
-        except Neo4jError as e_neo:
-            print(f"Neo4j Error during miRNA direct lookup for '{candidate_name}': {e_neo}")
-
-    if found_mirnas:
-        print(f"TargetScan miRNA Direct Match: Found {len(found_mirnas)} match(es) for '{targetscan_mirna_tool_name}' in Phase 1.")
-        return found_mirnas # Success on first try!
-
-    # === PHASE 2: If no direct match, try expanding families (e.g., 23 -> 23a, 23b) ===
-    print(f"-> No direct match for '{targetscan_mirna_tool_name}'. Proceeding to Phase 2 (Family Expansion).")
-    family_expansion_candidates = []
-    # Regex to find the number part of a miRNA, e.g., 'hsa-mir-23' in 'hsa-mir-23-3p'
-    # It captures (prefix)(number)(suffix)
-    match = re.match(r'^(.*?mir-\d+|.*?let-\d+)([a-zA-Z])?(-[35]p)?(.*)$', base_candidate_with_species)
-    if match:
-        base_part, existing_family_letter, arm, rest = match.groups()
-        if not existing_family_letter: # Only expand if no family letter is already present
-             for fam_sfx in ["a", "b", "c", "d", "e", "f"]: # Common family suffixes
-                # Construct new candidate: hsa-mir-23 + 'a' + -3p
-                new_candidate = f"{base_part}{fam_sfx}{arm or ''}{rest or ''}"
-                family_expansion_candidates.append(new_candidate)
-
-    for candidate_name in unique_ordered_candidates(family_expansion_candidates):
-        if not candidate_name: continue
-        try:
-            query = "MATCH (m:microRNA) WHERE toLower(m.name) = $name_var RETURN m.name AS name, m.accession AS accession"
-            result = session.run(query, name_var=candidate_name)
-            for record in result:
-                print(f"TargetScan Family Match: Found '{record['name']}' for base '{targetscan_mirna_tool_name}'")
-                found_mirnas.append({'name': record['name'], 'accession': record['accession']})
-        except Neo4jError as e_neo:
-            print(f"Neo4j Error during miRNA family lookup for '{candidate_name}': {e_neo}")
-
-    if found_mirnas:
-        return found_mirnas # Return all family members found
-
-    # === PHASE 3: Last resort, check the aliases file ===
-    if not map_file_aliases_checked_and_missing:
-        try:
-            with open(MIRBASE_ALIASES_FILE, 'r', encoding='utf-8') as f_aliases:
-                for line in f_aliases:
-                    parts = line.strip().split(';')
-                    if len(parts) >= 4:
-                        old_id_alias, new_acc_alias, new_id_alias = parts[1].lower(), parts[2], parts[3].lower()
-                        if old_id_alias == original_ts_name_lc or old_id_alias == base_candidate_with_species:
-                            query_alias, params_alias = "", {}
-                            if new_id_alias:
-                                query_alias = "MATCH (m:microRNA) WHERE toLower(m.name) = $id RETURN m.name, m.accession"
-                                params_alias = {'id': new_id_alias}
-                            elif new_acc_alias:
-                                query_alias = "MATCH (m:microRNA {accession: $acc}) RETURN m.name, m.accession"
-                                params_alias = {'acc': new_acc_alias}
-
-                            if query_alias:
-                                result_alias = session.run(query_alias, params_alias)
-                                for record_alias in result_alias:
-                                    print(f"TargetScan miRNA Alias Match: '{targetscan_mirna_tool_name}' -> '{old_id_alias}' -> DB '{record_alias['name']}'")
-                                    found_mirnas.append({'name': record_alias['name'], 'accession': record_alias['accession']})
-                                if found_mirnas:
-                                    return found_mirnas # Return alias match(es)
-        except FileNotFoundError:
-            if not map_file_aliases_checked_and_missing: print(f"Warning: miRBase aliases file not found: {MIRBASE_ALIASES_FILE}")
-            map_file_aliases_checked_and_missing = True
-        except Exception as e_alias:
-            if not map_file_aliases_checked_and_missing: print(f"Warning: Error reading miRBase aliases file: {e_alias}")
-            map_file_aliases_checked_and_missing = True
-
-    if not found_mirnas:
-        print(f"⚠️ TargetScan: Could not map miRNA '{targetscan_mirna_tool_name}' after all phases.")
-
-    # Return the list of found miRNAs (will be empty if none were found)
-    return found_mirnas
-
-def run_targetscan_import(data_file_path, species_prefix_arg):
-    print(f"Starting TargetScan import for species prefix: {species_prefix_arg}")
-    print(f"Processing data file: {data_file_path}")
+    (species_tax_id, [TargetScan miRNA names of the family string], target_ensembl_full, target_ensembl_base, pct)
+    for one data line, or None for a row of another species or a malformed one (counted in stats['skipped']).
+    """
+    mir_family_col_idx, gene_id_col_idx, species_id_col_idx, pct_col_idx = columns
+    row = line.strip().split('\t')
+    if not row or len(row) <= max(columns):
+        stats['skipped'] += 1
+        return None
 
-    database_name_display = 'TargetScan'
-    database_url_official = 'http://www.targetscan.org'
-    data_source_link_specific = 'https://www.targetscan.org/cgi-bin/targetscan/data_download.vert80.cgi'
+    species_tax_id = row[species_id_col_idx]
+    if species_tax_id not in tax_ids:
+        return None
 
-    create_db_info(database_name_display, database_url_official)
+    mirna_tool_entries_str = row[mir_family_col_idx]
+    target_ensembl_full_from_tool = row[gene_id_col_idx]
+    target_ensembl_base_from_tool = target_ensembl_full_from_tool.split('.')[0]
 
-    min_pct_score = float('inf')
-    max_pct_score = float('-inf')
+    try:
+        current_pct_score_val = float(row[pct_col_idx])
+    except ValueError:
+        stats['skipped'] += len(mirna_tool_entries_str.split('/'))
+        return None
 
-    processed_interactions_count = 0
-    created_relationships_count = 0
-    updated_relationships_count = 0
-    skipped_interactions_count = 0
-    total_lines_read_from_file = 0
+    mirna_names = [item.strip() for item in mirna_tool_entries_str.split('/') if item.strip()]
+    return species_tax_id, mirna_names, target_ensembl_full_from_tool, target_ensembl_base_from_tool, current_pct_score_val
 
-    species_id_map_targetscan = {
-        'hsa': ('Homo sapiens', '9606')
+def iter_targetscan_rows(data_file_path, tax_ids, stats=None):
+    """
+    Streams a TargetScan Predicted_Targets_Info file and yields
+    (species_tax_id, mirna_tool_name, target_ensembl_full, target_ensembl_base, pct)
+    for every miRNA of each family string in rows whose species ID is one of tax_ids.
+    stats, if given, receives 'lines_read' and 'skipped' (malformed rows / unparsable PCT) counts.
+    Raises ValueError if a required column is missing from the header.
+    """
+    tax_ids = set(tax_ids)
+    if stats is None: stats = {}
+    stats.setdefault('lines_read', 0)
+    stats.setdefault('skipped', 0)
+
+    with open(data_file_path, 'r', encoding='utf-8') as f_targetscan:
+        columns = targetscan_columns(f_targetscan.readline())
+        stats['lines_read'] += 1
+
+        for i, line in enumerate(f_targetscan):
+            stats['lines_read'] += 1
+            if (i+1) % 100000 == 0:
+                print(f"  Processed {i+1} lines from TargetScan data file (after header)...")
+
+            parsed = parse_targetscan_line(line, columns, tax_ids, stats)
+            if parsed is None:
+                continue
+            species_tax_id, mirna_names, target_ensembl_full_from_tool, target_ensembl_base_from_tool, current_pct_score_val = parsed
+            for mirna_name_tool_item_clean in mirna_names:
+                yield species_tax_id, mirna_name_tool_item_clean, target_ensembl_full_from_tool, target_ensembl_base_from_tool, current_pct_score_val
+
+def aggregate_targetscan_chunk(data_file_path, start, end, columns, tax_ids):
+    """
+    Parallel mode, run in a worker process: parses the byte range [start, end) of the file and aggregates it per
+    (TargetScan miRNA name, Ensembl base ID) into [min PCT, max PCT, row count, {full Ensembl ID input: None}].
+    Returns (aggregate, {'lines_read', 'skipped'}).
+    """
+    stats = {'lines_read': 0, 'skipped': 0}
+    aggregate = {}
+    for line in iter_chunk_lines(data_file_path, start, end):
+        stats['lines_read'] += 1
+        parsed = parse_targetscan_line(line, columns, tax_ids, stats)
+        if parsed is None:
+            continue
+        _, mirna_names, target_ensembl_full_from_tool, target_ensembl_base_from_tool, current_pct_score_val = parsed
+        for mirna_name_tool_item_clean in mirna_names:
+            key = (mirna_name_tool_item_clean, target_ensembl_base_from_tool)
+            entry = aggregate.get(key)
+            if entry is None:
+                aggregate[key] = [current_pct_score_val, current_pct_score_val, 1, {target_ensembl_full_from_tool: None}]
+                continue
+            if current_pct_score_val < entry[0]: entry[0] = current_pct_score_val
+            if current_pct_score_val > entry[1]: entry[1] = current_pct_score_val
+            entry[2] += 1
+            entry[3][target_ensembl_full_from_tool] = None
+    return aggregate, stats
+
+def _init_pair_stats(stats):
+    for key, value in (('lines_read', 0), ('skipped', 0), ('considered', 0), ('unmapped', 0),
+                       ('min_pct', float('inf')), ('max_pct', float('-inf'))):
+        stats.setdefault(key, value)
+
+def aggregate_targetscan_pairs(data_file_path, species_prefix, tax_id, mirna_resolver, stats):
+    """
+    Phase one: streams the file once and aggregates every (miRNA name, Ensembl base ID) pair of the rows
+    with Species ID tax_id in memory. Each distinct family string is resolved once (the resolver memoizes).
+    Returns {(miRNA name, Ensembl base ID): [min PCT, {TargetScan miRNA input: None}, {full Ensembl ID input: None}]},
+    the dicts being insertion-ordered sets of the inputs seen for the pair.
+    stats receives 'lines_read', 'skipped', 'considered', 'unmapped', 'min_pct' and 'max_pct'.
+    """
+    _init_pair_stats(stats)
+    pairs = {}
+    for _, mirna_name_tool_item_clean, target_ensembl_full_from_tool, target_ensembl_base_from_tool, current_pct_score_val \
+            in iter_targetscan_rows(data_file_path, (tax_id,), stats):
+        stats['considered'] += 1
+        # resolve_targetscan returns a list of potential matches (e.g., for miR-23 -> hsa-mir-23a, hsa-mir-23b)
+        mirna_map_results = mirna_resolver.resolve_targetscan(mirna_name_tool_item_clean, species_prefix)
+        if not mirna_map_results:
+            stats['unmapped'] += 1
+            continue
+
+        if current_pct_score_val < stats['min_pct']: stats['min_pct'] = current_pct_score_val
+        if current_pct_score_val > stats['max_pct']: stats['max_pct'] = current_pct_score_val
+
+        for mirna_map_result in mirna_map_results:
+            pair = pairs.get((mirna_map_result['name'], target_ensembl_base_from_tool))
+            if pair is None:
+                pairs[(mirna_map_result['name'], target_ensembl_base_from_tool)] = \
+                    [current_pct_score_val, {mirna_name_tool_item_clean: None}, {target_ensembl_full_from_tool: None}]
+                continue
+            if current_pct_score_val < pair[0]: pair[0] = current_pct_score_val
+            pair[1][mirna_name_tool_item_clean] = None
+            pair[2][target_ensembl_full_from_tool] = None
+    return pairs
+
+def aggregate_targetscan_pairs_parallel(data_file_path, species_prefix, tax_id, mirna_resolver, stats, processes):
+    """
+    aggregate_targetscan_pairs with the parsing spread over processes: line-aligned chunks of the file are
+    aggregated by aggregate_targetscan_chunk in a process pool and merged here in file order, then every
+    TargetScan miRNA is resolved once. Same result and stats as aggregate_targetscan_pairs.
+    """
+    _init_pair_stats(stats)
+    header_line, data_offset = read_header(data_file_path)
+    columns = targetscan_columns(header_line)
+    stats['lines_read'] += 1
+
+    merged = {}
+    for chunk_aggregate, chunk_stats in map_file_chunks(aggregate_targetscan_chunk, data_file_path, processes,
+                                                        data_offset, (columns, {tax_id})):
+        stats['lines_read'] += chunk_stats['lines_read']
+        stats['skipped'] += chunk_stats['skipped']
+        for key, (min_pct, max_pct, row_count, ensembl_inputs) in chunk_aggregate.items():
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [min_pct, max_pct, row_count, ensembl_inputs]
+                continue
+            if min_pct < entry[0]: entry[0] = min_pct
+            if max_pct > entry[1]: entry[1] = max_pct
+            entry[2] += row_count
+            entry[3].update(ensembl_inputs)
+        print(f"  Processed {stats['lines_read'] - 1} lines from TargetScan data file (after header)...")
+
+    pairs = {}
+    for (mirna_name_tool_item_clean, target_ensembl_base_from_tool), (min_pct, max_pct, row_count, ensembl_inputs) in merged.items():
+        stats['considered'] += row_count
+        mirna_map_results = mirna_resolver.resolve_targetscan(mirna_name_tool_item_clean, species_prefix)
+        if not mirna_map_results:
+            stats['unmapped'] += row_count
+            continue
+
+        if min_pct < stats['min_pct']: stats['min_pct'] = min_pct
+        if max_pct > stats['max_pct']: stats['max_pct'] = max_pct
+
+        for mirna_map_result in mirna_map_results:
+            pair = pairs.get((mirna_map_result['name'], target_ensembl_base_from_tool))
+            if pair is None:
+                pairs[(mirna_map_result['name'], target_ensembl_base_from_tool)] = \
+                    [min_pct, {mirna_name_tool_item_clean: None}, dict(ensembl_inputs)]
+                continue
+            if min_pct < pair[0]: pair[0] = min_pct
+            pair[1][mirna_name_tool_item_clean] = None
+            pair[2].update(ensembl_inputs)
+    return pairs
+
+def parse_species_arg(species_arg):
+    """
+    A TargetScan species argument -> (prefix, (species name, tax ID)). The argument is a prefix known in
+    TARGETSCAN_SPECIES ('hsa', 'mmu') or a new species as '<prefix>=<tax ID>:<species name>'.
+    Raises ValueError for an unknown prefix.
+    """
+    species_arg = species_arg.strip()
+    if '=' in species_arg:
+        species_prefix, _, tax_and_name = species_arg.partition('=')
+        tax_id, _, species_name = tax_and_name.partition(':')
+        return species_prefix.strip().lower(), (species_name.strip(), tax_id.strip())
+    if species_arg.lower() in TARGETSCAN_SPECIES:
+        return species_arg.lower(), TARGETSCAN_SPECIES[species_arg.lower()]
+    raise ValueError(f"Species prefix '{species_arg}' not defined for TargetScan mapping.")
+
+def parse_import_args(args):
+    """
+    '<file> <species> [<file> <species> ...]' -> [(file, prefix, (species name, tax ID))], one TargetScan file
+    per species (see check_targetscan_species). Raises ValueError for an unpaired argument, an unknown
+    species (see parse_species_arg) or a species given twice.
+    """
+    if not args or len(args) % 2:
+        raise ValueError("Expected <TargetScan file> <species> pairs.")
+    imports = []
+    for data_file_path, species_arg in zip(args[::2], args[1::2]):
+        species_prefix, species = parse_species_arg(species_arg)
+        if any(species_prefix == imported_prefix for _, imported_prefix, _ in imports):
+            raise ValueError(f"Species '{species_prefix}' given for more than one file.")
+        imports.append((data_file_path, species_prefix, species))
+    return imports
+
+def check_targetscan_species(data_file_path, tax_id, sample_lines=SPECIES_CHECK_LINES):
+    """
+    Raises ValueError if tax_id is not the species whose genes the file lists. The rows of other
+    Species IDs predict sites in the orthologous UTRs, yet name the genes of the file's species, so
+    importing them would attach e.g. mouse miRNAs to human Targets; mouse needs the TargetScanMouse
+    file. The gene species is taken from the Ensembl prefix of the first sample_lines data lines;
+    a file with unknown gene IDs is not checked.
+    """
+    with open(data_file_path, 'r', encoding='utf-8') as f_targetscan:
+        gene_id_col_idx = targetscan_columns(f_targetscan.readline())[1]
+        gene_prefixes = set()
+        for _, line in zip(range(sample_lines), f_targetscan):
+            row = line.rstrip('\r\n').split('\t')
+            match = re.match(r'(ENS[A-Z]*G)\d', row[gene_id_col_idx]) if len(row) > gene_id_col_idx else None
+            if match:
+                gene_prefixes.add(match.group(1))
+
+    gene_tax_ids = {ENSEMBL_GENE_PREFIX_TAX_IDS.get(gene_prefix) for gene_prefix in gene_prefixes}
+    if len(gene_tax_ids) != 1 or None in gene_tax_ids:
+        print(f"TargetScan: Warning: gene species of {data_file_path} not determined ({', '.join(sorted(gene_prefixes)) or 'no Ensembl IDs'}); species not checked.")
+        return
+    gene_tax_id = gene_tax_ids.pop()
+    if tax_id != gene_tax_id:
+        raise ValueError(f"{data_file_path} lists the genes of tax ID {gene_tax_id} ({', '.join(sorted(gene_prefixes))} IDs); "
+                         f"tax ID {tax_id} would be attached to that species' Targets. Use the TargetScan file of that species.")
+
+def target_upsert_row(target_ens, gene_details, species_name):
+    """(template, row) creating the Target for target_ens from its gene details (minimal node if None)."""
+    if not gene_details:
+        return MINIMAL_TARGET_UPSERT_TEMPLATE, {'p_target_ensembl_base_tool': target_ens, 'p_current_species_name': species_name}
+    return TARGET_UPSERT_TEMPLATE, {
+        'm_ens_code': target_ens,
+        'm_name': gene_details.get('name') or target_ens,
+        'm_species': gene_details.get('species') or species_name,
+        'm_geneid': gene_details.get('id', ''),
+        'm_ncbi_link': gene_details.get('id', '')
     }
-    if species_prefix_arg.lower() not in species_id_map_targetscan:
-        print(f"Error: Species prefix '{species_prefix_arg}' not defined for TargetScan mapping.")
-        sys.exit(1)
-    current_species_name, expected_ncbi_tax_id = species_id_map_targetscan[species_prefix_arg.lower()]
 
-    try:
+def run_targetscan_import(imports, processes=1, writers=1):
+    """
+    Imports every (TargetScan file, prefix, (species name, tax ID)) of imports (see parse_import_args),
+    one file per species, sharing the miRNA resolver built from the graph. All files are checked
+    before anything is written. processes > 1 parses each file in that many processes; writers > 1
+    writes the relationships over that many sessions, partitioned by miRNA (see parallel_import).
+    """
+    print(f"Starting TargetScan import for species prefixes: {', '.join(species_prefix for _, species_prefix, _ in imports)}")
+
+    database_name_display = 'TargetScan'
+    database_url_official = 'http://www.targetscan.org'
+    data_source_link_specific = 'https://www.targetscan.org/cgi-bin/targetscan/data_download.vert80.cgi'
+
+    for data_file_path, _, (_, tax_id) in imports:
         if not os.path.exists(data_file_path):
             print(f"CRITICAL Error: Input TargetScan data file not found at {data_file_path}")
             sys.exit(1)
+        try:
+            check_targetscan_species(data_file_path, tax_id)
+        except ValueError as e_species:
+            print(f"Error: {e_species}")
+            sys.exit(1)
 
-        with open(data_file_path, 'r', encoding='utf-8') as f_targetscan:
-            with db_connect() as session:
-                header_line_str = f_targetscan.readline().strip()
-                total_lines_read_from_file +=1
-                header_parts = [h.strip().lower() for h in header_line_str.split('\t')]
-                print(f"TargetScan Header: {header_parts}")
-
-                try:
-                    mir_family_col_idx = header_parts.index("mir family")
-                    gene_id_col_idx = header_parts.index("gene id")
-                    species_id_col_idx = header_parts.index("species id")
-                    pct_col_idx = header_parts.index("pct")
-                except ValueError as ve:
-                    print(f"Error finding column in TargetScan header: {ve}. Headers found: {header_parts}")
-                    sys.exit(1)
-
-                for i, line in enumerate(f_targetscan):
-                    total_lines_read_from_file +=1
-                    current_row_num_for_log = i + 2
-
-                    try:
-                        row = line.strip().split('\t')
-                        max_needed_idx = max(mir_family_col_idx, gene_id_col_idx, species_id_col_idx, pct_col_idx)
-                        if not row or len(row) <= max_needed_idx:
-                            skipped_interactions_count += 1
-                            continue
-
-                        if row[species_id_col_idx] != expected_ncbi_tax_id:
-                            continue
-
-                        mirna_tool_entries_str = row[mir_family_col_idx]
-                        target_ensembl_full_from_tool = row[gene_id_col_idx]
-                        target_ensembl_base_from_tool = target_ensembl_full_from_tool.split('.')[0]
-
-                        try:
-                            current_pct_score_val = float(row[pct_col_idx])
-                        except (ValueError, IndexError):
-                            skipped_interactions_count += len(mirna_tool_entries_str.split('/'))
-                            continue
-
-                        for mirna_name_tool_item in mirna_tool_entries_str.split('/'):
-                            mirna_name_tool_item_clean = mirna_name_tool_item.strip()
-                            if not mirna_name_tool_item_clean: continue
-
-                            processed_interactions_count += 1
-
-                            # === MODIFIED SECTION START ===
-                            # map_targetscan_mirna_to_db now returns a list of potential matches
-                            mirna_map_results = map_targetscan_mirna_to_db(mirna_name_tool_item_clean, species_prefix_arg, session)
-
-                            if not mirna_map_results:
-                                skipped_interactions_count +=1
-                                continue
-
-                            # Loop through each valid mapping found (e.g., for miR-23 -> hsa-mir-23a, hsa-mir-23b)
-                            for mirna_map_result in mirna_map_results:
-                                params_for_cypher = {
-                                    'p_mirna_name_tool': mirna_name_tool_item_clean,
-                                    'p_target_ensembl_base_tool': target_ensembl_base_from_tool,
-                                    'p_target_ensembl_full_tool': target_ensembl_full_from_tool,
-                                    'p_pct_score_val': current_pct_score_val,
-                                    'p_relation_name_prop': database_name_display,
-                                    'p_current_species_name': current_species_name,
-                                    'p_standard_mirna_name_match': mirna_map_result['name'] # Use specific name from this iteration
-                                }
-
-                                if current_pct_score_val < min_pct_score: min_pct_score = current_pct_score_val
-                                if current_pct_score_val > max_pct_score: max_pct_score = current_pct_score_val
-
-                                target_check_query = "MATCH (t:Target {ens_code: $p_target_ensembl_base_tool}) RETURN t.name LIMIT 1"
-                                target_record = session.run(target_check_query, params_for_cypher).single()
-                                if not target_record:
-                                    gene_details = ensembl.get_gene_by_id(params_for_cypher['p_target_ensembl_base_tool'])
-                                    if not gene_details: gene_details = ncbi.get_gene_by_ens(params_for_cypher['p_target_ensembl_base_tool'], params_for_cypher['p_current_species_name'])
-                                    if not gene_details: gene_details = uniprot.get_gene_by_ens(params_for_cypher['p_target_ensembl_base_tool'])
-
-                                    if gene_details:
-                                        merge_target_params = {
-                                            'm_ens_code': gene_details.get('embl', params_for_cypher['p_target_ensembl_base_tool']),
-                                            'm_name': gene_details.get('name', params_for_cypher['p_target_ensembl_base_tool']),
-                                            'm_species': gene_details.get('species', params_for_cypher['p_current_species_name']),
-                                            'm_geneid': gene_details.get('id', ''),
-                                            'm_ncbi_link': gene_details.get('id', '')
-                                        }
-                                        if not merge_target_params['m_ens_code']: skipped_interactions_count+=1; continue
-                                        session.run("""
-                                            MERGE (t:Target {ens_code: $m_ens_code})
-                                            ON CREATE SET t.name = $m_name, t.species = $m_species, t.geneid = $m_geneid, t.ncbi_link = $m_ncbi_link
-                                            ON MATCH SET  t.name = $m_name, t.species = $m_species, t.geneid = $m_geneid
-                                        """, merge_target_params)
-                                    else:
-                                        session.run("""
-                                            MERGE (t:Target {ens_code: $p_target_ensembl_base_tool})
-                                            ON CREATE SET t.name = $p_target_ensembl_base_tool, t.species = $p_current_species_name
-                                        """, params_for_cypher)
-
-                                merge_relationship_query = """
-                                MATCH (mir:microRNA {name: $p_standard_mirna_name_match})
-                                MATCH (gene:Target {ens_code: $p_target_ensembl_base_tool})
-                                MERGE (mir)-[r:TargetScan]->(gene) // Keying on nodes and rel type only
-                                ON CREATE SET
-                                    r.tool_name = $p_relation_name_prop,
-                                    r.pct_score = $p_pct_score_val,
-                                    r.source_microrna_inputs = [$p_mirna_name_tool], // Store original inputs as lists
-                                    r.source_target_ensembl_inputs = [$p_target_ensembl_full_tool]
-                                ON MATCH SET
-                                    r.pct_score = CASE WHEN $p_pct_score_val < r.pct_score THEN $p_pct_score_val ELSE r.pct_score END,
-                                    r.source_microrna_inputs = CASE WHEN NOT $p_mirna_name_tool IN r.source_microrna_inputs THEN r.source_microrna_inputs + $p_mirna_name_tool ELSE r.source_microrna_inputs END,
-                                    r.source_target_ensembl_inputs = CASE WHEN NOT $p_target_ensembl_full_tool IN r.source_target_ensembl_inputs THEN r.source_target_ensembl_inputs + $p_target_ensembl_full_tool ELSE r.source_target_ensembl_inputs END
-                                """
-                                rel_result_summary = session.run(merge_relationship_query, params_for_cypher).consume()
-                                if rel_result_summary.counters.relationships_created > 0:
-                                    created_relationships_count += 1
-                                elif rel_result_summary.counters.properties_set > 0 :
-                                    updated_relationships_count +=1
-                            # === MODIFIED SECTION END ===
-
-                    except Exception as e_row:
-                        print(f"❌ Error processing TargetScan row {current_row_num_for_log} ('{line.strip()}'): {e_row}")
-                        if row and len(row) > mir_family_col_idx:
-                            skipped_interactions_count += len(row[mir_family_col_idx].split('/'))
-                        else:
-                            skipped_interactions_count += 1
-                        continue
-
-                    if (i+1) % 5000 == 0:
-                        print(f"  Processed {i+1} lines from TargetScan data file (after header)...")
-
-            print(f"\nFinished TargetScan processing from {data_file_path}")
-            print(f"  Total lines read (incl header): {total_lines_read_from_file}")
-            print(f"  Interaction pairs considered: {processed_interactions_count}")
-            print(f"  New relationships CREATED by MERGE: {created_relationships_count}")
-            print(f"  Existing relationships UPDATED by MERGE: {updated_relationships_count}")
-            print(f"  Interaction pairs skipped: {skipped_interactions_count}")
-
-            final_min_score = min_pct_score if min_pct_score != float('inf') else 0.0
-            final_max_score = max_pct_score if max_pct_score != float('-inf') else 1.0
-            create_relation_info(database_name_display, data_source_link_specific, final_min_score, final_max_score, 0.0)
-
-    except FileNotFoundError:
-        print(f"CRITICAL Error: Input TargetScan data file not found at {data_file_path}")
+    ensure_schema()
+    create_db_info(database_name_display, database_url_official)
+
+    try:
+        min_pct_score = float('inf')
+        max_pct_score = float('-inf')
+        with db_connect() as session:
+            mirna_resolver = MirnaResolver.from_graph(session)
+
+            for data_file_path, species_prefix, (current_species_name, tax_id) in imports:
+                print(f"Processing data file: {data_file_path} ({species_prefix}, Species ID {tax_id})")
+                # Phase one: aggregate the pairs in a single pass ...
+                species_stats = {}
+                if processes > 1:
+                    pairs = aggregate_targetscan_pairs_parallel(data_file_path, species_prefix, tax_id, mirna_resolver, species_stats, processes)
+                else:
+                    pairs = aggregate_targetscan_pairs(data_file_path, species_prefix, tax_id, mirna_resolver, species_stats)
+                print(f"\nFinished reading {data_file_path}: {species_stats['lines_read']} lines (incl header), {species_stats['skipped']} malformed")
+                if not species_stats['considered']:
+                    print(f"Error: {data_file_path} has no rows with Species ID {tax_id}; {species_prefix} ({current_species_name}) not imported.")
+                    continue
+                min_pct_score = min(min_pct_score, species_stats['min_pct'])
+                max_pct_score = max(max_pct_score, species_stats['max_pct'])
+
+                # ... then resolve the new targets before anything is written
+                target_ensembl_ids = {target_ens for _, target_ens in pairs}
+                print(f"{species_prefix}: {len(pairs)} miRNA-target pairs over {len(target_ensembl_ids)} targets")
+                new_targets = prefetch_targets_by_ens(session, target_ensembl_ids, TARGET_SOURCES, current_species_name)
+
+                with BulkWriter(session=session) as writer:
+                    for target_ens, gene_details in new_targets.items():
+                        writer.add(*target_upsert_row(target_ens, gene_details, current_species_name))
+                    # the relationships MATCH these targets, possibly from other sessions
+                    writer.flush()
+
+                    # Phase two: one write per final relationship
+                    with (PartitionedWriter(writers, lambda row: row['p_standard_mirna_name_match']) if writers > 1
+                          else nullcontext(writer)) as relation_writer:
+                        for (mirna_name, target_ens), (min_pct, mirna_inputs, ensembl_inputs) in pairs.items():
+                            relation_writer.add(RELATION_UPSERT_TEMPLATE, {
+                                'p_standard_mirna_name_match': mirna_name,
+                                'p_target_ensembl_base_tool': target_ens,
+                                'p_pct_score_val': min_pct,
+                                'p_relation_name_prop': database_name_display,
+                                'p_mirna_name_tool_inputs': list(mirna_inputs),
+                                'p_target_ensembl_full_inputs': list(ensembl_inputs)
+                            })
+                    writer.flush()
+
+                relationship_counters = relation_writer.counters(RELATION_UPSERT_TEMPLATE)
+                print(f"  {species_prefix} ({current_species_name}):")
+                print(f"    Interaction pairs considered: {species_stats['considered']}")
+                print(f"    Interaction pairs skipped (unmapped miRNA): {species_stats['unmapped']}")
+                print(f"    Distinct miRNA-target relationships written: {len(pairs)}")
+                print(f"    New relationships CREATED by MERGE: {relationship_counters.get('relationships_created', 0)}")
+                print(f"    Targets created: {len(new_targets)}")
+
+        final_min_score = min_pct_score if min_pct_score != float('inf') else 0.0
+        final_max_score = max_pct_score if max_pct_score != float('-inf') else 1.0
+        create_relation_info(database_name_display, data_source_link_specific, final_min_score, final_max_score, 0.0)
+
+    except FileNotFoundError as e_file:
+        print(f"CRITICAL Error: Input TargetScan data file not found at {e_file.filename}")
         sys.exit(1)
     except Exception as e_main:
         print(f"An CRITICAL unexpected error occurred: {e_main}")
         import traceback
         traceback.print_exc()
     finally:
+        close_resolvers()
         close_driver()
 
     print("TargetScan import script finished.")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python src/targetscan_fixed.py <path_to_targetscan_Predicted_Targets_Info.txt> <species_prefix_for_miRNA (e.g., hsa)>")
+    configure_from_argv(sys.argv)
+    processes_arg, writers_arg = parse_parallel_args(sys.argv)
+    try:
+        imports_arg = parse_import_args(sys.argv[1:])
+    except ValueError as e_args:
+        if len(sys.argv) > 1: print(f"Error: {e_args}")
+        imports_arg = None
+    if not imports_arg:
+        print("Usage: python src/targetscan_fixed.py <path_to_targetscan_Predicted_Targets_Info.txt> <species_prefix_for_miRNA (e.g., hsa)> [<file> <species> ...]")
+        print("\tA TargetScan file lists the genes of one species: import mouse from the TargetScanMouse file, e.g.")
+        print("\t'Human_Predicted_Targets_Info.txt hsa Mouse_Predicted_Targets_Info.txt mmu'; known prefixes: " + ', '.join(TARGETSCAN_SPECIES))
+        print("\tOther species as <prefix>=<NCBI tax ID>:<species name>, e.g. rno=10116:'Rattus norvegicus'")
+        print("\t[--processes=<N>] parses each file in N processes, [--writers=<N>] writes over N sessions")
         sys.exit(1)
 
-    targetscan_file_arg = sys.argv[1]
-    species_prefix_for_mirna_arg = sys.argv[2]
-
-    run_targetscan_import(targetscan_file_arg, species_prefix_for_mirna_arg)
\ No newline at end of file
+    run_targetscan_import(imports_arg, processes_arg, writers_arg)
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import dbhelper
+import rna22_fixed
+from dbhelper import BulkWriter
+
+TARGET = "MERGE (t:Target {ens_code: row.ens_code})"
+RELATION = "MATCH (t:Target {ens_code: row.target}) MERGE (m)-[r:REL]->(t)"
+
+
+class FakeGraphSession:
+    """
+    Applies Target upsert rows (keyed on ens_code) as Target nodes and any other rows as relationships
+    to row['target'], created only if that Target exists, like MATCH.
+    """
+
+    def __init__(self, existing_targets=()):
+        self.targets = set(existing_targets)
+        self.relationships = set()
+        self.writes = []
+
+    def execute_write(self, work, query, rows):
+        return work(self, query, rows)
+
+    def run(self, query, rows):
+        template = query.split('\n', 1)[1]
+        self.writes.append((template, [row.get('ens_code') or row.get('target') for row in rows]))
+        created = 0
+        for row in rows:
+            if 'MERGE (t:Target' in template:
+                self.targets.add(row['ens_code'])
+            elif row['target'] in self.targets and row['target'] not in self.relationships:
+                self.relationships.add(row['target'])
+                created += 1
+        counters = SimpleNamespace(relationships_created=created)
+        return SimpleNamespace(consume=lambda: SimpleNamespace(counters=counters))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def close(self):
+        pass
+
+
+def write_rows(writer):
+    # the first row's target already exists, so RELATION is the first template added
+    writer.add(RELATION, {'target': 'ENSGOLD'})
+    writer.add(TARGET, {'ens_code': 'ENSGNEW'})
+    writer.add(RELATION, {'target': 'ENSGNEW'})
+
+
+def test_registered_templates_flush_targets_before_relationships():
+    session = FakeGraphSession(existing_targets={'ENSGOLD'})
+    with BulkWriter(session=session, batch_size=3, templates=(TARGET, RELATION)) as writer:
+        write_rows(writer)
+
+    assert session.writes == [(TARGET, ['ENSGNEW']), (RELATION, ['ENSGOLD', 'ENSGNEW'])]
+    assert session.relationships == {'ENSGOLD', 'ENSGNEW'}
+    assert writer.counters(RELATION)['relationships_created'] == 2
+
+
+def test_unregistered_templates_flush_in_first_use_order():
+    session = FakeGraphSession(existing_targets={'ENSGOLD'})
+    with BulkWriter(session=session, batch_size=3) as writer:
+        write_rows(writer)
+
+    assert session.writes == [(RELATION, ['ENSGOLD', 'ENSGNEW']), (TARGET, ['ENSGNEW'])]
+    assert session.relationships == {'ENSGOLD'}
+
+
+def test_registered_order_holds_across_batches():
+    session = FakeGraphSession(existing_targets={'ENSGOLD'})
+    with BulkWriter(session=session, batch_size=2, templates=(TARGET, RELATION)) as writer:
+        for i in range(5):
+            writer.add(RELATION, {'target': 'ENSGOLD'})
+            writer.add(TARGET, {'ens_code': f'ENSG{i}'})
+            writer.add(RELATION, {'target': f'ENSG{i}'})
+
+    assert session.relationships == {'ENSGOLD'} | {f'ENSG{i}' for i in range(5)}
+
+
+def test_rna22_import_writes_relationships_to_new_targets(tmp_path, monkeypatch):
+    tsv_file = tmp_path / 'rna22.tsv'
+    tsv_file.write_text("miRNA\ttarget\tscore\n"
+                        "hsa_miR_21_5p\tENSGOLD\t0.5\n"
+                        "hsa_miR_21_5p\tENSGNEW\t0.7\n")
+    session = FakeGraphSession(existing_targets={'ENSGOLD'})
+    for module in (dbhelper, rna22_fixed):
+        monkeypatch.setattr(module, 'db_connect', lambda: session)
+    for name in ('ensure_schema', 'create_db_info', 'create_relation_info', 'close_driver'):
+        monkeypatch.setattr(rna22_fixed, name, lambda *args: None)
+    monkeypatch.setattr(rna22_fixed, 'prefetch_targets_by_ens',
+                        lambda session, ids, sources: {'ENSGNEW': {'name': 'NEW', 'id': 1, 'species': 'Homo sapiens'}})
+    monkeypatch.setattr(rna22_fixed.MirnaResolver, 'from_graph',
+                        classmethod(lambda cls, session: SimpleNamespace(resolve_rna22=lambda name: name)))
+
+    rna22_fixed.run_rna22_import(str(tsv_file), 'RNA22')
+
+    assert session.relationships == {'ENSGOLD', 'ENSGNEW'}
@@ -2,154 +2,193 @@ import sys
 import re
 import os
 import time
-import json 
+import json
 import urllib.parse
-from download import url_request
-
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-BASE_DATA_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', 'data'))
-UNIPROT_CACHE_DIR = BASE_DATA_DIR
-UNIPROT_ENS_AC_CACHE_FILE = os.path.join(UNIPROT_CACHE_DIR, 'uniprot_ens_ac_cache.dat') 
-UNIPROT_ENTRY_CACHE_FILE = os.path.join(UNIPROT_CACHE_DIR, 'uniprot_entry_cache.dat') 
+from concurrent.futures import ThreadPoolExecutor
+import genestore
+import sprot
+from download import url_request, iter_url_pages
 
 UNIPROT_IDMAPPING_RUN_URL = "https://rest.uniprot.org/idmapping/run"
-UNIPROT_IDMAPPING_STATUS_URL_TEMPLATE = "https://rest.uniprot.org/idmapping/status/{}" 
-UNIPROT_IDMAPPING_RESULTS_URL_TEMPLATE = "https://rest.uniprot.org/idmapping/stream/{}" 
-UNIPROT_FETCH_TEXT_URL_TEMPLATE = "https://rest.uniprot.org/uniprotkb/{}.txt"
-
-def _ensure_dir_exists(file_path):
-    directory = os.path.dirname(file_path)
-    if directory and not os.path.exists(directory):
-        try: os.makedirs(directory);
-        except OSError as e: print(f"UniProt Helper: Error creating dir '{directory}': {e}"); return False
-    return True
-
-def _map_ensembl_to_uniprot_ac(ensembl_gene_id):
-    if not ensembl_gene_id: return None
-    clean_ensembl_id = ensembl_gene_id.strip().upper()
+UNIPROT_IDMAPPING_STATUS_URL_TEMPLATE = "https://rest.uniprot.org/idmapping/status/{}"
+UNIPROT_IDMAPPING_RESULTS_URL_TEMPLATE = "https://rest.uniprot.org/idmapping/uniprotkb/results/{}"
+# Gene name, GeneID and organism come back in the same TSV as the accession, so no
+# per-entry uniprotkb/{ac}.txt fetch is needed.
+UNIPROT_IDMAPPING_FIELDS = "accession,gene_primary,xref_geneid,organism_name"
+
+# IDs submitted per mapping job (the service accepts up to 100,000) and rows per result page.
+UNIPROT_IDMAPPING_BATCH_SIZE = 5000
+UNIPROT_IDMAPPING_PAGE_SIZE = 500
+UNIPROT_IDMAPPING_MAX_POLLS = 30
+# Mapping jobs run at once. They sleep between status polls, so they get their own pool rather
+# than download.get_executor(); their HTTP requests still go through the per-host rate limits.
+UNIPROT_IDMAPPING_MAX_JOBS = 4
 
-    payload = { "from": "Ensembl", "to": "UniProtKB", "ids": clean_ensembl_id }
+def _submit_idmapping_job(ensembl_ids):
+    payload = { "from": "Ensembl", "to": "UniProtKB", "ids": ",".join(ensembl_ids) }
     headers_post = {'Accept': 'application/json', 'Content-Type':'application/x-www-form-urlencoded'}
-    
-    submit_response_text = url_request(UNIPROT_IDMAPPING_RUN_URL, data_payload=payload, method="POST", headers=headers_post)
+
+    submit_response_text = url_request(UNIPROT_IDMAPPING_RUN_URL, data_payload=payload, method="POST", headers=headers_post, use_cache=False)
 
     if not submit_response_text:
-        print(f"UniProt ID Mapping: Failed to submit job for {clean_ensembl_id}.")
+        print(f"UniProt ID Mapping: Failed to submit job for {len(ensembl_ids)} IDs.")
         return None
     try:
         job_id = json.loads(submit_response_text).get("jobId")
         if not job_id:
-            print(f"UniProt ID Mapping: No jobId for {clean_ensembl_id}. Resp: {submit_response_text[:200]}")
-            return None
+            print(f"UniProt ID Mapping: No jobId returned. Resp: {submit_response_text[:200]}")
+        return job_id
     except json.JSONDecodeError:
-        print(f"UniProt ID Mapping: Could not decode jobId for {clean_ensembl_id}. Resp: {submit_response_text[:200]}")
+        print(f"UniProt ID Mapping: Could not decode jobId. Resp: {submit_response_text[:200]}")
         return None
 
+def _pause(seconds, cancel_event):
+    """Sleeps for seconds, or until cancel_event is set. Returns True if it was set."""
+    if cancel_event is None:
+        time.sleep(seconds)
+        return False
+    return cancel_event.wait(seconds)
+
+def _wait_for_idmapping_job(job_id, cancel_event=None):
+    """Polls a mapping job until it is finished. Returns True when results are ready, False if it failed or was cancelled."""
     status_url = UNIPROT_IDMAPPING_STATUS_URL_TEMPLATE.format(job_id)
     headers_get = {'Accept': 'application/json'}
-    for attempt in range(10): 
-        status_response_text = url_request(status_url, None, method="GET", headers=headers_get)
-        if not status_response_text: 
-            print(f"UniProt ID Mapping: Failed to get status for job {job_id} (attempt {attempt+1})."); 
-            if attempt == 9: return None 
-            time.sleep(3); continue
+    for attempt in range(UNIPROT_IDMAPPING_MAX_POLLS):
+        status_response_text = url_request(status_url, None, method="GET", headers=headers_get, use_cache=False)
+        if not status_response_text:
+            print(f"UniProt ID Mapping: Failed to get status for job {job_id} (attempt {attempt+1}).")
+            if _pause(3, cancel_event): return False
+            continue
 
         try:
             status_data = json.loads(status_response_text)
-            job_status = status_data.get("jobStatus")
-            if job_status == "FINISHED":
-                results_url = UNIPROT_IDMAPPING_RESULTS_URL_TEMPLATE.format(job_id) + "?format=tsv&fields=accession&size=1" 
-                results_tsv = url_request(results_url, None, method="GET", headers=headers_get)
-                if results_tsv:
-                    lines = results_tsv.strip().splitlines()
-                    if len(lines) > 1: 
-                        data_parts = lines[1].split('\t') 
-                        if len(data_parts) >= 1 and data_parts[0]: 
-                            return data_parts[0] 
-                print(f"UniProt ID Mapping: No results or format error for job {job_id}. TSV: {results_tsv[:200] if results_tsv else 'None'}")
-                return None 
-            elif job_status in ["RUNNING", "QUEUED"]: 
-                if attempt < 9: time.sleep(3 * (attempt + 1)) 
-                else: print(f"UniProt ID Mapping: Job {job_id} still running/queued after max attempts."); return None
-            else: 
-                print(f"UniProt ID Mapping: Job {job_id} failed or unexpected status: {job_status}. Info: {status_data.get('warnings') or status_data.get('errors')}")
-                return None
-        except json.JSONDecodeError: print(f"UniProt ID Mapping: Could not decode status/results for job {job_id}. Resp: {status_response_text[:200]}"); return None
-        except Exception as e_status: print(f"UniProt ID Mapping: Error checking status job {job_id}: {e_status}"); return None
-            
-    print(f"UniProt ID Mapping: Job {job_id} timed out for {clean_ensembl_id}.")
-    return None
-
-def _parse_uniprot_text_entry(entry_text, uniprot_ac_val, ensembl_id_source=None):
-    if not entry_text: return None
-    gene_info = {'name': None, 'id': '', 'embl': ensembl_id_source or '', 'species': None, 'ac': uniprot_ac_val}
-    try:
-        for line in entry_text.splitlines():
-            if line.startswith("AC   ") and not gene_info['ac']: 
-                gene_info['ac'] = line.split()[1].split(';')[0] 
-            elif line.startswith("OS   ") and not gene_info['species']:
-                match = re.match(r"OS   (.*?)(?: \(.*|$)", line) 
-                if match: gene_info['species'] = match.group(1).strip().rstrip('.')
-            elif line.startswith("GN   "): 
-                if not gene_info['name']:
-                    name_match = re.search(r"Name=([^;{]+)", line) 
-                    if name_match: gene_info['name'] = name_match.group(1).strip().upper()
-            elif line.startswith("DR   GeneID;"): 
-                if not gene_info['id']:
-                    gid_match = re.search(r"GeneID;\s*(\d+);", line)
-                    if gid_match: gene_info['id'] = gid_match.group(1)
-            elif line.startswith("DR   Ensembl;"): 
-                if not gene_info['embl'] or gene_info['embl'] == ensembl_id_source: 
-                    ensg_match = re.search(r"(ENS[A-Z]*G\d+(\.\d+)?)", line, re.IGNORECASE) 
-                    if ensg_match: gene_info['embl'] = ensg_match.group(1).upper() 
-        
-        return gene_info if gene_info['name'] and gene_info['ac'] else None
-    except Exception as e_parse: print(f"UniProt (_parse_text): Error parsing AC '{uniprot_ac_val}': {e_parse}"); return None
+        except json.JSONDecodeError: print(f"UniProt ID Mapping: Could not decode status for job {job_id}. Resp: {status_response_text[:200]}"); return False
+
+        # A finished job redirects to its first result page, which has no jobStatus.
+        job_status = status_data.get("jobStatus")
+        if job_status is None and ("results" in status_data or "failedIds" in status_data):
+            return True
+        if job_status == "FINISHED":
+            return True
+        if job_status in ["NEW", "RUNNING", "QUEUED"]:
+            if _pause(min(3 * (attempt + 1), 30), cancel_event): return False
+            continue
+        print(f"UniProt ID Mapping: Job {job_id} failed or unexpected status: {job_status}. Info: {status_data.get('warnings') or status_data.get('errors')}")
+        return False
+
+    print(f"UniProt ID Mapping: Job {job_id} still running/queued after {UNIPROT_IDMAPPING_MAX_POLLS} polls.")
+    return False
+
+def _parse_idmapping_tsv_row(row_values, column_index):
+    """Turns one result TSV row into (from_ensembl_id, gene record)."""
+    def column(name):
+        idx = column_index.get(name)
+        return row_values[idx].strip() if idx is not None and idx < len(row_values) else ''
+
+    gene_ids = [gid for gid in column('GeneID').split(';') if gid.strip()]
+    organism = re.sub(r'\s*\(.*\)\s*$', '', column('Organism'))
+    from_id = column('From').upper()
+    return from_id, {
+        'ac': column('Entry'),
+        'name': column('Gene Names (primary)').split(';')[0].strip().upper(),
+        'id': gene_ids[0].strip() if gene_ids else '',
+        'species': organism,
+        'embl': from_id,
+    }
+
+def _run_idmapping_batch(ensembl_ids, cancel_event=None):
+    """
+    Maps one batch of Ensembl gene IDs with a single job and streams its paged TSV results.
+    Every mapping is kept. Returns {ensembl_id: [records]}, or None if the job or a page failed
+    or cancel_event was set.
+    """
+    job_id = _submit_idmapping_job(ensembl_ids)
+    if not job_id or not _wait_for_idmapping_job(job_id, cancel_event):
+        return None
+
+    results_url = (UNIPROT_IDMAPPING_RESULTS_URL_TEMPLATE.format(job_id) +
+                   f"?format=tsv&fields={UNIPROT_IDMAPPING_FIELDS}&size={UNIPROT_IDMAPPING_PAGE_SIZE}")
+    mapped = {ensembl_id: [] for ensembl_id in ensembl_ids}
+    column_index = None
+    for page_text in iter_url_pages(results_url):
+        if page_text is None:
+            print(f"UniProt ID Mapping: Result page of job {job_id} could not be fetched.")
+            return None
+        if cancel_event is not None and cancel_event.is_set():
+            return None
+        for line in page_text.splitlines():
+            if not line.strip(): continue
+            row_values = line.split('\t')
+            if row_values[0] == 'From':
+                column_index = {name: idx for idx, name in enumerate(row_values)}
+                continue
+            if column_index is None: continue
+            from_id, record = _parse_idmapping_tsv_row(row_values, column_index)
+            if record['ac'] and from_id in mapped:
+                mapped[from_id].append(record)
+    return mapped
+
+def _local_sprot_records(sprot_index, clean_ensembl_id):
+    """Gene records of the local Swiss-Prot entries cross-referencing clean_ensembl_id."""
+    return [{'ac': entry['ac'], 'name': entry['name'], 'id': entry['id'], 'species': entry['species'], 'embl': clean_ensembl_id}
+            for entry in sprot_index.entries('embl', clean_ensembl_id) if entry['ac']]
+
+def map_ensembl_to_uniprot(ensembl_gene_ids, cancel_event=None):
+    """
+    Maps many Ensembl gene IDs to all their UniProtKB entries.
+    IDs found in the indexed local Swiss-Prot file or in the cache are answered locally;
+    the rest go out UNIPROT_IDMAPPING_BATCH_SIZE IDs per job. Once cancel_event is set,
+    the jobs stop polling and the IDs still unmapped are left uncached.
+    Returns {clean_ensembl_id: [records]} where each record has 'ac', 'name', 'id', 'species', 'embl'.
+    """
+    results = {}
+    to_map = []
+    sprot_index = sprot.get_default_index()
+    for ensembl_gene_id in ensembl_gene_ids:
+        if not ensembl_gene_id: continue
+        clean_ensembl_id = ensembl_gene_id.strip().upper()
+        if clean_ensembl_id in results: continue
+        results[clean_ensembl_id] = []
+
+        if sprot_index is not None:
+            local_records = _local_sprot_records(sprot_index, clean_ensembl_id)
+            if local_records:
+                results[clean_ensembl_id] = local_records
+                continue
+
+        cached_acs = genestore.lookup_uniprot_acs(clean_ensembl_id)
+        if cached_acs is genestore.MISS: continue
+        cached_records = [genestore.lookup_gene('uniprot', ac=ac) for ac in (cached_acs or [])]
+        cached_records = [record for record in cached_records if record and record is not genestore.MISS]
+        if cached_records:
+            results[clean_ensembl_id] = cached_records
+        else:
+            to_map.append(clean_ensembl_id)
+
+    batches = [to_map[i:i + UNIPROT_IDMAPPING_BATCH_SIZE] for i in range(0, len(to_map), UNIPROT_IDMAPPING_BATCH_SIZE)]
+    if len(batches) > 1:
+        print(f"UniProt ID Mapping: Mapping {len(to_map)} Ensembl IDs in {len(batches)} concurrent jobs...")
+    if not batches:
+        return results
+    with ThreadPoolExecutor(max_workers=min(len(batches), UNIPROT_IDMAPPING_MAX_JOBS),
+                            thread_name_prefix='uniprot-idmapping') as job_pool:
+        for batch, mapped in zip(batches, job_pool.map(lambda batch: _run_idmapping_batch(batch, cancel_event), batches)):
+            if mapped is None and cancel_event is not None and cancel_event.is_set():
+                continue
+            if mapped is None:
+                print(f"UniProt ID Mapping: Job for {len(batch)} IDs failed; they will be retried on the next run.")
+                continue
+            genestore.put_genes('uniprot', [record for records in mapped.values() for record in records])
+            genestore.put_uniprot_acs({ensembl_id: [record['ac'] for record in records] for ensembl_id, records in mapped.items()})
+            results.update(mapped)
+    return results
+
+def get_genes_by_ens(ensembl_gene_ids, cancel_event=None):
+    """Returns {clean_ensembl_id: first UniProt-derived gene record or None} for many Ensembl IDs."""
+    return {ensembl_id: (records[0] if records else None)
+            for ensembl_id, records in map_ensembl_to_uniprot(ensembl_gene_ids, cancel_event).items()}
 
 def get_gene_by_ens(ensembl_gene_id):
     if not ensembl_gene_id: return None
-    clean_ensembl_id = ensembl_gene_id.strip().upper() 
-    uniprot_ac = None
-
-    if _ensure_dir_exists(UNIPROT_ENS_AC_CACHE_FILE):
-        try:
-            with open(UNIPROT_ENS_AC_CACHE_FILE, 'r', encoding='utf-8') as f_c:
-                for line in f_c:
-                    parts = line.strip().split('\t')
-                    if len(parts) == 2 and parts[0].upper() == clean_ensembl_id:
-                        uniprot_ac = parts[1] if parts[1] != "NOT_MAPPED" else None; break
-        except FileNotFoundError: pass
-
-    if not uniprot_ac:
-        uniprot_ac = _map_ensembl_to_uniprot_ac(clean_ensembl_id) 
-        if _ensure_dir_exists(UNIPROT_ENS_AC_CACHE_FILE):
-            try:
-                with open(UNIPROT_ENS_AC_CACHE_FILE, 'a', encoding='utf-8') as f_c:
-                    f_c.write(f"{clean_ensembl_id}\t{uniprot_ac or 'NOT_MAPPED'}\n")
-            except IOError as e: print(f"Warning: UniProt ENS->AC Cache Write Error: {e}")
-        if not uniprot_ac: return None
-
-    if _ensure_dir_exists(UNIPROT_ENTRY_CACHE_FILE):
-        try:
-            with open(UNIPROT_ENTRY_CACHE_FILE, 'r', encoding='utf-8') as f_c:
-                for line in f_c:
-                    parts = line.strip().split('\t')
-                    if len(parts) == 5 and parts[0] == uniprot_ac:
-                        if parts[1] == "NOT_PARSED": return None
-                        return {'ac': parts[0], 'name': parts[1], 'id': parts[2], 'species': parts[3], 'embl': parts[4]}
-        except FileNotFoundError: pass
-
-    entry_url = UNIPROT_FETCH_TEXT_URL_TEMPLATE.format(urllib.parse.quote(uniprot_ac))
-    entry_text = url_request(entry_url, None, method="GET")
-    if not entry_text: print(f"UniProt: Failed to fetch entry for AC: {uniprot_ac}"); return None
-
-    parsed_info = _parse_uniprot_text_entry(entry_text, uniprot_ac, clean_ensembl_id) 
-    if _ensure_dir_exists(UNIPROT_ENTRY_CACHE_FILE):
-        try:
-            with open(UNIPROT_ENTRY_CACHE_FILE, 'a', encoding='utf-8') as f_c:
-                if parsed_info:
-                    f_c.write(f"{parsed_info.get('ac','')}\t{parsed_info.get('name','')}\t{parsed_info.get('id','')}\t{parsed_info.get('species','')}\t{parsed_info.get('embl','')}\n")
-                else:
-                    f_c.write(f"{uniprot_ac}\tNOT_PARSED\tNOT_PARSED\tNOT_PARSED\t{clean_ensembl_id}\n")
-        except IOError as e: print(f"Warning: UniProt Entry Cache Write Error: {e}")
-    return parsed_info
\ No newline at end of file
+    clean_ensembl_id = ensembl_gene_id.strip().upper()
+    return get_genes_by_ens([clean_ensembl_id]).get(clean_ensembl_id)
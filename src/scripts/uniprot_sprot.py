@@ -1,91 +1,141 @@
 import sys
 import os
-import re
-from dbhelper import db_connect
-from ncbi import get_gene_by_id, get_gene_by_name
-
-data_file = '../data/uniprot_sprot.dat'
-data_dir = '../data/uniprot_sprot/'
-
-if not os.path.exists(data_dir):
-    os.makedirs(data_dir)
-
-    with open(data_file, 'r') as f:
-        inblock = False
-        filename = None
-
-        for line in f:
-            if inblock:
-                file.write(line)
-                if line.startswith('//'):
-                    inblock = False
-                    file.close()
-
-            if line.startswith('ID'):
-                inblock = True
-                filename = data_dir + line.split()[1] + '.dat'
-                file = open(filename, 'w')
-                file.write(line)
-
-                print("Processing: " + line, end="")
-                print("to " + filename)
-
-if len(sys.argv) < 3:
-    print("Usage: " + sys.argv[0] + " <geneID> <species>")
-    print("\tto print information about a specific gene")
-    print("Usage: " + sys.argv[0] + " import <species>")
-    print("\tto import all the gene information from a species")
-    exit()
-
-species = sys.argv[2].upper()
-genes = []
-session = None
-
-if sys.argv[1] == 'import':
-    genes = [file.split('_')[0] for file in os.listdir(data_dir)
-             if file.endswith(species + '.dat')]
-
-    session = db_connect()
-else:
-    genes = [sys.argv[1].upper()]
-
-for gene in genes:
-    with open(data_dir + gene + '_' + species + '.dat', 'r') as f:
-        gene = {
-            'name'      : '',
-            'id'        : '',
-            'embl'      : '',
-            'species'   : ''
-        }
-        for line in f:
-            if gene['name'] == '' and line.startswith('ID'):
-                gene['name'] = line.split()[1].split('_')[0]
-            elif line.startswith('DR'):
-                if gene['id'] == '' and 'GeneID' in line:
-                    gene['id'] = line.split()[2][:-1]
-                elif gene['embl'] == '' and 'Ensembl' in line:
-                    gene['embl'] = line.split()[4][:-1]
-            elif gene['species'] == '' and line.startswith('OS'):
-                gene['species'] = line.split(None, 1)[1][:-2]
-
-        if gene['embl'] == '':
-            if gene['id'] != '':
-                gene = get_gene_by_id(gene['id'])
-            elif gene['name'] != '':
-                gene = get_gene_by_name(gene['name'])
-
-        if sys.argv[1] == 'import'  \
-            and gene['name'] != '' \
+from dbhelper import BulkWriter, ensure_schema
+from ncbi import get_gene_by_id, get_gene_by_name, get_genes_by_ids
+from download import configure_from_argv
+import sprot
+
+DEFAULT_BATCH_SIZE = 5000
+
+TARGET_UPSERT_TEMPLATE = """
+    MERGE (t:Target {ens_code: row.ens_code})
+    ON CREATE SET t.name = row.name, t.species = row.species, t.geneid = row.geneid, t.ncbi_link = row.geneid
+    ON MATCH SET  t.name = row.name, t.species = row.species, t.geneid = row.geneid
+"""
+
+
+def complete_gene(entry, ncbi_genes=None):
+    """
+    Returns the name/id/embl/species gene record of a parsed Swiss-Prot entry,
+    asking NCBI for the missing pieces when the entry has no Ensembl cross-reference.
+    ncbi_genes is an optional {geneid: record} already fetched for the entry's batch.
+    """
+    gene = {
+        'name'      : entry['name'],
+        'id'        : entry['id'],
+        'embl'      : entry['embl'],
+        'species'   : entry['species']
+    }
+    if gene['embl'] == '':
+        ncbi_gene = None
+        if gene['id'] != '':
+            ncbi_gene = ncbi_genes.get(gene['id']) if ncbi_genes is not None else get_gene_by_id(gene['id'])
+        elif gene['name'] != '':
+            ncbi_gene = get_gene_by_name(gene['name'])
+        if ncbi_gene:
+            gene = ncbi_gene
+    return gene
+
+
+def find_entry(data_file, gene_name, species):
+    """
+    Returns the parsed <gene_name>_<species> entry, or None.
+    Through the sidecar index (built on first use for a plain .dat) the lookup also accepts
+    a gene symbol, GeneID or accession; a gzipped file is scanned instead.
+    """
+    entry_id = f"{gene_name}_{species}".upper()
+    if not data_file.endswith('.gz'):
+        index = sprot.SprotIndex(data_file) if os.path.exists(sprot.index_path_for(data_file)) else None
+        if index is None or not index.is_current():
+            sprot.build_index(data_file)
+            index = sprot.SprotIndex(data_file)
+        matches = sprot.species_matcher(species)
+        for kind, value in (('entry_id', entry_id), ('name', gene_name), ('geneid', gene_name), ('ac', gene_name)):
+            entries = [entry for entry in index.entries(kind, value) if matches(entry)]
+            if entries:
+                return entries[0]
+        return None
+
+    for entry in sprot.iter_entries(data_file, species):
+        if entry['entry_id'] == entry_id:
+            return entry
+    return None
+
+
+def flush_targets(writer, entries):
+    """
+    Completes a batch of parsed entries (one NCBI request for all GeneIDs lacking an Ensembl ID)
+    and hands the complete genes to the bulk writer. Returns the number of Targets queued.
+    """
+    ncbi_genes = get_genes_by_ids([entry['id'] for entry in entries if entry['embl'] == '' and entry['id'] != ''])
+    queued_count = 0
+    for entry in entries:
+        gene = complete_gene(entry, ncbi_genes)
+        if gene['name'] != '' \
             and gene['id'] != '' \
             and gene['embl'] != '':
-            session.run("MERGE (n:Target {"
-                          "name: '%s',"
-                          "species: 'Homo sapiens',"
-                          "geneid: '%s',"
-                          "ens_code: '%s',"
-                          "ncbi_link: '%s'"
-                        "})" %
-                (gene['name'], gene['id'], gene['embl'], gene['id']))
-
-if session:
-    session.close()
+            writer.add(TARGET_UPSERT_TEMPLATE, {
+                'name': gene['name'],
+                'species': gene['species'] or entry['species'],
+                'geneid': gene['id'],
+                'ens_code': gene['embl'],
+            })
+            queued_count += 1
+    return queued_count
+
+
+def import_species(data_file, species, batch_size=DEFAULT_BATCH_SIZE):
+    """Streams the flat file once and upserts a Target for every complete gene of the species, batch_size at a time."""
+    ensure_schema()
+    imported_count = 0
+    scanned_count = 0
+    pending_entries = []
+    with BulkWriter(batch_size=batch_size) as writer:
+        for entry in sprot.iter_entries(data_file, species):
+            scanned_count += 1
+            pending_entries.append(entry)
+            if len(pending_entries) >= batch_size:
+                imported_count += flush_targets(writer, pending_entries)
+                pending_entries = []
+                print(f"  Processed {scanned_count} {species} entries ({imported_count} imported)...")
+        if pending_entries:
+            imported_count += flush_targets(writer, pending_entries)
+    print(f"Swiss-Prot: Imported {imported_count} of {scanned_count} {species} entries from {data_file}.")
+
+
+if __name__ == "__main__":
+    configure_from_argv(sys.argv)
+    batch_size = DEFAULT_BATCH_SIZE
+    for arg in list(sys.argv[1:]):
+        if arg.startswith('--batch-size='):
+            batch_size = max(1, int(arg.split('=', 1)[1]))
+            sys.argv.remove(arg)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == 'index':
+        data_file = sys.argv[2] if len(sys.argv) > 2 else sprot.SPROT_DAT_FILE
+        sys.exit(0 if sprot.build_index(data_file) else 1)
+
+    if len(sys.argv) < 3:
+        print("Usage: " + sys.argv[0] + " <geneID> <species> [<uniprot_sprot.dat[.gz]>]")
+        print("\tto print information about a specific gene")
+        print("Usage: " + sys.argv[0] + " import <species> [<uniprot_sprot.dat[.gz]>] [--batch-size=N]")
+        print("\tto import all the gene information from a species")
+        print("Usage: " + sys.argv[0] + " index [<uniprot_sprot.dat>]")
+        print("\tto (re)build the byte-offset index used for lookups")
+        print("\t<species> is an entry name suffix (HUMAN), an NCBI tax ID (9606) or an organism name ('Homo sapiens')")
+        exit()
+
+    species = sys.argv[2]
+    data_file = sys.argv[3] if len(sys.argv) > 3 else sprot.default_data_file()
+    if not os.path.exists(data_file):
+        print(f"Swiss-Prot data file not found: {data_file} (run fetch_sources.py uniprot_sprot)")
+        sys.exit(1)
+
+    if sys.argv[1] == 'import':
+        import_species(data_file, species, batch_size)
+    else:
+        entry = find_entry(data_file, sys.argv[1], species)
+        if entry is None:
+            print(f"No Swiss-Prot entry {sys.argv[1].upper()}_{species.upper()} in {data_file}")
+        else:
+            print(complete_gene(entry))